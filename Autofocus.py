@@ -0,0 +1,119 @@
+import math
+import threading
+import time
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+from CameraAcquisition import FrameGrabber
+
+# Sharpness of a focus frame: variance of the Laplacian of the green channel. Vectorised on the (already cropped and
+# downsampled) frame, a 512x384 crop takes about a millisecond
+def sharpness(gray):
+    image = gray.astype(np.float32)
+    laplacian = 4*image[1:-1, 1:-1] - image[:-2, 1:-1] - image[2:, 1:-1] - image[1:-1, :-2] - image[1:-1, 2:]
+    return float(laplacian.var())
+
+
+# Grabs the green channel of the central region of the next frame, downsampled
+class FocusFrameGrabber(FrameGrabber):
+    def __init__(self, roiFraction=0.5, downsample=2):
+        super().__init__()
+        self.roiFraction = roiFraction # Central part of the frame used for the sharpness
+        self.downsample = downsample
+
+    def request(self, skipFrames=1): # The first frame after a move may have been exposed while moving
+        super().request(skipFrames)
+
+    def extract(self, buf, info):
+        width, height = info.width, info.height
+        channels = buf.shape[1]//width
+        cropWidth, cropHeight = int(width*self.roiFraction), int(height*self.roiFraction)
+        x, y = (width - cropWidth)//2, (height - cropHeight)//2
+        green = buf[y:y+cropHeight:self.downsample, (x*channels + 1):(x+cropWidth)*channels:channels*self.downsample]
+        return np.array(green)
+
+
+# Z search off the UI thread. ESP301 belongs to the UI thread (serial port, timers), so every move is requested with
+# moveRequested and the UI answers with moveDone() once the controller reports the axis ready.
+# Coarse scan over the range, then golden-section search around the best coarse position until the bracket is below the
+# tolerance. Positions are only visited once, the result is the best measured position
+class AutofocusThread(QThread):
+    moveRequested = pyqtSignal(float)
+    progress = pyqtSignal(float, float) # z in mm, sharpness
+    focused = pyqtSignal(float, float, float, int) # best z, sharpness, seconds, number of moves
+    failed = pyqtSignal(str)
+
+    GOLDEN = (math.sqrt(5) - 1)/2
+
+    def __init__(self, grabber, startZ, searchRange=0.2, coarseSteps=7, tolerance=0.002, settleTime=0.05, zLimits=(0, 10), parent=None):
+        super().__init__(parent)
+        self.grabber = grabber
+        self.startZ = startZ
+        self.searchRange = searchRange # mm, centered on startZ
+        self.coarseSteps = coarseSteps
+        self.tolerance = tolerance # mm
+        self.settleTime = settleTime # s after the controller reports the move done
+        self.zLimits = zLimits
+        self.moveFinished = threading.Event()
+        self.scores = {}
+        self.moves = 0
+        self.running = True
+
+    def moveDone(self): # Called by the UI when the requested move has finished
+        self.moveFinished.set()
+
+    def measure(self, z): # Moves to z and returns the sharpness, measured positions are cached
+        z = round(min(max(z, self.zLimits[0]), self.zLimits[1]), 5)
+        if z in self.scores:
+            return self.scores[z]
+        if not self.running:
+            raise InterruptedError("autofocus stopped")
+        self.moveFinished.clear()
+        self.moveRequested.emit(z)
+        self.moves += 1
+        if not self.moveFinished.wait(10):
+            raise TimeoutError(f"move to z={z} did not finish")
+        time.sleep(self.settleTime)
+        self.grabber.request()
+        frame = self.grabber.wait()
+        if frame is None:
+            raise TimeoutError("no camera frame")
+        score = sharpness(frame)
+        self.scores[z] = score
+        self.progress.emit(z, score)
+        return score
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            # Coarse scan, always in the same direction
+            low = self.startZ - self.searchRange/2
+            step = self.searchRange/(self.coarseSteps - 1)
+            positions = [low + i*step for i in range(self.coarseSteps)]
+            scores = [self.measure(z) for z in positions]
+            best = int(np.argmax(scores))
+
+            # Golden-section search (maximum) in the bracket around the best coarse position
+            a, b = positions[max(best-1, 0)], positions[min(best+1, len(positions)-1)]
+            c = b - self.GOLDEN*(b - a)
+            d = a + self.GOLDEN*(b - a)
+            while b - a > self.tolerance:
+                if self.measure(c) > self.measure(d):
+                    b, d = d, c
+                    c = b - self.GOLDEN*(b - a)
+                else:
+                    a, c = c, d
+                    d = a + self.GOLDEN*(b - a)
+
+            bestZ = max(self.scores, key=self.scores.get)
+            self.moveFinished.clear()
+            self.moveRequested.emit(bestZ)
+            self.moves += 1
+            self.moveFinished.wait(10)
+            self.focused.emit(bestZ, self.scores[bestZ], time.perf_counter() - start, self.moves)
+        except (TimeoutError, InterruptedError) as e:
+            self.failed.emit(str(e))
+
+    def stop(self):
+        self.running = False
+        self.moveFinished.set()
+        self.wait()
@@ -0,0 +1,208 @@
+import ctypes
+import threading
+import time
+import numpy as np
+import amcam
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Ring of preallocated frame buffers shared between the acquisition thread (writer) and the UI thread (reader).
+# The writer never touches the slot the UI is reading, the UI only ever gets the newest published frame.
+# Buffers are writable numpy arrays (rows x stride), so amcam writes into them and QImage can borrow them without copying
+class FrameRingBuffer:
+    def __init__(self, count, height, stride):
+        if count < 3:
+            count = 3 # One slot being written, one published, one being displayed
+        self.buffers = [np.zeros((height, stride), dtype=np.uint8) for i in range(count)]
+        self.pointers = [buf.ctypes.data_as(ctypes.c_char_p) for buf in self.buffers] # Created once, passed to PullImageV2
+        self.seq = np.zeros(count, dtype=np.uint32) # Frame info per slot, written with the slot
+        self.timestamps = np.zeros(count, dtype=np.uint64)
+        self.pullTimes = np.zeros(count)
+        self.lock = threading.Lock()
+        self.writeIndex = -1
+        self.latestIndex = -1 # Newest published frame that has not been taken by the UI yet
+        self.readingIndex = -1 # Frame currently used by the UI
+        self.notificationPending = False
+
+        self.pulled = 0
+        self.displayed = 0
+        self.dropped = 0
+
+    def acquireWriteSlot(self): # Returns the next slot that is neither published nor being displayed
+        with self.lock:
+            index = self.writeIndex
+            for i in range(len(self.buffers)):
+                index = (index + 1) % len(self.buffers)
+                if index != self.latestIndex and index != self.readingIndex:
+                    break
+            self.writeIndex = index
+            return index, self.pointers[index]
+
+    def setFrameInfo(self, index, seq, timestamp, pullTime): # Called by the writer of the slot before publish()
+        self.seq[index] = seq
+        self.timestamps[index] = timestamp
+        self.pullTimes[index] = pullTime
+
+    def frameInfo(self, index): # (seq, sensor timestamp in us, perf_counter pull time) of a taken slot
+        return int(self.seq[index]), int(self.timestamps[index]), float(self.pullTimes[index])
+
+    def publish(self, index): # Makes the written slot the newest frame, a not displayed older frame counts as dropped
+        with self.lock:
+            self.pulled += 1
+            if self.latestIndex != -1:
+                self.dropped += 1
+            self.latestIndex = index
+            notify = not self.notificationPending
+            self.notificationPending = True
+            return notify
+
+    def takeLatest(self): # Returns (index, buffer) of the newest frame or None. Slot stays locked until release() or the next takeLatest()
+        with self.lock:
+            self.notificationPending = False
+            if self.latestIndex == -1:
+                return None
+            index = self.latestIndex
+            self.latestIndex = -1
+            self.readingIndex = index
+            self.displayed += 1
+            return index, self.buffers[index]
+
+    def release(self, index):
+        with self.lock:
+            if self.readingIndex == index:
+                self.readingIndex = -1
+
+    def counters(self):
+        with self.lock:
+            return {"pulled": self.pulled, "displayed": self.displayed, "dropped": self.dropped}
+
+    def resetCounters(self):
+        with self.lock:
+            self.pulled = 0
+            self.displayed = 0
+            self.dropped = 0
+
+
+# Worker that pulls the camera frames outside of the UI thread. The amcam callback only counts pending frames,
+# the UI is notified with frameReady at most once until it has taken the newest frame
+class CameraAcquisitionThread(QThread):
+    frameReady = pyqtSignal()
+    pullFailed = pyqtSignal(int)
+
+    def __init__(self, hcam, width, height, bufferCount=4, bits=24, metrics=None, parent=None):
+        super().__init__(parent)
+        self.hcam = hcam
+        self.w = width
+        self.h = height
+        self.bits = bits # 24 (RGB24) or 32 (RGB32), see CameraView.negotiatePixelFormat
+        self.stride = (self.w * self.bits + 31) // 32 * 4
+        self.ring = FrameRingBuffer(bufferCount, self.h, self.stride)
+        self.pendingFrames = threading.Semaphore(0)
+        self.pullInfo = amcam.AmcamFrameInfoV2(0, 0, 0, 0, 0) # seq and sensor timestamp of the last pulled frame
+        self.frameConsumers = [] # Called with (buffer, frame info, pull time) for every pulled frame, see addFrameConsumer
+        self.frameFilter = None # Modifies a pulled frame in place before it is published, see setFrameFilter
+        self.metrics = metrics # FrameMetrics fed with the sequence number and timing of every pulled frame
+        self.running = True # Cleared by stop(), also when stop() comes before run() started
+
+    def notifyFrame(self): # Called from the amcam internal threads for every AMCAM_EVENT_IMAGE
+        self.pendingFrames.release()
+
+    def run(self):
+        while self.running:
+            if not self.pendingFrames.acquire(timeout=0.1):
+                continue
+            index, pointer = self.ring.acquireWriteSlot()
+            try:
+                self.hcam.PullImageV2(pointer, self.bits, self.pullInfo)
+            except amcam.HRESULTException as ex:
+                self.pullFailed.emit(ex.hr)
+                continue
+            pullTime = time.perf_counter()
+            self.ring.setFrameInfo(index, self.pullInfo.seq, self.pullInfo.timestamp, pullTime)
+            if self.metrics is not None:
+                self.metrics.onPull(self.pullInfo.seq, self.pullInfo.timestamp, pullTime)
+            frameFilter = self.frameFilter
+            if frameFilter is not None:
+                frameFilter(self.ring.buffers[index])
+            if self.ring.publish(index):
+                self.frameReady.emit()
+            for consumer in self.frameConsumers: # The slot is only rewritten by this thread, reading it after publishing does not delay the view
+                consumer(self.ring.buffers[index], self.pullInfo, pullTime)
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+    def addFrameConsumer(self, consumer): # consumer(buffer, info, pullTime) runs in this thread and must only copy what it needs and return
+        self.frameConsumers = self.frameConsumers + [consumer] # Replaced, not modified, while run() may iterate over it
+
+    def removeFrameConsumer(self, consumer):
+        self.frameConsumers = [c for c in self.frameConsumers if c != consumer]
+
+    def setFrameFilter(self, frameFilter): # frameFilter(buffer) runs in this thread for every frame, None to remove it
+        self.frameFilter = frameFilter
+
+    def takeLatestFrame(self):
+        return self.ring.takeLatest()
+
+    def frameInfo(self, index):
+        return self.ring.frameInfo(index)
+
+    def releaseFrame(self, index):
+        self.ring.release(index)
+
+    def frameBuffers(self): # The preallocated numpy buffers of the ring, indexed like the slots of takeLatestFrame
+        return self.ring.buffers
+
+    def counters(self): # Pulled, displayed and dropped frames since start
+        return self.ring.counters()
+
+
+def frameFilterChain(filters): # One frame filter (see CameraAcquisitionThread.setFrameFilter) running filters in order, None without filters
+    if len(filters) <= 1:
+        return filters[0] if filters else None
+    def chain(buf):
+        for frameFilter in filters:
+            frameFilter(buf)
+    return chain
+
+
+# Frame consumer (see CameraAcquisitionThread.addFrameConsumer) that keeps a copy of the next frame pulled after request(),
+# for threads that need exactly one fresh frame (autofocus, stage scan). Unarmed it returns right away
+class FrameGrabber:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.grabbed = threading.Event()
+        self.armed = False
+        self.skipFrames = 0
+        self.notBefore = 0
+        self.frame = None
+
+    def request(self, skipFrames=0): # Next frame pulled after now, skipFrames: frames whose exposure may have started before
+        with self.lock:
+            self.grabbed.clear()
+            self.frame = None
+            self.skipFrames = skipFrames
+            self.notBefore = time.perf_counter()
+            self.armed = True
+
+    def wait(self, timeout=2.0): # Returns the grabbed frame or None
+        if not self.grabbed.wait(timeout):
+            with self.lock:
+                self.armed = False
+            return None
+        return self.frame
+
+    def extract(self, buf, info): # (height, width, channels) copy of the frame, the slot is reused by the acquisition thread
+        channels = buf.shape[1]//info.width
+        return np.array(buf[:, :info.width*channels].reshape(info.height, info.width, channels))
+
+    def __call__(self, buf, info, pullTime):
+        with self.lock:
+            if not self.armed or pullTime < self.notBefore:
+                return
+            if self.skipFrames > 0:
+                self.skipFrames -= 1
+                return
+            self.armed = False
+        self.frame = self.extract(buf, info)
+        self.grabbed.set()
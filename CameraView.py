@@ -1,20 +1,82 @@
-import sys, amcam
-from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt, QRect, QPoint, QPointF
+import os, sys, time, amcam
+import numpy as np
+from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt, QRect, QRectF, QPoint, QPointF, QTimer
 from PyQt5.QtGui import QPixmap, QImage, QPainter, QPen
 from PyQt5.QtWidgets import QLabel, QApplication, QWidget, QDesktopWidget, QCheckBox, QMessageBox
 from ClickableCameraLabel import ClickableCameraLabel 
+from CameraAcquisition import CameraAcquisitionThread, FrameGrabber, frameFilterChain
+from StillCapture import ImageWriterThread, StillCaptureThread
+from VideoRecorder import VideoRecorderThread
+from FrameMetrics import FrameMetrics
+from FrameAveraging import FrameAverager
+from FrameContrast import ContrastStretch
+from FlatField import FlatFieldStore, FlatFieldCorrection, ReferenceCaptureThread
+from DeviceStartup import DeviceConnectThread
 
 class CameraView(QWidget):
-    eventImage = pyqtSignal()
     clicked = pyqtSignal(str)
+    stillSaved = pyqtSignal(str)
+    recordingStopped = pyqtSignal(str)
+    flatFieldChanged = pyqtSignal(str) # state of the flat-field correction and reference captures
+    hardwareReferenceDone = pyqtSignal(int) # AMCAM_EVENT_FFC or AMCAM_EVENT_DFC, from the amcam threads
+    cameraConnected = pyqtSignal(bool, float) # camera opened and streaming, seconds it took to open
+    cameraLost = pyqtSignal(int) # AMCAM_EVENT_DISCONNECTED or AMCAM_EVENT_ERROR, from the amcam threads
+    hotPlugged = pyqtSignal() # a camera was plugged in or out (Amcam.HotPlug, not on Windows), from the amcam threads
 
-    def __init__(self):
+    def __init__(self, bufferCount=4, displayRate=30, cameraClass=None):
         super().__init__()
+        self.cameraClass = cameraClass if cameraClass is not None else amcam.Amcam # SimulatedCamera.SimulatedAmcam without hardware
         self.hcam = None
-        self.buf = None      # video buffer
+        self.cameraConnect = None # worker thread opening the camera, see initCamera
+        self.reconnecting = False # camera was lost and is reopened as soon as it is back, see cameraLostSignal
+        self.pullFailures = [] # times of the pull failures in the last second
+        self.lastWarningTime = -1e9 # message boxes are rate limited, see warn
+        self.warningOpen = False
+        self.acquisition = None # acquisition thread with the frame ring buffer
+        self.imageWriter = None # background writer for saved images
+        self.stillCapture = None # handles the still image events
+        self.recorder = None # video recording of the stream, None when not recording
+        self.recordingStateProvider = None # returns (stage position, laser on) for every recorded frame
+        self.frameConsumers = [] # get every pulled frame in the acquisition thread, kept across stream restarts
+        self.frameAverager = FrameAverager() # temporal denoising of the live frames, see setFrameAveraging
+        self.frameAveragingEnabled = False
+        self.flatFieldStore = FlatFieldStore() # dark and flat references per exposure, see setFlatFieldCorrection
+        self.flatField = FlatFieldCorrection()
+        self.flatFieldEnabled = False
+        self.flatFieldPaths = None # references loaded for the current exposure and frame size
+        self.hardwareFlatField = False # camera with its own FFC/DFC, references are imported instead of applied in software
+        self.referenceCapture = None
+        self.referenceGrabber = None
+        self.pendingHardwareReference = None # kind of the running FfcOnce/DfcOnce
+        self.contrastStretch = None # ContrastStretch of the displayed frames, see setContrastStretch
+        self.stretchBuffer = None # display buffer of the stretched frame and the QImage borrowing it
+        self.stretchImage = None
+        self.bufferCount = bufferCount
+        self.camname = ''
         self.w = 0           # video width
         self.h = 0           # video height
+        self.sensorWidth = 0 # full sensor width, the video can be smaller with a focus window
+        self.sensorHeight = 0
+        self.focusWindow = None # QRect in sensor pixels the camera is restricted to (hardware ROI), None for the full sensor
+        self.binning = 1
+        self.bits = 24       # pixel format negotiated with the camera
+        self.imageFormat = QImage.Format_RGB888
+        self.frameImages = [] # one QImage per ring buffer slot, borrowing the slot memory
         self.total = 0
+        self.metrics = FrameMetrics() # sequence gaps and sensor -> pull -> paint latencies
+        self.presentedFrameInfo = None # (seq, timestamp, pullTime) of the frame waiting to be painted
+        self.hudEnabled = False
+
+        # Presentation scheduler: repaints are capped to the display rate, acquisition keeps running at sensor speed
+        self.presentTimer = QTimer(self)
+        self.presentTimer.setSingleShot(True)
+        self.presentTimer.timeout.connect(self.presentFrame)
+        self.lastPresentTime = 0
+        self.setDisplayRate(displayRate)
+        self.fpsTimer = QTimer(self)
+        self.fpsTimer.timeout.connect(self.updateFpsReadout)
+        self.lastFpsCounters = None
+        self.lastFpsTime = 0
 
         screen_size = QApplication.primaryScreen().availableGeometry()
         max_height = int(screen_size.height()*0.93)
@@ -25,70 +87,625 @@ class CameraView(QWidget):
         centerPoint = QDesktopWidget().availableGeometry().center()
         qtRectangle.moveCenter(centerPoint)
         self.move(qtRectangle.topLeft())
+        self.reconnectTimer = QTimer(self) # Retries opening a lost camera, also where there are no hot plug notifications
+        self.reconnectTimer.timeout.connect(self.reconnectCamera)
         self.initUI()
         self.initCamera()
+        try:
+            self.cameraClass.HotPlug(self.hotPlugged.emit)
+        except (amcam.HRESULTException, OSError, AttributeError): # Windows, or a library without Amcam_HotPlug: a lost camera is only noticed by its events and found again by the reconnect timer
+            pass
 
     def initUI(self):
         self.cb = QCheckBox('Auto Exposure', self)
         self.cb.stateChanged.connect(self.changeAutoExposure)
         self.imageLabel = ClickableCameraLabel(self)
-        self.imageLabel.setScaledContents(True)
         self.imageLabel.move(0, 0)
         self.imageLabel.resize(self.geometry().width(), self.geometry().height())
+        self.imageLabel.framePainted.connect(self.framePaintedSignal)
+        self.hardwareReferenceDone.connect(self.hardwareReferenceSignal)
+        self.cameraLost.connect(self.cameraLostSignal)
+        self.hotPlugged.connect(self.hotPluggedSignal)
 
-# the vast majority of callbacks come from amcam.dll/so/dylib internal threads, so we use qt signal to post this event to the UI thread  
+# the vast majority of callbacks come from amcam.dll/so/dylib internal threads, only wake up the acquisition thread which pulls the frame
     @staticmethod
     def cameraCallback(nEvent, ctx):
         if nEvent == amcam.AMCAM_EVENT_IMAGE:
-            ctx.eventImage.emit()
+            if ctx.acquisition is not None:
+                ctx.acquisition.notifyFrame()
+        elif nEvent == amcam.AMCAM_EVENT_STILLIMAGE:
+            if ctx.stillCapture is not None:
+                ctx.stillCapture.notifyStill()
+        elif nEvent in (amcam.AMCAM_EVENT_FFC, amcam.AMCAM_EVENT_DFC):
+            ctx.hardwareReferenceDone.emit(nEvent)
+        elif nEvent in (amcam.AMCAM_EVENT_DISCONNECTED, amcam.AMCAM_EVENT_ERROR):
+            ctx.cameraLost.emit(nEvent)
+
+    def setDisplayRate(self, rate): # Maximum repaints per second, None or 0 uses the refresh rate of the screen
+        if not rate:
+            rate = QApplication.primaryScreen().refreshRate()
+        self.displayRate = rate
+        self.presentInterval = 1/rate
 
-# run in the UI thread
+# run in the UI thread, a new frame is presented right away if the last repaint is older than the display interval,
+# otherwise once the interval is over. Frames arriving meanwhile are dropped by the ring buffer
     @pyqtSlot()
     def eventImageSignal(self):
-        if self.hcam is not None:
+        if self.acquisition is None or self.presentTimer.isActive():
+            return
+        remaining = self.lastPresentTime + self.presentInterval - time.perf_counter()
+        if remaining <= 0:
+            self.presentFrame()
+        else:
+            self.presentTimer.start(int(remaining*1000)+1)
+
+    @pyqtSlot()
+    def presentFrame(self): # only the newest pulled frame is shown
+        if self.acquisition is None:
+            return
+        frame = self.acquisition.takeLatestFrame()
+        if frame is None:
+            return
+        self.lastPresentTime = time.perf_counter()
+        index, buf = frame
+        self.total += 1
+        self.presentedFrameInfo = self.acquisition.frameInfo(index)
+        if self.contrastStretch is not None:
+            self.imageLabel.setFrame(self.stretchFrame(buf))
+            self.acquisition.releaseFrame(index) # The label shows the display buffer, the slot is free again
+            return
+        # The slot stays locked for the label until the next frame is taken, so the QImage can borrow its memory
+        self.imageLabel.setFrame(self.frameImages[index])
+
+    def stretchFrame(self, buf): # Contrast stretched copy of the frame in the display buffer, allocated once per stream
+        if self.stretchBuffer is None or self.stretchBuffer.shape != buf.shape:
+            self.stretchBuffer = np.empty_like(buf)
+            self.stretchImage = QImage(self.stretchBuffer.data, self.w, self.h, self.acquisition.stride, self.imageFormat)
+        self.contrastStretch(buf, self.stretchBuffer, self.w, self.h, self.bits//8)
+        return self.stretchImage
+
+    def setContrastStretch(self, enabled): # Live view with per channel levels stretched to full scale, the frames themselves are not changed
+        self.contrastStretch = ContrastStretch() if enabled else None # The display buffer is kept until the stream stops, the label may still show it
+
+    @pyqtSlot()
+    def framePaintedSignal(self):
+        if self.presentedFrameInfo is None:
+            return
+        seq, timestamp, pullTime = self.presentedFrameInfo
+        self.presentedFrameInfo = None
+        self.metrics.onPaint(timestamp, pullTime, time.perf_counter())
+
+    @pyqtSlot(int)
+    def pullFailedSignal(self, hr):
+        now = time.perf_counter()
+        self.pullFailures = [t for t in self.pullFailures if now - t < 1.0] + [now]
+        if len(self.pullFailures) >= 5: # Every pull fails: the camera is gone, even if it did not raise an event
+            self.pullFailures = []
+            self.cameraLostSignal(amcam.AMCAM_EVENT_ERROR)
+            return
+        self.warn('pull image failed, hr=0x{:x}'.format(hr))
+
+    def warn(self, message, interval=30): # At most one message box every interval seconds and never two at once, the others are printed
+        now = time.perf_counter()
+        if self.warningOpen or now - self.lastWarningTime < interval:
+            print(f"[Camera] {message}")
+            return
+        self.lastWarningTime = now
+        self.warningOpen = True
+        QMessageBox.warning(self, '', message, QMessageBox.Ok)
+        self.warningOpen = False
+
+    def frameCounters(self): # Pulled, displayed and dropped frames of the acquisition thread
+        if self.acquisition is None:
+            return {"pulled": 0, "displayed": 0, "dropped": 0}
+        return self.acquisition.counters()
+
+    def updateFpsReadout(self): # Once per second: camera and display frame rate in the window title
+        counters = self.frameCounters()
+        now = time.perf_counter()
+        if self.lastFpsCounters is not None:
+            elapsed = now - self.lastFpsTime
+            cameraFps = (counters["pulled"] - self.lastFpsCounters["pulled"])/elapsed
+            displayFps = (counters["displayed"] - self.lastFpsCounters["displayed"])/elapsed
+            self.setWindowTitle('{}: {:.1f} fps, display {:.1f} fps'.format(self.camname, cameraFps, displayFps))
+            if self.hudEnabled:
+                self.imageLabel.setHud(self.hudLines(cameraFps, displayFps))
+        self.lastFpsCounters = counters
+        self.lastFpsTime = now
+        if self.flatFieldEnabled:
+            self.loadFlatField() # Follows the exposure, only reloads if another reference is the nearest
+
+    def frameMetrics(self): # Received and lost frames (sequence gaps) and latency summaries (count, mean, p50, p95, p99, max in ms)
+        return self.metrics.snapshot()
+
+    def frameLatencyHistograms(self): # Bin counts of the sensor -> pull, pull -> paint and sensor -> paint latencies
+        return self.metrics.histograms()
+
+    def resetFrameMetrics(self):
+        self.metrics.reset()
+
+    def setHudEnabled(self, enabled): # On-screen frame rate, lost frames and latency readout, updated once per second
+        self.hudEnabled = enabled
+        self.imageLabel.setHud(self.hudLines() if enabled else None)
+
+    def hudLines(self, cameraFps=0.0, displayFps=0.0):
+        metrics = self.frameMetrics()
+        lines = [f"camera {cameraFps:5.1f} fps  display {displayFps:5.1f} fps",
+                 f"received {metrics['received']}  lost {metrics['lost']} ({metrics['gaps']} gaps)"]
+        for name, key in (("sensor->pull ", "sensorToPull_ms"), ("pull->paint  ", "pullToPaint_ms"), ("sensor->paint", "sensorToPaint_ms")):
+            latency = metrics[key]
+            lines.append(f"{name} p50 {latency['p50']:5.1f}  p95 {latency['p95']:5.1f}  max {latency['max']:6.1f} ms")
+        return lines
+
+    def initCamera(self): # Enumerating and opening the camera can take seconds: done by a worker thread, the view shows the state meanwhile
+        if not self.reconnecting:
+            self.setWindowTitle('Connecting to camera...')
+            self.imageLabel.setStatusText('Connecting to camera...')
+        self.cb.setEnabled(False)
+        self.cameraConnect = DeviceConnectThread("camera", self.openCamera, (amcam.HRESULTException,))
+        self.cameraConnect.connected.connect(self.cameraOpenedSignal)
+        self.cameraConnect.failed.connect(self.cameraOpenFailedSignal)
+        self.cameraConnect.start()
+
+    def openCamera(self): # Runs in the worker thread: (name, camera or None if it could not be opened, sensor size), None without camera
+        a = self.cameraClass.EnumV2()
+        if len(a) <= 0:
+            return None
+        hcam = self.cameraClass.Open(a[0].id)
+        return (a[0].displayname, hcam, hcam.get_Size() if hcam is not None else None)
+
+    @pyqtSlot(str, object, float)
+    def cameraOpenedSignal(self, name, result, seconds):
+        self.cameraConnect.wait() # Returns right after the signal, the thread must not be deleted while it runs
+        self.cameraConnect = None
+        if result is None or result[1] is None:
+            if self.reconnecting: # Not back yet, the reconnect timer tries again
+                return
+            self.setWindowTitle('No camera found' if result is None else 'failed to open camera')
+            self.imageLabel.setStatusText('No camera found' if result is None else 'Camera could not be opened')
+            self.cameraConnected.emit(False, seconds)
+            return
+        self.camname, self.hcam, (self.sensorWidth, self.sensorHeight) = result
+        self.setWindowTitle(self.camname)
+        self.imageLabel.setStatusText(None)
+        self.cb.setEnabled(True)
+        if self.reconnecting: # Settings of the lost camera
+            self.hcam.put_AutoExpoEnable(self.cb.isChecked())
+        else:
+            self.cb.setChecked(self.hcam.get_AutoExpoEnable())            
+        self.hardwareFlatField = self.supportsHardwareFlatField()
+        try:
+            if self.reconnecting:
+                self.restoreFocusWindow()
+            self.negotiatePixelFormat()
+            self.startStillCapture()
+            self.startStream()
+            self.fpsTimer.start(1000)
+            self.hcam.put_TempTint(14976, 860)
+        except amcam.HRESULTException as ex:
+            if self.reconnecting: # Half there (still enumerating on the bus): closed and tried again
+                self.teardownCamera()
+                return
+            QMessageBox.warning(self, '', 'failed to start camera, hr=0x{:x}'.format(ex.hr), QMessageBox.Ok)
+            self.cameraConnected.emit(False, seconds)
+            return
+        if self.reconnecting:
+            print(f"[Camera] {self.camname} reconnected")
+            self.reconnecting = False
+            self.reconnectTimer.stop()
+        self.cameraConnected.emit(True, seconds)
+
+    @pyqtSlot(str, object, float)
+    def cameraOpenFailedSignal(self, name, error, seconds):
+        self.cameraConnect.wait()
+        self.cameraConnect = None
+        if self.reconnecting:
+            return
+        self.setWindowTitle('failed to open camera')
+        self.imageLabel.setStatusText('Camera could not be opened')
+        QMessageBox.warning(self, '', 'failed to open camera, hr=0x{:x}'.format(error.hr), QMessageBox.Ok)
+        self.cameraConnected.emit(False, seconds)
+
+    @pyqtSlot(int)
+    def cameraLostSignal(self, event): # Unplugged or USB error: everything using the camera is stopped and it is reopened in the background
+        if self.hcam is None:
+            return
+        print(f"[Camera] {self.camname} {'disconnected' if event == amcam.AMCAM_EVENT_DISCONNECTED else 'failed'}, reconnecting")
+        self.teardownCamera()
+        self.reconnecting = True
+        self.setWindowTitle('Camera disconnected')
+        self.imageLabel.setStatusText('Camera disconnected, reconnecting...')
+        self.reconnectTimer.start(2000)
+
+    @pyqtSlot()
+    def hotPluggedSignal(self): # A camera came or went: a lost one is tried right away instead of at the next retry
+        if self.reconnecting:
+            self.reconnectCamera()
+
+    def reconnectCamera(self):
+        if self.reconnecting and self.hcam is None and self.cameraConnect is None:
+            self.initCamera()
+
+    def teardownCamera(self): # Stops everything using the camera handle and closes it. Frame consumers, filters and the focus window are kept
+        self.presentTimer.stop()
+        self.fpsTimer.stop()
+        self.stopRecording()
+        if self.referenceCapture is not None:
+            self.referenceCapture.stop()
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.acquisition = None
+        self.imageLabel.clearFrame()
+        self.presentedFrameInfo = None
+        self.frameImages = []
+        self.stretchImage = None
+        self.stretchBuffer = None
+        if self.stillCapture is not None:
+            self.stillCapture.stop()
+            self.stillCapture = None
+        if self.imageWriter is not None:
+            self.imageWriter.stop()
+            self.imageWriter = None
+        hcam, self.hcam = self.hcam, None
+        self.cb.setEnabled(False)
+        try:
+            hcam.Close()
+        except amcam.HRESULTException:
+            pass
+
+    def restoreFocusWindow(self): # ROI and binning of the lost camera on the reopened one
+        if self.focusWindow is not None:
+            self.hcam.put_Roi(self.focusWindow.x(), self.focusWindow.y(), self.focusWindow.width(), self.focusWindow.height())
+        if self.binning > 1:
+            self.hcam.put_Option(amcam.AMCAM_OPTION_BINNING, 0x80 | self.binning)
+
+    def startStream(self): # Allocate the ring buffer for the current video size (after ROI and binning) and start pulling
+        self.w, self.h = self.hcam.get_FinalSize()
+        self.metrics.streamRestarted()
+        self.lastFpsCounters = None # The counters start over with the new ring buffer
+        self.acquisition = CameraAcquisitionThread(self.hcam, self.w, self.h, self.bufferCount, self.bits, self.metrics)
+        self.acquisition.frameReady.connect(self.eventImageSignal)
+        self.acquisition.pullFailed.connect(self.pullFailedSignal)
+        for consumer in self.frameConsumers:
+            self.acquisition.addFrameConsumer(consumer)
+        self.frameAverager.reset()
+        self.flatFieldPaths = None # References of the new frame size
+        if self.flatFieldEnabled:
+            self.loadFlatField()
+        self.updateFrameFilter()
+        stride = self.acquisition.stride
+        self.frameImages = [QImage(buf.data, self.w, self.h, stride, self.imageFormat) for buf in self.acquisition.frameBuffers()]
+        self.imageLabel.setSensorGeometry(self.sensorWidth, self.sensorHeight, QRectF(self.focusWindow) if self.focusWindow is not None else None)
+        self.acquisition.start()
+        self.hcam.StartPullModeWithCallback(self.cameraCallback, self)
+
+    def startStillCapture(self):
+        self.imageWriter = ImageWriterThread()
+        self.imageWriter.imageSaved.connect(self.stillSaved)
+        self.imageWriter.imageFailed.connect(self.stillFailedSignal)
+        stillWidth, stillHeight = self.hcam.get_StillResolution(0)
+        self.stillCapture = StillCaptureThread(self.hcam, stillWidth, stillHeight, self.bits, self.imageFormat, self.imageWriter)
+        self.stillCapture.captureFailed.connect(self.stillFailedSignal)
+        self.imageWriter.start()
+        self.stillCapture.start()
+
+    def stillMetadata(self): # Stage position and exposure at the moment of the snap
+        metadata = {
+            "time": time.time(),
+            "stageX_mm": self.imageLabel.currentPosition[0],
+            "stageY_mm": self.imageLabel.currentPosition[1],
+            "stageZ_mm": self.imageLabel.currentPosition[2],
+            "pixelSize_mm": self.imageLabel.pixel_size,
+            "camera": self.camname,
+        }
+        try:
+            metadata["exposureTime_us"] = self.hcam.get_ExpoTime()
+            metadata["analogGain"] = self.hcam.get_ExpoAGain()
+            metadata["autoExposure"] = bool(self.hcam.get_AutoExpoEnable())
+        except amcam.HRESULTException:
+            pass
+        return metadata
+
+    def captureStill(self): # Full resolution snap, pulled and written (TIFF) in background threads. False without camera
+        if self.hcam is None or self.stillCapture is None:
+            return False
+        try:
+            self.stillCapture.capture(self.stillMetadata())
+        except amcam.HRESULTException as ex:
+            QMessageBox.warning(self, '', 'failed to capture still image, hr=0x{:x}'.format(ex.hr), QMessageBox.Ok)
+            return False
+        return True
+
+    @pyqtSlot(str)
+    def stillFailedSignal(self, message):
+        print(f"[Still Capture] {message}")
+
+    def addFrameConsumer(self, consumer): # consumer(buffer, info, pullTime) is called in the acquisition thread for every pulled frame
+        self.frameConsumers.append(consumer)
+        if self.acquisition is not None:
+            self.acquisition.addFrameConsumer(consumer)
+
+    def removeFrameConsumer(self, consumer):
+        if consumer in self.frameConsumers:
+            self.frameConsumers.remove(consumer)
+        if self.acquisition is not None:
+            self.acquisition.removeFrameConsumer(consumer)
+
+    def setFrameAveraging(self, frames): # Exponential average of about frames frames in the acquisition thread, 0 or 1 switches it off
+        self.frameAveragingEnabled = frames > 1
+        if self.frameAveragingEnabled:
+            self.frameAverager.setFrames(frames)
+        self.updateFrameFilter()
+
+    def updateFrameFilter(self): # Flat-field correction first, the average is taken of the corrected frames
+        filters = []
+        if self.referenceCapture is None: # References are captured from raw frames, neither corrected nor averaged
+            if self.flatFieldEnabled and not self.hardwareFlatField:
+                filters.append(self.flatField)
+            if self.frameAveragingEnabled:
+                filters.append(self.frameAverager)
+        if self.acquisition is not None:
+            self.acquisition.setFrameFilter(frameFilterChain(filters))
+
+    def exposureSetting(self): # (exposure time in us, analog gain in percent) the references are stored for
+        try:
+            return (self.hcam.get_ExpoTime(), self.hcam.get_ExpoAGain())
+        except amcam.HRESULTException:
+            return (0, 100)
+
+    def supportsHardwareFlatField(self):
+        try:
+            self.hcam.get_Option(amcam.AMCAM_OPTION_FFC)
+            self.hcam.get_Option(amcam.AMCAM_OPTION_DFC)
+        except amcam.HRESULTException:
+            return False
+        return True
+
+    def setFlatFieldCorrection(self, enabled): # Dark and flat correction with the references of the nearest exposure
+        self.flatFieldEnabled = enabled
+        self.flatFieldPaths = None
+        if self.hcam is None:
+            return
+        if enabled:
+            self.loadFlatField()
+        elif self.hardwareFlatField:
             try:
-                self.hcam.PullImageV2(self.buf, 24, None)
-                self.total += 1
+                self.hcam.put_Option(amcam.AMCAM_OPTION_FFC, 0)
+                self.hcam.put_Option(amcam.AMCAM_OPTION_DFC, 0)
             except amcam.HRESULTException as ex:
-                QMessageBox.warning(self, '', 'pull image failed, hr=0x{:x}'.format(ex.hr), QMessageBox.Ok)
-            else:
-                self.setWindowTitle('{}: {}'.format(self.camname, self.total))
-                img = QImage(self.buf, self.w, self.h, (self.w * 24 + 31) // 32 * 4, QImage.Format_RGB888)
-                
-                pixmap = QPixmap.fromImage(img)
-                self.imageLabel.setPixmap(pixmap)
-
-    def initCamera(self):
-        a = amcam.Amcam.EnumV2()
-        if len(a) <= 0:
-            self.setWindowTitle('No camera found')
-            self.cb.setEnabled(False)
+                self.flatFieldChanged.emit('hardware correction not switched off, hr=0x{:x}'.format(ex.hr))
+        self.updateFrameFilter()
+        if not enabled:
+            self.flatFieldChanged.emit("Off")
+
+    def loadFlatField(self): # Loads (or imports into the camera) the references for the current exposure if they changed
+        if self.hcam is None or self.referenceCapture is not None or self.pendingHardwareReference is not None:
+            return
+        exposure = self.exposureSetting()
+        extensions = ("dfc", "ffc") if self.hardwareFlatField else ("npy", "npy")
+        paths = (self.flatFieldStore.find("dark", *exposure, self.w, self.h, extensions[0]),
+                 self.flatFieldStore.find("flat" if self.hardwareFlatField else "gain", *exposure, self.w, self.h, extensions[1]))
+        if paths == self.flatFieldPaths:
+            return
+        self.flatFieldPaths = paths
+        darkPath, flatPath = paths
+        if self.hardwareFlatField:
+            try:
+                for path, importReference, option in ((darkPath, self.hcam.DfcImport, amcam.AMCAM_OPTION_DFC), (flatPath, self.hcam.FfcImport, amcam.AMCAM_OPTION_FFC)):
+                    if path is not None:
+                        importReference(path)
+                    self.hcam.put_Option(option, 1 if path is not None else 0)
+            except amcam.HRESULTException as ex:
+                self.flatFieldChanged.emit('references not imported, hr=0x{:x}'.format(ex.hr))
+                return
         else:
-            self.camname = a[0].displayname
-            self.setWindowTitle(self.camname)
-            self.eventImage.connect(self.eventImageSignal)
+            self.flatField.setReferences(np.load(darkPath, mmap_mode="r") if darkPath is not None else None, np.load(flatPath, mmap_mode="r") if flatPath is not None else None)
+            self.updateFrameFilter()
+        names = [os.path.basename(path) for path in paths if path is not None]
+        self.flatFieldChanged.emit(("Hardware: " if self.hardwareFlatField else "Software: ") + (", ".join(names) if names else f"no references for {self.w}x{self.h}"))
+
+    def captureReference(self, kind, frames=16): # kind "dark" (light blocked) or "flat" (blank substrate, defocused), False if busy
+        if self.hcam is None or self.acquisition is None or self.referenceCapture is not None or self.pendingHardwareReference is not None:
+            return False
+        if self.hardwareFlatField: # The camera averages the frames itself, the reference is exported when it reports the new state
             try:
-                self.hcam = amcam.Amcam.Open(a[0].id)
+                if kind == "flat":
+                    self.hcam.put_Option(amcam.AMCAM_OPTION_FFC, 0xff000000 | frames)
+                    self.hcam.FfcOnce()
+                else:
+                    self.hcam.put_Option(amcam.AMCAM_OPTION_DFC, 0xff000000 | frames)
+                    self.hcam.DfcOnce()
             except amcam.HRESULTException as ex:
-                QMessageBox.warning(self, '', 'failed to open camera, hr=0x{:x}'.format(ex.hr), QMessageBox.Ok)
+                self.flatFieldChanged.emit('{} reference failed, hr=0x{:x}'.format(kind, ex.hr))
+                return False
+            self.pendingHardwareReference = (kind, self.exposureSetting())
+            self.flatFieldChanged.emit(f"Capturing {kind} reference...")
+            return True
+        self.referenceGrabber = FrameGrabber()
+        self.addFrameConsumer(self.referenceGrabber)
+        self.referenceCapture = ReferenceCaptureThread(kind, self.referenceGrabber, self.flatFieldStore, self.exposureSetting(), frames)
+        self.referenceCapture.captured.connect(lambda kind, key: self.flatFieldChanged.emit(f"Saved {kind} reference {key}"))
+        self.referenceCapture.failed.connect(lambda message: self.flatFieldChanged.emit(f"Reference not captured: {message}"))
+        self.referenceCapture.finished.connect(self.referenceCaptureFinished)
+        self.updateFrameFilter()
+        self.flatFieldChanged.emit(f"Capturing {kind} reference...")
+        self.referenceCapture.start()
+        return True
+
+    def referenceCaptureFinished(self):
+        self.removeFrameConsumer(self.referenceGrabber)
+        self.referenceCapture = None
+        self.referenceGrabber = None
+        self.flatFieldPaths = None
+        if self.flatFieldEnabled:
+            self.loadFlatField()
+        self.frameAverager.reset() # The average restarts from the first filtered frame
+        self.updateFrameFilter()
+
+    @pyqtSlot(int)
+    def hardwareReferenceSignal(self, event): # FfcOnce/DfcOnce done: export the reference of the camera for its exposure
+        if self.pendingHardwareReference is None or self.hcam is None:
+            return
+        kind, exposure = self.pendingHardwareReference
+        self.pendingHardwareReference = None
+        key = self.flatFieldStore.key(*exposure, self.w, self.h)
+        path = self.flatFieldStore.path(kind, key, "ffc" if kind == "flat" else "dfc")
+        try:
+            os.makedirs(self.flatFieldStore.directory, exist_ok=True)
+            if kind == "flat":
+                self.hcam.FfcExport(path)
+            else:
+                self.hcam.DfcExport(path)
+        except (amcam.HRESULTException, OSError) as e:
+            self.flatFieldChanged.emit(f"{kind} reference not exported: {e}")
+            return
+        self.flatFieldPaths = None
+        self.flatFieldChanged.emit(f"Saved {kind} reference {key}")
+        if self.flatFieldEnabled:
+            self.loadFlatField()
+
+    def setStageMoving(self, moving): # Averaging restarts after every move and is bypassed while the stage moves
+        self.frameAverager.hold = moving
+        self.frameAverager.reset()
+
+    def startRecording(self, directory=None): # Records every pulled frame with its sequence number, timestamp, stage position and laser state
+        if self.acquisition is None or self.recorder is not None:
+            return False
+        if directory is None:
+            directory = os.path.join("Recordings", time.strftime("run_%Y%m%d_%H%M%S"))
+        self.recorder = VideoRecorderThread(directory, self.w, self.h, self.acquisition.stride, self.bits, self.recordingStateProvider)
+        self.recorder.recordingFailed.connect(self.recordingFailedSignal)
+        self.recorder.start()
+        self.addFrameConsumer(self.recorder.record)
+        return True
+
+    def stopRecording(self): # Returns the directory of the finished recording, None if there was none
+        if self.recorder is None:
+            return None
+        self.removeFrameConsumer(self.recorder.record)
+        self.recorder.stop() # Writes the queued frames and the index
+        directory = self.recorder.directory
+        counters = self.recorder.counters()
+        self.recorder = None
+        print(f"[Recording] {directory}: {counters['recorded']} frames, {counters['skipped']} skipped")
+        self.recordingStopped.emit(directory)
+        return directory
+
+    def isRecording(self):
+        return self.recorder is not None
+
+    @pyqtSlot(str)
+    def recordingFailedSignal(self, message):
+        print(f"[Recording] {message}")
+
+    def stopStream(self):
+        self.presentTimer.stop()
+        self.stopRecording() # A recording has a fixed frame size
+        self.hcam.Stop()
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.acquisition = None
+        self.imageLabel.clearFrame() # The label must not keep borrowing the old buffers
+        self.stretchImage = None
+        self.stretchBuffer = None
+        self.presentedFrameInfo = None
+        self.frameImages = []
+
+    def setFocusWindow(self, rect=None, binning=1): # Restrict acquisition to rect (sensor pixels) with optional binning, rect None streams the full sensor
+        if self.hcam is None:
+            return False
+        if rect is not None:
+            rect = QRectF(rect).toAlignedRect().intersected(QRect(0, 0, self.sensorWidth, self.sensorHeight))
+            # Hardware ROI: offsets and sizes must be even numbers
+            x = rect.x() & ~1
+            y = rect.y() & ~1
+            w = max(16, min(rect.width(), self.sensorWidth - x)) & ~1
+            h = max(16, min(rect.height(), self.sensorHeight - y)) & ~1
+            rect = QRect(x, y, w, h)
+        self.stopStream()
+        try:
+            if rect is None:
+                self.hcam.put_Roi(0, 0, 0, 0)
             else:
-                self.w, self.h = self.hcam.get_Size()
-                bufsize = ((self.w * 24 + 31) // 32 * 4) * self.h
-                self.buf = bytes(bufsize)
-                self.cb.setChecked(self.hcam.get_AutoExpoEnable())            
-                try:
-                    if sys.platform == 'win32':
-                        self.hcam.put_Option(amcam.AMCAM_OPTION_BYTEORDER, 0) # QImage.Format_RGB888
-                    self.hcam.StartPullModeWithCallback(self.cameraCallback, self)
-                    self.hcam.put_TempTint(14976, 860)
-                except amcam.HRESULTException as ex:
-                    QMessageBox.warning(self, '', 'failed to start camera, hr=0x{:x}'.format(ex.hr), QMessageBox.Ok)
+                self.hcam.put_Roi(rect.x(), rect.y(), rect.width(), rect.height())
+            self.hcam.put_Option(amcam.AMCAM_OPTION_BINNING, (0x80 | binning) if binning > 1 else 1) # Average binning keeps the brightness
+            self.focusWindow = rect
+            self.binning = binning
+        except amcam.HRESULTException as ex:
+            QMessageBox.warning(self, '', 'failed to set focus window, hr=0x{:x}'.format(ex.hr), QMessageBox.Ok)
+        try:
+            self.startStream()
+        except amcam.HRESULTException as ex:
+            QMessageBox.warning(self, '', 'failed to start camera, hr=0x{:x}'.format(ex.hr), QMessageBox.Ok)
+            return False
+        return True
+
+    def focusOnDesign(self, margin=150, binning=1): # Focus window around the active design, False if there is no design
+        rect = self.imageLabel.designBoundingRect(margin)
+        if rect is None:
+            return False
+        return self.setFocusWindow(rect, binning)
+
+    def setTriggerMode(self, enabled): # Software trigger: the camera only delivers a frame per triggerFrame(). False if not supported
+        if self.hcam is None:
+            return False
+        try:
+            self.hcam.put_Option(amcam.AMCAM_OPTION_TRIGGER, 1 if enabled else 0)
+        except amcam.HRESULTException:
+            return False
+        return True
+
+    def triggerFrame(self): # Can be called from any thread
+        self.hcam.Trigger(1)
+
+    def frameToStage(self): # (x0, y0, mm per pixel) of the current frame: stage position of pixel (x, y) is (x0 + x*scale, y0 - y*scale)
+        label = self.imageLabel
+        left, top = (self.focusWindow.x(), self.focusWindow.y()) if self.focusWindow is not None else (0, 0)
+        x0, y0 = label.sensorTransform().toStage((left, top)).tolist()
+        return (x0, y0, label.pixel_size*self.binning)
+
+    def negotiatePixelFormat(self): # RGB32 (BGRX in memory) is QImage.Format_RGB32 and is painted without conversion, otherwise RGB24
+        try:
+            self.hcam.put_Option(amcam.AMCAM_OPTION_BYTEORDER, 1)
+            self.hcam.put_Option(amcam.AMCAM_OPTION_RGB, 2)
+            self.bits = 32
+            self.imageFormat = QImage.Format_RGB32
+        except amcam.HRESULTException:
+            self.hcam.put_Option(amcam.AMCAM_OPTION_BYTEORDER, 0) # QImage.Format_RGB888
+            self.bits = 24
+            self.imageFormat = QImage.Format_RGB888
 
     def changeAutoExposure(self, state):
         if self.hcam is not None:
             self.hcam.put_AutoExpoEnable(state == Qt.Checked)
 
     def closeEvent(self, event):
+        self.reconnectTimer.stop()
+        try:
+            self.cameraClass.HotPlug(None)
+        except (amcam.HRESULTException, OSError, AttributeError):
+            pass
+        if self.cameraConnect is not None: # Closed while connecting: a camera opened meanwhile is closed right away
+            self.cameraConnect.connected.disconnect()
+            self.cameraConnect.failed.disconnect()
+            self.cameraConnect.wait()
+            if self.cameraConnect.result is not None and self.cameraConnect.result[1] is not None:
+                self.cameraConnect.result[1].Close()
+            self.cameraConnect = None
+        self.presentTimer.stop()
+        self.fpsTimer.stop()
+        self.stopRecording()
+        if self.referenceCapture is not None:
+            self.referenceCapture.stop()
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.acquisition = None
+        if self.stillCapture is not None:
+            self.stillCapture.stop()
+            self.stillCapture = None
+        if self.imageWriter is not None:
+            self.imageWriter.stop() # Writes the queued images first
+            self.imageWriter = None
         if self.hcam is not None:
             self.hcam.Close()
             self.hcam = None
@@ -96,6 +713,10 @@ class CameraView(QWidget):
     
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    win = CameraView()
+    if "--simulate-camera" in sys.argv:
+        from SimulatedCamera import SimulatedAmcam
+        win = CameraView(cameraClass=SimulatedAmcam)
+    else:
+        win = CameraView()
     win.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -1,18 +1,48 @@
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt
 from PyQt5.QtWidgets import QLabel, QApplication
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor, QTransform, QPolygonF, QPainterPath, QBrush, QFont
+from PyQt5.QtGui import QPixmap, QImage, QPainter, QPen, QColor, QTransform, QPolygonF, QPainterPath, QBrush, QFont
 from PyQt5.QtCore import Qt, QRectF, QPointF, QLineF, QRectF, QLineF
 import math
 import sys
 import numpy as np
+from DesignGeometry import DesignGeometry
+from ViewTransform import ViewTransform, rotateAround
+from SpatialIndex import GridIndex
 
 # Class for the Label and the overlay design on top of the camera view
 class ClickableCameraLabel(QLabel):
+    SHAPE_KINDS = ("rect", "line", "quadr", "del_rect") # Design shape lists, in the order they are hit-tested
     updated = pyqtSignal(bool)
+    focusWindowPicked = pyqtSignal(QRectF) # Rectangle in sensor pixels
+    framePainted = pyqtSignal() # Emitted after a new frame set with setFrame was painted for the first time
+
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.original_pixmap = None
+        self.frame = None # QImage of the current camera frame
+        self.sensorSize = None # Full sensor size (width, height), None when the frame is the whole sensor
+        self.frameRect = None # Part of the sensor (in sensor pixels) covered by the frame, None when the frame is the whole sensor
+        self.pickingFocusWindow = False
+        self.framePaintPending = False
+        self.hudLines = None # Text lines shown in the top right corner (frame metrics), None to hide
+        self.statusText = None # Shown instead of the frame while there is none (camera connecting or missing)
+        self.staticOverlay = None # Grid, coordinates, crosshair and scale bar rendered once, see staticOverlayLayer
+        self.staticOverlayKey = None
+        self.gridFont = QFont(self.font())
+        self.gridFont.setPointSize(12)
+        self.positionFont = QFont(self.font())
+        self.positionFont.setPointSize(14)
+        self.scaleBarFont = QFont("Arial", 18)
+        self.designLayer = None # Design shapes with their handles, redrawn only after designChanged(), see designLayerImage
+        self.designLayerKey = None
+        self.designRevision = 0 # Counts the changes of the design shapes (edits, shapes rebuilt after stage motion)
+        self.parsedDesign = None # designItems parsed once, see designGeometry
+        self.designItemsRevision = 0 # Counts the changes of designItems
+        self.designShapesKey = None # Items revision and view the design shapes were last built for, see setFrame
+        self.shapeIndex = GridIndex() # (kind, index) of the design shapes by bounding box incl. handles, see shapeAt
+        self.flakes = [] # Detected flakes (FlakeDetection, stage mm) drawn as outlines, a click on one makes it a design rect
+        self.pressedFlake = None
         self.setMouseTracking(True)
         self.setFocusPolicy(Qt.StrongFocus)
 
@@ -47,138 +77,29 @@ class ClickableCameraLabel(QLabel):
         if not self.interactionEnabled:
             return
         if event.button() == Qt.LeftButton:
-            handle_size = 6
-            rotation_handle_radius = 8
-            
             # Check if clicked on any current design elements
-            for i, entry in enumerate(self.rectangles):
-                rect = entry['rect']
-                rotation = entry['rotation']
-                center = rect.center()
-
-                # Transformation für Rücktransformation der Mausposition
-                transform = QTransform()
-                transform.translate(center.x(), center.y())
-                transform.rotate(-rotation)
-                transform.translate(-center.x(), -center.y())
-                local_pos = transform.map(event.pos())
-
-                # Griff für Rotation
-                handle_center = QPointF((rect.left() + rect.right()) // 2, rect.top() - 15)
-                if (local_pos - handle_center).manhattanLength() <= rotation_handle_radius:
-                    self.selected_index = i
-                    self.rotating = True
-                    self.drawingType = "rect"
-                    self.update()
-                    self.setCursor(Qt.SizeHorCursor)
-                    return
-
-                # Eckgriffe prüfen
-                for corner, pt in [('tl', rect.topLeft()), ('tr', rect.topRight()),
-                                   ('bl', rect.bottomLeft()), ('br', rect.bottomRight())]:
-                    handle_rect = QRectF(pt.x() - handle_size//2, pt.y() - handle_size//2, handle_size, handle_size)
-                    if handle_rect.contains(local_pos):
-                        self.selected_index = i
-                        self.resizing_corner = corner
-                        self.drawingType = "rect"
-                        self.update()
-                        self.setCursor(Qt.SizeBDiagCursor)
-                        return
-
-                # Seiten-Interaktion für Bewegung
-                if rect.contains(local_pos):
-                    self.selected_index = i
-                    self.moving_offset = local_pos - rect.topLeft()
-                    self.drawingType = "rect"
-                    self.update()
-                    self.setCursor(Qt.ClosedHandCursor)
-                    return
-
-            for i, line in enumerate(self.lines):                
-                pos = event.pos()
-
-                # Eckgriffe prüfen
-                for corner, pt in [('b', line.p1()), ('t', line.p2())]:
-                    handle_rect = QRectF(pt.x() - handle_size//2, pt.y() - handle_size//2, handle_size, handle_size)
-                    if handle_rect.contains(pos):
-                        self.selected_index = i
-                        self.resizing_corner = corner
-                        self.drawingType = "line"
-                        self.update()
-                        self.setCursor(Qt.SizeBDiagCursor)
-                        return
-        
-            for i, quadr in enumerate(self.quadr):
-                pos = event.pos()
-
-                # Eckgriffe prüfen
-                for cornerIndex in range(quadr.count()):
-                        cornerPoint = quadr.at(cornerIndex)
-                        handle_rect = QRectF(cornerPoint.x() - handle_size//2, cornerPoint.y() - handle_size//2, handle_size, handle_size)
-                        if handle_rect.contains(pos):
-                            self.selected_index = i
-                            self.resizing_corner = cornerIndex
-                            self.drawingType = "quadr"
-                            self.update()
-                            self.setCursor(Qt.SizeBDiagCursor)
-                            return
-
-            for i, entry in enumerate(self.del_rectangles):
-                del_rect = entry['rect']
-                rotation = entry['rotation']
-                center = del_rect.center()
-
-                # Transformation für Rücktransformation der Mausposition
-                transform = QTransform()
-                transform.translate(center.x(), center.y())
-                transform.rotate(-rotation)
-                transform.translate(-center.x(), -center.y())
-                local_pos = transform.map(event.pos())
-
-                # Griff für Rotation
-                handle_center = QPointF((del_rect.left() + del_rect.right()) // 2, del_rect.top() - 15)
-                if (local_pos - handle_center).manhattanLength() <= rotation_handle_radius:
-                    self.selected_index = i
+            hit = self.shapeAt(event.pos())
+            if hit is not None:
+                kind, index, part, local_pos = hit
+                self.selected_index = index
+                self.drawingType = kind
+                if part == "rotate":
                     self.rotating = True
-                    self.drawingType = "del_rect"
-                    self.update()
-                    self.setCursor(Qt.SizeHorCursor)
-                    return
-
-                # Eckgriffe prüfen
-                for corner, pt in [('tl', del_rect.topLeft()), ('tr', del_rect.topRight()),
-                                   ('bl', del_rect.bottomLeft()), ('br', del_rect.bottomRight())]:
-                    handle_rect = QRectF(pt.x() - handle_size//2, pt.y() - handle_size//2, handle_size, handle_size)
-                    if handle_rect.contains(local_pos):
-                        self.selected_index = i
-                        self.resizing_corner = corner
-                        self.drawingType = "del_rect"
-                        self.update()
-                        self.setCursor(Qt.SizeBDiagCursor)
-                        return
+                elif part == "move":
+                    self.moving_offset = local_pos - self.shapeList(kind)[index]['rect'].topLeft()
+                else:
+                    self.resizing_corner = part
+                self.update()
+                self.setCursor({"rotate": Qt.SizeHorCursor, "move": Qt.ClosedHandCursor}.get(part, Qt.SizeBDiagCursor))
+                return
 
-                # Seiten-Interaktion für Bewegung
-                if del_rect.contains(local_pos):
-                    self.selected_index = i
-                    self.moving_offset = local_pos - del_rect.topLeft()
-                    self.drawingType = "del_rect"
-                    self.update()
-                    self.setCursor(Qt.ClosedHandCursor)
-                    return
-
-            # Did not click on current design elements -> Draw Element
+            # Did not click on current design elements -> Draw Element, or a rect around the flake if released without dragging
+            self.pressedFlake = self.flakeAt(event.pos())
             self.drawing = True
             pos = event.pos()
 
             # Check if is drawing outside of motors movement range. Transform pixel position into real world position
-            dx_px = pos.x() - self.width()//2
-            dy_py = pos.y() - self.height()//2
-
-            dx_mm = dx_px*self.pixel_size*self.pixmapScreenSizeRatio
-            dy_mm = dy_py*self.pixel_size*self.pixmapScreenSizeRatio
-        
-            pointX = self.currentPosition[0] + dx_mm
-            pointY = self.currentPosition[1] - dy_mm
+            pointX, pointY = self.labelTransform().toStage((pos.x(), pos.y()))
 
             if not (0<pointX<12 and 0<pointY<12):
                 print("Outside the limits")
@@ -186,7 +107,7 @@ class ClickableCameraLabel(QLabel):
 
             self.start_point = event.pos()
             self.end_point = event.pos()
-            if self.newDrawingType == "line":
+            if self.newDrawingType == "line" and not self.pickingFocusWindow:
                 self.preview_draw = QLineF(self.start_point, self.end_point)
             else: 
                 self.preview_draw = QRectF(self.start_point, self.end_point)
@@ -200,15 +121,7 @@ class ClickableCameraLabel(QLabel):
         
         # Transform pixel position into real world position
         pos = event.pos()
-
-        dx_px = pos.x() - self.width()//2
-        dy_py = pos.y() - self.height()//2
-
-        dx_mm = dx_px*self.pixel_size*self.pixmapScreenSizeRatio
-        dy_mm = dy_py*self.pixel_size*self.pixmapScreenSizeRatio
-      
-        pointX = self.currentPosition[0] + dx_mm
-        pointY = self.currentPosition[1] - dy_mm
+        pointX, pointY = self.labelTransform().toStage((pos.x(), pos.y()))
 
         self.goToCoordinates = (round(float(pointX), 5), round(float(pointY), 5), self.currentPosition[2])
 
@@ -221,11 +134,12 @@ class ClickableCameraLabel(QLabel):
             return
         if self.drawing: # Show preview drawing shape
             self.end_point = event.pos()
-            if self.newDrawingType == "line":
+            if self.newDrawingType == "line" and not self.pickingFocusWindow:
                 self.preview_draw = QLineF(self.start_point, self.end_point)
             else:
                 self.preview_draw = QRectF(self.start_point, self.end_point) 
             self.update()
+            return # Only the preview changed, it is drawn on top of the design layer
     
         elif self.rotating and self.selected_index != -1: # Rotate selected shape
             if self.drawingType == "rect":
@@ -259,7 +173,7 @@ class ClickableCameraLabel(QLabel):
                     except:
                         del_size = self.pixel_surface_del
                     new_outer = new_rect.adjusted(-del_size, -del_size, del_size, del_size)
-                    conflict = any(new_outer.intersects(other['rect']) for j, other in enumerate(self.rectangles) if j != self.selected_index)
+                    conflict = self.rectConflict(new_outer, self.selected_index)
                     if not conflict:
                         self.rectangles[self.selected_index]['rect'] = new_rect
                         self.rectangles[self.selected_index]['del_rect'] = new_outer
@@ -291,7 +205,7 @@ class ClickableCameraLabel(QLabel):
                 new_rect = QRectF(opposite, event.pos()).normalized()
  
                 if new_rect.width() >= 20 and new_rect.height() >= 20:
-                    conflict = any(new_rect.intersects(other['rect']) for j, other in enumerate(self.rectangles))
+                    conflict = self.rectConflict(new_rect)
                     if not conflict:
                         self.del_rectangles[self.selected_index]['rect'] = new_rect
 
@@ -310,7 +224,7 @@ class ClickableCameraLabel(QLabel):
                 except:
                     del_size = self.pixel_surface_del
                 new_outer = new_rect.adjusted(-del_size, -del_size, del_size, del_size)
-                conflict = any(new_outer.intersects(other['rect']) for j, other in enumerate(self.rectangles) if j != self.selected_index)
+                conflict = self.rectConflict(new_outer, self.selected_index)
                 if not conflict:
                     self.rectangles[self.selected_index]['rect'] = new_rect
                     self.rectangles[self.selected_index]['del_rect'] = new_outer
@@ -344,10 +258,16 @@ class ClickableCameraLabel(QLabel):
                 new_top_left.setY(max(0, min(new_top_left.y(), self.height() - del_rect.height())))
                 delta = new_top_left - del_rect.topLeft()
                 new_rect = del_rect.translated(delta)
-                conflict = any(new_rect.intersects(other['rect']) for j, other in enumerate(self.rectangles))
+                conflict = self.rectConflict(new_rect)
                 if not conflict:
                     self.del_rectangles[self.selected_index]['rect'] = new_rect
-        
+
+        else: # Hovering: nothing is repainted, the cursor shows what a press would grab
+            hit = self.shapeAt(event.pos())
+            self.setCursor(Qt.CrossCursor if hit is None else {"rotate": Qt.SizeHorCursor, "move": Qt.OpenHandCursor}.get(hit[2], Qt.SizeBDiagCursor))
+            return
+        self.indexShape(self.drawingType, self.selected_index)
+        self.designChanged()
         self.update()
 
     def mouseReleaseEvent(self, event): # Handle when releasing mouse
@@ -356,25 +276,37 @@ class ClickableCameraLabel(QLabel):
         self.setCursor(Qt.CrossCursor)
         # Check if was drawing to append shape
         if event.button() == Qt.LeftButton and self.drawing:
-            if self.newDrawingType == "rect" or self.newDrawingType == "quadr":
+            if self.pressedFlake is not None and not self.pickingFocusWindow and (self.end_point - self.start_point).manhattanLength() < 5:
+                self.addFlakeDesign(self.pressedFlake)
+                self.selected_index = -1
+            elif self.pickingFocusWindow:
+                rect = QRectF(self.start_point, self.end_point).normalized()
+                if rect.width() > 20 and rect.height() > 20:
+                    ratio = self.sensorToScreenRatio()
+                    self.focusWindowPicked.emit(QRectF(rect.x()*ratio[0], rect.y()*ratio[1], rect.width()*ratio[0], rect.height()*ratio[1]))
+                self.pickingFocusWindow = False
+            elif self.newDrawingType == "rect" or self.newDrawingType == "quadr":
                 rect = QRectF(self.start_point, self.end_point)
                 if rect.width() > 20 and rect.height() > 20:
                     outer_rect = rect.adjusted(-self.pixel_surface_del, -self.pixel_surface_del, self.pixel_surface_del, self.pixel_surface_del)
-                    conflict = any(outer_rect.intersects(existing['rect']) for existing in self.rectangles)
+                    conflict = self.rectConflict(outer_rect)
                     if not conflict:
                         self.rectangles.append({'rect': rect, 'rotation': 0, 'del_rect': outer_rect, 'del_size': self.pixel_surface_del})
+                        self.indexShape("rect", len(self.rectangles) - 1)
                 self.selected_index = -1
             elif self.newDrawingType == "line":
                 line = QLineF(self.start_point, self.end_point)
                 if line.length() > 20:
                     self.lines.append(line)
+                    self.indexShape("line", len(self.lines) - 1)
                 self.selected_index = -1
             elif self.newDrawingType == "del_rect":
                 rect = QRectF(self.start_point, self.end_point)
                 if rect.width() > 20 and rect.height() > 20:
-                    conflict = any(rect.intersects(existing['rect']) for existing in self.rectangles)
+                    conflict = self.rectConflict(rect)
                     if not conflict:
                         self.del_rectangles.append({'rect': rect, 'rotation': 0})
+                        self.indexShape("del_rect", len(self.del_rectangles) - 1)
                 self.selected_index = -1
         
         # Update all elements and reset editing variables
@@ -383,13 +315,384 @@ class ClickableCameraLabel(QLabel):
         self.rotating = False
         self.drawing = False
         self.resizing_corner = None
+        self.pressedFlake = None
+        self.designChanged()
         self.update() 
             
 
     def paintEvent(self, event): # Software draw the shapes (how the shapes should look like on the overlay view)
         super().paintEvent(event)
         painter = QPainter(self)
+        self.paintFrame(painter)
+        if self.flakes:
+            self.paintFlakes(painter)
+
+        if self.rectangles or self.lines or self.quadr or self.del_rectangles:
+            painter.drawImage(0, 0, self.designLayerImage())
+
+        if self.preview_draw and self.drawing:
+            pen = QPen(QColor(0, 255, 0), 1, Qt.DashLine)
+            painter.setPen(pen)
+            if self.newDrawingType == "rect" or self.newDrawingType == "del_rect" or self.pickingFocusWindow:
+                painter.drawRect(self.preview_draw)
+            elif self.newDrawingType == "line":
+                painter.drawLine(QLineF(self.preview_draw))
+
+        if self.hudLines:
+            self.paintHud(painter)
+        if self.framePaintPending:
+            self.framePaintPending = False
+            self.framePainted.emit()
+
+    def keyPressEvent(self, event): # Handle when pressing some keys
+        if not self.interactionEnabled:
+            return
+        if event.key() == 16777219  or event.key() == Qt.Key_Delete:
+            if 0 <= self.selected_index < len(self.rectangles if self.drawingType == "rect" else self.lines if self.drawingType == "line" else self.quadr if self.drawingType == "quadr" else self.del_rectangles):
+                if self.drawingType == "rect":
+                    del self.rectangles[self.selected_index]
+                elif self.drawingType == "line":
+                    del self.lines[self.selected_index]
+                elif self.drawingType == "quadr":
+                    del self.quadr[self.selected_index]
+                elif self.drawingType == "del_rect":
+                    del self.del_rectangles[self.selected_index]
+                self.indexDesign() # The following shapes moved up
+            self.updated.emit(True)
+            self.selected_index = -1
+            self.drawing = False
+
+        if event.key() == Qt.Key_Escape:
+            self.selected_index = -1
+            self.drawing = False
+        
+        if (event.key() == Qt.Key_Left or event.key() == Qt.Key_Right or event.key() == Qt.Key_Up or event.key() == Qt.Key_Down) and 0 <= self.selected_index < len(self.rectangles if self.drawingType == "rect" else self.lines if self.drawingType == "line" else self.quadr if self.drawingType == "quadr" else self.del_rectangles):
+            if self.drawingType == "rect": 
+                new_rect = self.rectangles[self.selected_index]['rect'].translated(
+                    3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0,
+                    -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
+                try:
+                    del_size = int(self.rectangles[self.selected_index]['del_size'])
+                except:
+                    del_size = self.pixel_surface_del
+                new_outer = new_rect.adjusted(-del_size, -del_size, del_size, del_size)
+                conflict = self.rectConflict(new_outer, self.selected_index)
+                if not conflict:
+                    self.rectangles[self.selected_index]['rect'] = new_rect
+                    self.rectangles[self.selected_index]['del_rect'] = new_outer
+            elif self.drawingType == "line":
+                new_line = self.lines[self.selected_index].translated(3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0, -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
+                self.lines[self.selected_index] = new_line
+            elif self.drawingType == "quadr":
+                new_quadr = self.quadr[self.selected_index].translated(3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0, -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
+                self.quadr[self.selected_index] = new_quadr
+            elif self.drawingType == "del_rect": 
+                new_rect = self.del_rectangles[self.selected_index]['rect'].translated(
+                    3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0,
+                    -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
+                conflict = self.rectConflict(new_rect)
+                if not conflict:
+                    self.del_rectangles[self.selected_index]['rect'] = new_rect
+            self.indexShape(self.drawingType, self.selected_index)
+            self.updated.emit(True)
+        self.updateDesignElements()
+        self.designChanged()
+        self.update()
+
+    def updateDesignElements(self): # Design items in stage mm from the shapes in label pixels, the corners of all shapes are converted at once
+        def rotatedCorners(entries): # Corners tl, tr, br, bl of the rects rotated around their centers, (n, 4, 2)
+            coords = np.array([entry['rect'].getCoords() for entry in entries], dtype=np.float64).reshape(-1, 4)
+            centers = np.stack([(coords[:, 0] + coords[:, 2])/2, (coords[:, 1] + coords[:, 3])/2], axis=-1)
+            return rotateAround(coords[:, [[0, 1], [2, 1], [2, 3], [0, 3]]], centers, [entry['rotation'] for entry in entries])
+
+        pixels = [
+            rotatedCorners(self.rectangles),
+            np.array([[line.x1(), line.y1(), line.x2(), line.y2()] for line in self.lines], dtype=np.float64).reshape(-1, 2, 2),
+            np.array([[(quadr.at(i).x(), quadr.at(i).y()) for i in range(4)] for quadr in self.quadr], dtype=np.float64).reshape(-1, 4, 2),
+            rotatedCorners(self.del_rectangles),
+        ]
+        stage = np.round(self.labelTransform().toStage(np.concatenate([corners.reshape(-1, 2) for corners in pixels])), 5)
+        rects, lines, quadrs, del_rects = np.split(stage, np.cumsum([corners.shape[0]*corners.shape[1] for corners in pixels])[:-1])
+
+        design_elements = []
+        for points, entry in zip(rects.reshape(-1, 8).tolist(), self.rectangles):
+            design_elements.append("rect;" + ";".join(map(str, points)) + f";{entry['rotation']};{entry['del_size']}")
+        for points in lines.reshape(-1, 4).tolist():
+            design_elements.append("line;" + ";".join(map(str, points)))
+        for points in quadrs.reshape(-1, 8).tolist():
+            design_elements.append("quadr;" + ";".join(map(str, points)))
+        for points, entry in zip(del_rects.reshape(-1, 8).tolist(), self.del_rectangles):
+            design_elements.append("del_rect;" + ";".join(map(str, points)) + f";{entry['rotation']}")
+
+        if self.designItems != design_elements:
+            self.designItems = design_elements
+            self.updated.emit(True)
+        self.designShapesKey = None # Rebuilt from the items with the next frame
+    
+    def setPixmap(self, pixmap): # Kept for callers with a QPixmap, the camera uses setFrame
+        self.setFrame(pixmap.toImage())
+
+    def setSensorGeometry(self, sensorWidth, sensorHeight, frameRect=None): # frameRect: part of the sensor delivered by the camera (ROI), None for the full sensor
+        self.sensorSize = (sensorWidth, sensorHeight)
+        self.frameRect = frameRect
+
+    def sensorDimensions(self): # Size of the full sensor in pixels. All pixel <-> mm conversions are based on it, not on the (cropped or binned) frame
+        if self.sensorSize is not None:
+            return self.sensorSize
+        if self.frame is not None:
+            return (self.frame.width(), self.frame.height())
+        return (self.width(), self.height())
+
+    def sensorToScreenRatio(self): # Sensor pixels per label pixel in x and y
+        width, height = self.sensorDimensions()
+        return (width/self.width(), height/self.height())
+
+    def startFocusWindowPicking(self): # Next drawn rectangle is emitted as focusWindowPicked instead of becoming a design shape
+        self.pickingFocusWindow = True
+
+    def designBoundingRect(self, margin=0): # Bounding rectangle of all design items in sensor pixels (clipped to the sensor), None without designs
+        width, height = self.sensorDimensions()
+        vertices = self.designGeometry().vertices
+        if len(vertices) == 0:
+            return None
+        pixels = self.sensorTransform().toView(vertices)
+        pixelX, pixelY = pixels[:, 0], pixels[:, 1]
+        rect = QRectF(QPointF(pixelX.min()-margin, pixelY.min()-margin), QPointF(pixelX.max()+margin, pixelY.max()+margin))
+        rect = rect.intersected(QRectF(0, 0, width, height))
+        if rect.isEmpty():
+            return None
+        return rect
+
+    def clearFrame(self): # Drop the current frame, e.g. before the buffers it borrows are reallocated
+        self.frame = None
+        self.framePaintPending = False
+        self.update()
+
+    def setStatusText(self, text): # Shown while there is no frame, None for nothing
+        self.statusText = text
+        self.update()
+
+    def setHud(self, lines): # Show text lines (e.g. frame metrics) on top of the view, None hides them
+        self.hudLines = lines
+        self.update()
+
+    def setFrame(self, image): # Set the camera frame (borrowed, not copied) and rebuild the design shapes. Painting happens in paintEvent
+        self.frame = image
+        self.framePaintPending = True
+
+        width, height = self.sensorDimensions()
+        self.pixmapScreenSizeRatio = width/self.width()
+
+        self.centerX = width//2
+        self.centerY = height//2
+
+        if not self.resizing_corner and not self.rotating and not self.drawing and not self.moving_offset: # Not while a shape is edited
+            design = self.designGeometry()
+            key = (self.designItemsRevision, self.currentPosition[0], self.currentPosition[1], self.pixel_size, self.width(), self.height(), width, height)
+            if key != self.designShapesKey: # Only rebuilt when the design was edited or the view moved
+                self.designShapesKey = key
+                self.setDesignShapes(design, width, height)
+
+        self.update()
+
+    def designGeometry(self): # designItems parsed into arrays, parsed again only when the items were changed (here or in the design list)
+        if self.parsedDesign is None or not self.parsedDesign.matches(self.designItems):
+            self.parsedDesign = DesignGeometry(self.designItems)
+            self.designItemsRevision += 1
+        return self.parsedDesign
 
+    def setDesignShapes(self, design, width, height): # Rebuild the editable shapes in label pixels from the parsed design at the current position
+        vertices = self.labelTransform().toView(design.vertices)
+        np.clip(vertices[:, 0], 0, width, out=vertices[:, 0]) # Corners outside the sensor are moved to its edge
+        np.clip(vertices[:, 1], 0, height, out=vertices[:, 1])
+        pixels = design.split(vertices)
+
+        def unrotatedRects(kind): # Rect from corners 1 and 3 rotated back around its center, [(x1, y1, x2, y2)]
+            corners = pixels[kind][:, [0, 2]]
+            return rotateAround(corners, corners.mean(axis=1), -design.rotations[kind]).reshape(-1, 4).tolist()
+
+        revision = self.designRevision
+        rectanglesToAppend = []
+        for (x1, y1, x2, y2), rotation, del_size in zip(unrotatedRects("rect"),
+                                                        design.rotations["rect"].tolist(), design.delSizes.tolist()):
+            rect = QRectF(QPointF(x1, y1), QPointF(x2, y2))
+            outer_rect = rect.adjusted(-del_size, -del_size, del_size, del_size)
+            rectanglesToAppend.append({'rect': rect, 'rotation': rotation, 'del_rect': outer_rect, 'del_size': del_size})
+
+        del_rectanglesToAppend = []
+        for (x1, y1, x2, y2), rotation in zip(unrotatedRects("del_rect"),
+                                              design.rotations["del_rect"].tolist()):
+            del_rectanglesToAppend.append({'rect': QRectF(QPointF(x1, y1), QPointF(x2, y2)), 'rotation': rotation})
+
+        linesToAppend = [QLineF(x1, y1, x2, y2) for (x1, y1), (x2, y2) in pixels["line"].tolist()]
+        quadrToAppend = [QPolygonF([QPointF(x, y) for x, y in corners]) for corners in pixels["quadr"].tolist()]
+
+        if self.rectangles != rectanglesToAppend:
+            self.rectangles = rectanglesToAppend
+            self.designChanged()
+        if self.del_rectangles != del_rectanglesToAppend:
+            self.del_rectangles = del_rectanglesToAppend
+            self.designChanged()
+        if self.lines != linesToAppend:
+            self.lines = linesToAppend
+            self.designChanged()
+        if self.quadr != quadrToAppend:
+            self.quadr = quadrToAppend
+            self.designChanged()
+        if self.designRevision != revision:
+            self.indexDesign()
+
+    def setFlakes(self, flakes): # Flakes from FlakeDetection.FlakeDetector in stage mm, [] to hide
+        self.flakes = flakes
+        self.update()
+
+    def shapeList(self, kind):
+        return {"rect": self.rectangles, "line": self.lines, "quadr": self.quadr, "del_rect": self.del_rectangles}[kind]
+
+    def shapeBox(self, kind, shape): # Label pixel box around the shape with its handles, for rects also around the unrotated rect (conflicts)
+        margin = 10 # Handles are hit up to 8 px (rotation handle) from their point
+        if kind == "line":
+            points = [(shape.x1(), shape.y1()), (shape.x2(), shape.y2())]
+        elif kind == "quadr":
+            points = [(shape.at(i).x(), shape.at(i).y()) for i in range(shape.count())]
+        else:
+            rect = shape['rect']
+            x1, y1, x2, y2 = rect.getCoords()
+            local = [(x1, y1), (x2, y1), (x2, y2), (x1, y2), ((x1 + x2)//2, y1 - 15)]
+            centerX, centerY = (x1 + x2)/2, (y1 + y2)/2
+            cos, sin = math.cos(math.radians(shape['rotation'])), math.sin(math.radians(shape['rotation']))
+            points = local + [(centerX + (x - centerX)*cos - (y - centerY)*sin, centerY + (x - centerX)*sin + (y - centerY)*cos) for x, y in local]
+        xs, ys = [x for x, y in points], [y for x, y in points]
+        return (min(xs) - margin, min(ys) - margin, max(xs) + margin, max(ys) + margin)
+
+    def indexShape(self, kind, index): # After one shape was added or edited
+        shapes = self.shapeList(kind)
+        if 0 <= index < len(shapes):
+            self.shapeIndex.insert((kind, index), self.shapeBox(kind, shapes[index]))
+
+    def indexDesign(self): # After the shape lists were replaced or a shape was deleted
+        self.shapeIndex.clear()
+        for kind in self.SHAPE_KINDS:
+            for index, shape in enumerate(self.shapeList(kind)):
+                self.shapeIndex.insert((kind, index), self.shapeBox(kind, shape))
+
+    def checkShapeIndex(self): # Rebuilt if shapes were added or removed without indexShape/indexDesign
+        if len(self.shapeIndex) != len(self.rectangles) + len(self.lines) + len(self.quadr) + len(self.del_rectangles):
+            self.indexDesign()
+
+    def shapeAt(self, pos): # Design shape part under the label position: (kind, index, part, pos in the unrotated shape) or None
+        # part: "rotate" (rotation handle), a corner ('tl', 'tr', 'bl', 'br' for rects, 'b', 't' for lines, the index for
+        # quadrilaterals) or "move". Only the shapes of the grid cell are tested, in the order rects, lines, quadrilaterals,
+        # del rects like the shapes are listed
+        self.checkShapeIndex()
+        handle_size = 6
+        rotation_handle_radius = 8
+        candidates = sorted(self.shapeIndex.queryPoint(pos.x(), pos.y()), key=lambda key: (self.SHAPE_KINDS.index(key[0]), key[1]))
+        for kind, index in candidates:
+            shape = self.shapeList(kind)[index]
+            if kind == "line":
+                corners = [('b', shape.p1()), ('t', shape.p2())]
+            elif kind == "quadr":
+                corners = [(cornerIndex, shape.at(cornerIndex)) for cornerIndex in range(shape.count())]
+            else:
+                rect = shape['rect']
+                center = rect.center()
+
+                # Transformation für Rücktransformation der Mausposition
+                transform = QTransform()
+                transform.translate(center.x(), center.y())
+                transform.rotate(-shape['rotation'])
+                transform.translate(-center.x(), -center.y())
+                local_pos = transform.map(pos)
+
+                # Griff für Rotation
+                handle_center = QPointF((rect.left() + rect.right()) // 2, rect.top() - 15)
+                if (local_pos - handle_center).manhattanLength() <= rotation_handle_radius:
+                    return (kind, index, "rotate", local_pos)
+
+                # Eckgriffe prüfen
+                for corner, pt in [('tl', rect.topLeft()), ('tr', rect.topRight()), ('bl', rect.bottomLeft()), ('br', rect.bottomRight())]:
+                    handle_rect = QRectF(pt.x() - handle_size//2, pt.y() - handle_size//2, handle_size, handle_size)
+                    if handle_rect.contains(local_pos):
+                        return (kind, index, corner, local_pos)
+
+                # Seiten-Interaktion für Bewegung
+                if rect.contains(local_pos):
+                    return (kind, index, "move", local_pos)
+                continue
+
+            for corner, pt in corners:
+                handle_rect = QRectF(pt.x() - handle_size//2, pt.y() - handle_size//2, handle_size, handle_size)
+                if handle_rect.contains(pos):
+                    return (kind, index, corner, pos)
+        return None
+
+    def rectConflict(self, rect, skip=-1): # True if rect intersects one of the design rects other than index skip
+        self.checkShapeIndex()
+        box = rect.normalized()
+        for kind, index in self.shapeIndex.query((box.left(), box.top(), box.right(), box.bottom())):
+            if kind == "rect" and index != skip and rect.intersects(self.rectangles[index]['rect']):
+                return True
+        return False
+
+    def viewTransform(self, scale, center): # Stage mm <-> pixels of a view with scale mm per pixel showing the current position at center
+        return ViewTransform(self.currentPosition, scale, center)
+
+    def labelTransform(self): # Stage mm <-> label pixels
+        return self.viewTransform(self.pixel_size*self.sensorToScreenRatio()[0], (self.width()//2, self.height()//2))
+
+    def sensorTransform(self): # Stage mm <-> sensor pixels
+        width, height = self.sensorDimensions()
+        return self.viewTransform(self.pixel_size, (width//2, height//2))
+
+    def stageToLabel(self, x, y): # Stage position in mm to label pixels at the current position
+        return QPointF(*self.labelTransform().toView((x, y)).tolist())
+
+    def flakeOutline(self, flake, transform=None):
+        transform = transform or self.labelTransform()
+        return QPolygonF([QPointF(x, y) for x, y in transform.toView(flake["outline"]).tolist()])
+
+    def flakeAt(self, pos): # Detected flake under the label position, None if there is none
+        if self.pixmapScreenSizeRatio == 0:
+            return None
+        transform = self.labelTransform()
+        for flake in self.flakes:
+            if self.flakeOutline(flake, transform).containsPoint(QPointF(pos), Qt.OddEvenFill):
+                return flake
+        return None
+
+    def addFlakeDesign(self, flake): # Rect design item along the flake axes, False if it overlaps an existing rect
+        scale = self.labelTransform().scale
+        center = self.stageToLabel(*flake["center"])
+        width, height = flake["size"][0]/scale, flake["size"][1]/scale
+        rect = QRectF(center.x() - width/2, center.y() - height/2, width, height)
+        outer_rect = rect.adjusted(-self.pixel_surface_del, -self.pixel_surface_del, self.pixel_surface_del, self.pixel_surface_del)
+        if self.rectConflict(outer_rect):
+            return False
+        self.rectangles.append({'rect': rect, 'rotation': round(flake["angle"], 2), 'del_rect': outer_rect, 'del_size': self.pixel_surface_del})
+        self.indexShape("rect", len(self.rectangles) - 1)
+        self.designChanged()
+        return True
+
+    def designChanged(self): # Call after changing rectangles, lines, quadr or del_rectangles, the design layer is redrawn with the next paint
+        self.designRevision += 1
+
+    def designLayerImage(self): # Transparent layer of the label size with all design shapes, only redrawn when they, the selection or the size change
+        ratio = self.devicePixelRatioF()
+        key = (self.designRevision, self.selected_index, self.drawingType, self.width(), self.height(), ratio)
+        if key != self.designLayerKey or self.designLayer is None:
+            size = (round(self.width()*ratio), round(self.height()*ratio))
+            if self.designLayer is None or (self.designLayer.width(), self.designLayer.height()) != size:
+                self.designLayer = QImage(size[0], size[1], QImage.Format_ARGB32_Premultiplied)
+                self.designLayer.setDevicePixelRatio(ratio)
+            self.designLayer.fill(Qt.transparent)
+            painter = QPainter(self.designLayer)
+            self.paintDesignLayer(painter)
+            painter.end()
+            self.designLayerKey = key
+        return self.designLayer
+
+    def paintDesignLayer(self, painter): # Rects with their del area, lines, quadrilaterals and del rects with handles, in label pixels
         for i, entry in enumerate(self.rectangles):
             rect = entry['rect']
             rotation = entry['rotation']
@@ -495,180 +798,76 @@ class ClickableCameraLabel(QLabel):
             painter.drawEllipse(rot_center, 6, 6)
             painter.restore()
 
-        if self.preview_draw and self.drawing:
-            pen = QPen(QColor(0, 255, 0), 1, Qt.DashLine)
-            painter.setPen(pen)
-            if self.newDrawingType == "rect" or self.newDrawingType == "del_rect":
-                painter.drawRect(self.preview_draw)
-            elif self.newDrawingType == "line":
-                painter.drawLine(QLineF(self.preview_draw))
-
-    def keyPressEvent(self, event): # Handle when pressing some keys
-        if not self.interactionEnabled:
+    def paintFlakes(self, painter): # In label pixels
+        if self.pixmapScreenSizeRatio == 0:
             return
-        if event.key() == 16777219  or event.key() == Qt.Key_Delete:
-            if 0 <= self.selected_index < len(self.rectangles if self.drawingType == "rect" else self.lines if self.drawingType == "line" else self.quadr if self.drawingType == "quadr" else self.del_rectangles):
-                if self.drawingType == "rect":
-                    del self.rectangles[self.selected_index]
-                elif self.drawingType == "line":
-                    del self.lines[self.selected_index]
-                elif self.drawingType == "quadr":
-                    del self.quadr[self.selected_index]
-                elif self.drawingType == "del_rect":
-                    del self.del_rectangles[self.selected_index]
-            self.updated.emit(True)
-            self.selected_index = -1
-            self.drawing = False
-
-        if event.key() == Qt.Key_Escape:
-            self.selected_index = -1
-            self.drawing = False
-        
-        if (event.key() == Qt.Key_Left or event.key() == Qt.Key_Right or event.key() == Qt.Key_Up or event.key() == Qt.Key_Down) and 0 <= self.selected_index < len(self.rectangles if self.drawingType == "rect" else self.lines if self.drawingType == "line" else self.quadr if self.drawingType == "quadr" else self.del_rectangles):
-            if self.drawingType == "rect": 
-                new_rect = self.rectangles[self.selected_index]['rect'].translated(
-                    3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0,
-                    -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
-                try:
-                    del_size = int(self.rectangles[self.selected_index]['del_size'])
-                except:
-                    del_size = self.pixel_surface_del
-                new_outer = new_rect.adjusted(-del_size, -del_size, del_size, del_size)
-                conflict = any(new_outer.intersects(other['rect']) for j, other in enumerate(self.rectangles) if j != self.selected_index)
-                if not conflict:
-                    self.rectangles[self.selected_index]['rect'] = new_rect
-                    self.rectangles[self.selected_index]['del_rect'] = new_outer
-            elif self.drawingType == "line":
-                new_line = self.lines[self.selected_index].translated(3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0, -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
-                self.lines[self.selected_index] = new_line
-            elif self.drawingType == "quadr":
-                new_quadr = self.quadr[self.selected_index].translated(3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0, -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
-                self.quadr[self.selected_index] = new_quadr
-            elif self.drawingType == "del_rect": 
-                new_rect = self.del_rectangles[self.selected_index]['rect'].translated(
-                    3 if event.key() == Qt.Key_Right else -3 if event.key() == Qt.Key_Left else 0,
-                    -3 if event.key() == Qt.Key_Up else 3 if event.key() == Qt.Key_Down else 0)
-                conflict = any(new_rect.intersects(other['rect']) for j, other in enumerate(self.rectangles))
-                if not conflict:
-                    self.del_rectangles[self.selected_index]['rect'] = new_rect
-            self.updated.emit(True)
-        self.updateDesignElements()
-        self.update()
-
-    def updateDesignElements(self):
-        design_elements = []
-        #print(f"Rectangles: {self.rectangles}")
-        for object in self.rectangles:
-            rect = object['rect']
-            transform = QTransform()
-            rotation = object['rotation']
-            del_size = object['del_size']
-            center = rect.center()
-            transform.translate(center.x(), center.y())
-            transform.rotate(rotation)
-            transform.translate(-center.x(), -center.y())
-
-            pixelPoints = np.array([transform.map(rect.topLeft()), transform.map(rect.topRight()),
-                    transform.map(rect.bottomRight()), transform.map(rect.bottomLeft())])
-
-            dx_px = np.array([e.x() for e in pixelPoints]) - self.width()//2
-            dy_py = np.array([e.y() for e in pixelPoints]) - self.height()//2
-
-            dx_mm = dx_px*self.pixel_size*self.pixmapScreenSizeRatio #Check!
-            dy_mm = dy_py*self.pixel_size*self.pixmapScreenSizeRatio
-
-            pointsX = np.array([self.currentPosition[0] + dx_mm[i] for i in range(len(dx_mm))])
-            pointsY = np.array([self.currentPosition[1] - dy_mm[i] for i in range(len(dy_mm))]) 
-
-            pointsX = np.round(pointsX, 5)
-            pointsY = np.round(pointsY, 5)
-
-            design_elements.append(f"rect;{pointsX[0]};{pointsY[0]};{pointsX[1]};{pointsY[1]};{pointsX[2]};{pointsY[2]};{pointsX[3]};{pointsY[3]};{rotation};{del_size}")
-
-        for line in self.lines:
-            p1x = line.p1().x()
-            p1y = line.p1().y()
-            p2x = line.p2().x()
-            p2y = line.p2().y()
-
-
-            dx_px = np.array([p1x, p2x]) - self.width()//2
-            dy_py = np.array([p1y, p2y]) - self.height()//2
-
-            dx_mm = dx_px*self.pixel_size*self.pixmapScreenSizeRatio
-            dy_mm = dy_py*self.pixel_size*self.pixmapScreenSizeRatio
-
-            pointsX = np.array([self.currentPosition[0] + dx_mm[i] for i in range(len(dx_mm))])
-            pointsY = np.array([self.currentPosition[1] - dy_mm[i] for i in range(len(dy_mm))]) 
-
-            pointsX = np.round(pointsX, 5)
-            pointsY = np.round(pointsY, 5)
-
-            design_elements.append(f"line;{pointsX[0]};{pointsY[0]};{pointsX[1]};{pointsY[1]}")
-
-        for quadr in self.quadr:
-            pixelPoints = [quadr.at(i) for i in range(quadr.count())]
-
-            dx_px = np.array([e.x() for e in pixelPoints]) - self.width()//2
-            dy_py = np.array([e.y() for e in pixelPoints]) - self.height()//2
-
-            dx_mm = dx_px*self.pixel_size*self.pixmapScreenSizeRatio
-            dy_mm = dy_py*self.pixel_size*self.pixmapScreenSizeRatio
-
-            pointsX = np.array([self.currentPosition[0] + dx_mm[i] for i in range(len(dx_mm))])
-            pointsY = np.array([self.currentPosition[1] - dy_mm[i] for i in range(len(dy_mm))]) 
-
-            pointsX = np.round(pointsX, 5)
-            pointsY = np.round(pointsY, 5)
-
-            design_elements.append(f"quadr;{pointsX[0]};{pointsY[0]};{pointsX[1]};{pointsY[1]};{pointsX[2]};{pointsY[2]};{pointsX[3]};{pointsY[3]}")
-
-        for del_rect in self.del_rectangles:
-            rect = del_rect['rect']
-            transform = QTransform()
-            rotation = del_rect['rotation']
-    
-            center = rect.center()
-            transform.translate(center.x(), center.y())
-            transform.rotate(rotation)
-            transform.translate(-center.x(), -center.y())
-
-            pixelPoints = np.array([transform.map(rect.topLeft()), transform.map(rect.topRight()),
-                    transform.map(rect.bottomRight()), transform.map(rect.bottomLeft())])
-
-            dx_px = np.array([e.x() for e in pixelPoints]) - self.width()//2
-            dy_py = np.array([e.y() for e in pixelPoints]) - self.height()//2
-
-            dx_mm = dx_px*self.pixel_size*self.pixmapScreenSizeRatio
-            dy_mm = dy_py*self.pixel_size*self.pixmapScreenSizeRatio
-
-            pointsX = np.array([self.currentPosition[0] + dx_mm[i] for i in range(len(dx_mm))])
-            pointsY = np.array([self.currentPosition[1] - dy_mm[i] for i in range(len(dy_mm))]) 
-
-            pointsX = np.round(pointsX, 5)
-            pointsY = np.round(pointsY, 5)
-
-            design_elements.append(f"del_rect;{pointsX[0]};{pointsY[0]};{pointsX[1]};{pointsY[1]};{pointsX[2]};{pointsY[2]};{pointsX[3]};{pointsY[3]};{rotation}")
-
-
-        if self.designItems != design_elements:
-            self.designItems = design_elements
-            self.updated.emit(True)
-    
-    def setPixmap(self, pixmap): # Build the whole overlay view on top of the camera view
-        painter = QPainter(pixmap)
-
-        width = pixmap.width()
-        height = pixmap.height()
-        self.pixmapScreenSizeRatio = width/self.width()
-
-        self.centerX = width//2
-        self.centerY = height//2
-
+        painter.save()
+        painter.setPen(QPen(QColor(0, 255, 128), 2))
+        painter.setBrush(Qt.NoBrush)
+        transform = self.labelTransform()
+        for flake in self.flakes:
+            painter.drawPolygon(self.flakeOutline(flake, transform))
+        painter.restore()
+
+    def paintHud(self, painter): # In label pixels, independent of the sensor scaling
+        painter.save()
+        painter.setFont(QFont("Consolas", 10))
+        lineHeight = painter.fontMetrics().height()
+        hudWidth = max(painter.fontMetrics().horizontalAdvance(line) for line in self.hudLines) + 16
+        hudRect = QRectF(self.width() - hudWidth - 10, 10, hudWidth, lineHeight*len(self.hudLines) + 10)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 160))
+        painter.drawRect(hudRect)
+        painter.setPen(QColor(0, 255, 0))
+        for i, line in enumerate(self.hudLines):
+            painter.drawText(QRectF(hudRect.x()+8, hudRect.y()+5+i*lineHeight, hudWidth, lineHeight), Qt.AlignLeft, line)
+        painter.restore()
+
+    def paintFrame(self, painter): # Draw the camera frame scaled to the label with the grid, crosshair and scale bar on top (in sensor pixels)
+        if self.frame is None:
+            if self.statusText:
+                painter.save()
+                font = painter.font()
+                font.setPointSize(16)
+                painter.setFont(font)
+                painter.setPen(Qt.gray)
+                painter.drawText(QRectF(self.rect()), Qt.AlignCenter, self.statusText)
+                painter.restore()
+            return
+        width, height = self.sensorDimensions()
+        painter.save()
+        painter.scale(self.width()/width, self.height()/height)
+        if self.frameRect is None:
+            painter.drawImage(QRectF(0, 0, width, height), self.frame)
+        else: # Cropped and/or binned frame is drawn at its place on the sensor
+            painter.fillRect(QRectF(0, 0, width, height), Qt.black)
+            painter.drawImage(self.frameRect, self.frame)
+
+        painter.restore()
+        painter.drawImage(0, 0, self.staticOverlayLayer())
+
+    def staticOverlayLayer(self): # Transparent layer of the label size, only redrawn when the stage position, the pixel size or a size changes
+        width, height = self.sensorDimensions()
+        ratio = self.devicePixelRatioF()
+        key = (self.currentPosition[0], self.currentPosition[1], self.pixel_size, self.width(), self.height(), width, height, ratio)
+        if key != self.staticOverlayKey or self.staticOverlay is None:
+            self.staticOverlay = QImage(round(self.width()*ratio), round(self.height()*ratio), QImage.Format_ARGB32_Premultiplied)
+            self.staticOverlay.setDevicePixelRatio(ratio) # Sharp on high DPI screens
+            self.staticOverlay.fill(Qt.transparent)
+            painter = QPainter(self.staticOverlay)
+            painter.scale(self.width()/width, self.height()/height)
+            self.paintStaticOverlay(painter, width, height)
+            painter.end()
+            self.staticOverlayKey = key
+        return self.staticOverlay
+
+    def paintStaticOverlay(self, painter, width, height): # Grid with coordinates, crosshair with the position and the scale bar in sensor pixels
         anzahlStriche = 20
 
-        verticalStepSize = pixmap.width()/anzahlStriche
+        verticalStepSize = width/anzahlStriche
         horizontalStepSize = height/anzahlStriche
+        gridPixels = np.arange(anzahlStriche)[:, None]*(verticalStepSize, horizontalStepSize)
+        gridPositions = np.round(self.sensorTransform().toStage(gridPixels), 5).tolist() # Stage position of every grid line
 
         #print(f"Kästchen Größe: PIXEL({verticalStepSize}, {horizontalStepSize}), ABS({verticalStepSize*self.pixel_size}, {horizontalStepSize*self.pixel_size})")
         for i in range(anzahlStriche):
@@ -686,18 +885,13 @@ class ClickableCameraLabel(QLabel):
             )
 
             painter.setPen(QPen(Qt.red, 2))
-            font = painter.font()
-            font.setPointSize(12)
-            painter.setFont(font)
+            painter.setFont(self.gridFont)
 
             vertCoordTextRect = QRectF(
                 drawVertPosition+5, 5, 100, 16
             )
 
-            absolutePosition = (
-                round(float(self.currentPosition[0]+(i-10)*verticalStepSize*self.pixel_size), 5), 
-                round(float(self.currentPosition[1]-(i-10)*horizontalStepSize*self.pixel_size), 5) 
-                )
+            absolutePosition = gridPositions[i]
             painter.drawText(vertCoordTextRect, Qt.AlignLeft, f"{absolutePosition[0]}")
 
             horizCoordTextRect = QRectF(
@@ -705,242 +899,17 @@ class ClickableCameraLabel(QLabel):
             )
             painter.drawText(horizCoordTextRect, Qt.AlignLeft, f"{absolutePosition[1]}")
 
-        #print(f"GM Items: {self.designItems}")
-        rectanglesToAppend = []
-        linesToAppend = []
-        quadrToAppend = []
-        del_rectanglesToAppend = []
-        for item in self.designItems:
-            elementParts = item.split(";")
-            if not self.resizing_corner and not self.rotating and not self.drawing and not self.moving_offset:
-                if elementParts[0] == "line":
-                    startX = float(elementParts[1])
-                    startY = float(elementParts[2])
-                    endX = float(elementParts[3])
-                    endY = float(elementParts[4])
-
-                    coordinatesX = [startX, endX]
-                    coordinatesY = [startY, endY]
-
-                    inVisibleMap = True
-                    
-                    for e in range(len(coordinatesX)):
-                        distanceToAbsCenterPositionX = coordinatesX[e]-self.currentPosition[0]
-                        distanceInPixelX = distanceToAbsCenterPositionX/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionX = distanceInPixelX+self.width()//2
-                        if 0<pixelPositionX<width:
-                            coordinatesX[e] = pixelPositionX
-                        elif pixelPositionX<0:
-                            coordinatesX[e] = 0
-                        elif pixelPositionX>width:
-                            coordinatesX[e] = width
-
-                        distanceToAbsCenterPositionY = self.currentPosition[1]-coordinatesY[e]
-                        distanceInPixelY = distanceToAbsCenterPositionY/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionY = distanceInPixelY+self.height()//2
-                        if 0<pixelPositionY<height:
-                            coordinatesY[e] = pixelPositionY
-                        elif pixelPositionY<0:
-                            coordinatesY[e] = 0
-                        elif pixelPositionY>height:
-                            coordinatesY[e] = height
-
-                    if inVisibleMap:
-                        p1 = QPointF(coordinatesX[0], coordinatesY[0])
-                        p2 = QPointF(coordinatesX[1], coordinatesY[1])
-                        linesToAppend.append(QLineF(p1, p2))
-
-                elif elementParts[0] == "quadr":
-                    corner1X = float(elementParts[1])
-                    corner1Y = float(elementParts[2])
-                    corner2X = float(elementParts[3])
-                    corner2Y = float(elementParts[4])
-                    corner3X = float(elementParts[5])
-                    corner3Y = float(elementParts[6])
-                    corner4X = float(elementParts[7])
-                    corner4Y = float(elementParts[8])
-
-                    coordinatesX = [corner1X, corner2X, corner3X, corner4X]
-                    coordinatesY = [corner1Y, corner2Y, corner3Y, corner4Y]
-
-                    inVisibleMap = True
-                        
-                    for e in range(len(coordinatesX)):
-                        distanceToAbsCenterPositionX = coordinatesX[e]-self.currentPosition[0]
-                        distanceInPixelX = distanceToAbsCenterPositionX/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionX = distanceInPixelX+self.width()//2
-                        if 0<pixelPositionX<width:
-                            coordinatesX[e] = pixelPositionX
-                        elif pixelPositionX<0:
-                            coordinatesX[e] = 0
-                        elif pixelPositionX>width:
-                            coordinatesX[e] = width
-
-                        distanceToAbsCenterPositionY = self.currentPosition[1]-coordinatesY[e]
-                        distanceInPixelY = distanceToAbsCenterPositionY/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionY = distanceInPixelY+self.height()//2
-                        if 0<pixelPositionY<height:
-                            coordinatesY[e] = pixelPositionY
-                        elif pixelPositionY<0:
-                            coordinatesY[e] = 0
-                        elif pixelPositionY>height:
-                            coordinatesY[e] = height
-
-                    if inVisibleMap:
-                        quadr = QPolygonF([
-                            QPointF(coordinatesX[0], coordinatesY[0]),
-                            QPointF(coordinatesX[1], coordinatesY[1]),
-                            QPointF(coordinatesX[2], coordinatesY[2]),
-                            QPointF(coordinatesX[3], coordinatesY[3]),
-                        ])
-                        quadrToAppend.append(quadr)
-                               
-                                            
-                        """elif elementParts[0] == "arc":
-                            startX = float(elementParts[1])
-                            startY = float(elementParts[2])
-                            centerArcX = float(elementParts[3])
-                            centerArcY = float(elementParts[4])
-                            degrees = float(elementParts[5])
-                            #TO DO!
-                            if inVisibleMap:
-                                painter.setPen(QPen(Qt.black, 8, Qt.RoundCap))"""
-
-                elif elementParts[0] == "rect":
-                    corner1X = float(elementParts[1])
-                    corner1Y = float(elementParts[2])
-                    corner2X = float(elementParts[3])
-                    corner2Y = float(elementParts[4])
-                    corner3X = float(elementParts[5])
-                    corner3Y = float(elementParts[6])
-                    corner4X = float(elementParts[7])
-                    corner4Y = float(elementParts[8])
-                    rotation = float(elementParts[9])
-                    del_size = int(elementParts[10])
-
-                    coordinatesX = [corner1X, corner2X, corner3X, corner4X]
-                    coordinatesY = [corner1Y, corner2Y, corner3Y, corner4Y]
-
-                    inVisibleMap = True
-                        
-                    for e in range(len(coordinatesX)):
-                        distanceToAbsCenterPositionX = coordinatesX[e]-self.currentPosition[0]
-                        distanceInPixelX = distanceToAbsCenterPositionX/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionX = distanceInPixelX+self.width()//2
-                        if 0<pixelPositionX<width:
-                            coordinatesX[e] = pixelPositionX
-                        elif pixelPositionX<0:
-                            coordinatesX[e] = 0
-                        elif pixelPositionX>width:
-                            coordinatesX[e] = width
-
-                        distanceToAbsCenterPositionY = self.currentPosition[1]-coordinatesY[e]
-                        distanceInPixelY = distanceToAbsCenterPositionY/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionY = distanceInPixelY+self.height()//2
-                        if 0<pixelPositionY<height:
-                            coordinatesY[e] = pixelPositionY
-                        elif pixelPositionY<0:
-                            coordinatesY[e] = 0
-                        elif pixelPositionY>height:
-                            coordinatesY[e] = height
-
-                    topLeftPoint = QPointF(coordinatesX[0], coordinatesY[0])
-                    bottomRightPoint = QPointF(coordinatesX[2], coordinatesY[2])
-
-                    #print(f"Pixel rücktrafo: ({topLeftPoint}, {bottomRightPoint})")
-
-                    if inVisibleMap:
-                        rotatedCorners = [topLeftPoint, bottomRightPoint]
-                        rect = QRectF(rotatedCorners[0], rotatedCorners[1])
-                        center = rect.center()
-                        transform = QTransform()
-                        transform.translate(center.x(), center.y())
-                        transform.rotate(-rotation)
-                        transform.translate(-center.x(), -center.y())
-
-                        originalPoints = [transform.map(pt) for pt in rotatedCorners]
-                        originalRect = QRectF(originalPoints[0], originalPoints[1])
-                        outer_rect = originalRect.adjusted(-del_size, -del_size, del_size, del_size)
-                        rectanglesToAppend.append({'rect': originalRect, 'rotation': rotation, 'del_rect': outer_rect, 'del_size': del_size})
-
-                elif elementParts[0] == "del_rect":
-                    corner1X = float(elementParts[1])
-                    corner1Y = float(elementParts[2])
-                    corner2X = float(elementParts[3])
-                    corner2Y = float(elementParts[4])
-                    corner3X = float(elementParts[5])
-                    corner3Y = float(elementParts[6])
-                    corner4X = float(elementParts[7])
-                    corner4Y = float(elementParts[8])
-                    rotation = float(elementParts[9])
-
-                    coordinatesX = [corner1X, corner2X, corner3X, corner4X]
-                    coordinatesY = [corner1Y, corner2Y, corner3Y, corner4Y]
-
-                    inVisibleMap = True
-                        
-                    for e in range(len(coordinatesX)):
-                        distanceToAbsCenterPositionX = coordinatesX[e]-self.currentPosition[0]
-                        distanceInPixelX = distanceToAbsCenterPositionX/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionX = distanceInPixelX+self.width()//2
-                        if 0<pixelPositionX<width:
-                            coordinatesX[e] = pixelPositionX
-                        elif pixelPositionX<0:
-                            coordinatesX[e] = 0
-                        elif pixelPositionX>width:
-                            coordinatesX[e] = width
-
-                        distanceToAbsCenterPositionY = self.currentPosition[1]-coordinatesY[e]
-                        distanceInPixelY = distanceToAbsCenterPositionY/(self.pixel_size*self.pixmapScreenSizeRatio)
-                        pixelPositionY = distanceInPixelY+self.height()//2
-                        if 0<pixelPositionY<height:
-                            coordinatesY[e] = pixelPositionY
-                        elif pixelPositionY<0:
-                            coordinatesY[e] = 0
-                        elif pixelPositionY>height:
-                            coordinatesY[e] = height
-
-                    topLeftPoint = QPointF(coordinatesX[0], coordinatesY[0])
-                    bottomRightPoint = QPointF(coordinatesX[2], coordinatesY[2])
-
-                    if inVisibleMap:
-                        rotatedCorners = [topLeftPoint, bottomRightPoint]
-                        rect = QRectF(rotatedCorners[0], rotatedCorners[1])
-                        center = rect.center()
-                        transform = QTransform()
-                        transform.translate(center.x(), center.y())
-                        transform.rotate(-rotation)
-                        transform.translate(-center.x(), -center.y())
-
-                        originalPoints = [transform.map(pt) for pt in rotatedCorners]
-                        originalRect = QRectF(originalPoints[0], originalPoints[1])
-                        del_rectanglesToAppend.append({'rect': originalRect, 'rotation': rotation})
-
-
-            #print(f"Rectangles from GMItems {rectanglesToAppend}")
-        if not self.resizing_corner and not self.rotating and not self.drawing and not self.moving_offset:
-            if self.rectangles != rectanglesToAppend:
-                self.rectangles = rectanglesToAppend
-            if self.del_rectangles != del_rectanglesToAppend:
-                self.del_rectangles = del_rectanglesToAppend
-            if self.lines != linesToAppend:
-                self.lines = linesToAppend
-            if self.quadr != quadrToAppend:
-                self.quadr = quadrToAppend
-
-
         boldPen = QPen(Qt.darkRed, 3)
         painter.setPen(boldPen)
 
-        painter.drawLine(self.centerX-6, self.centerY, self.centerX+6, self.centerY)
-        painter.drawLine(self.centerX, self.centerY-6, self.centerX, self.centerY+6)
+        centerX, centerY = width//2, height//2
+        painter.drawLine(centerX-6, centerY, centerX+6, centerY)
+        painter.drawLine(centerX, centerY-6, centerX, centerY+6)
 
-        font = painter.font()
-        font.setPointSize(14)
-        painter.setFont(font)
+        painter.setFont(self.positionFont)
 
         currentPositionRect = QRectF(
-            self.centerX+10, self.centerY+10, 200, 20
+            centerX+10, centerY+10, 200, 20
         )
 
         painter.drawText(currentPositionRect, Qt.AlignLeft, f"({self.currentPosition[0]:.4f}, {self.currentPosition[1]:.4f})")
@@ -950,8 +919,8 @@ class ClickableCameraLabel(QLabel):
         scale_bar_rect_height = 80
         scale_bar_rect_margin = 30
 
-        scale_bar_x = pixmap.width() - scale_bar_rect_width-scale_bar_rect_margin
-        scale_bar_y = pixmap.height() - scale_bar_rect_height-scale_bar_rect_margin
+        scale_bar_x = width - scale_bar_rect_width-scale_bar_rect_margin
+        scale_bar_y = height - scale_bar_rect_height-scale_bar_rect_margin
 
         painter.setBrush(QBrush(QColor(255, 255, 255, 200)))
         painter.setPen(QPen(Qt.black, 1))
@@ -963,14 +932,10 @@ class ClickableCameraLabel(QLabel):
         painter.setPen(QPen(Qt.black, 5))
         painter.drawLine(line_x1, line_y, line_x1+line_length, line_y)
 
-        font = QFont("Arial", 18)
-        painter.setFont(font)
+        painter.setFont(self.scaleBarFont)
         painter.drawText(scale_bar_x, scale_bar_y+40, scale_bar_rect_width, 22, Qt.AlignCenter, "10 µm")
 
 
-        super().setPixmap(pixmap)
-        self.update()
-
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     win = ClickableCameraLabel()
@@ -0,0 +1,53 @@
+import numpy as np
+
+# Design items as stored in designItems (stage mm):
+#   rect;x1;y1;x2;y2;x3;y3;x4;y4;rotation;del_size
+#   del_rect;x1;y1;x2;y2;x3;y3;x4;y4;rotation
+#   quadr;x1;y1;x2;y2;x3;y3;x4;y4
+#   line;x1;y1;x2;y2
+# parsed once into one array of corners per shape type, (shapes, corners, 2) in mm, in the order of the items. The arrays
+# are views into vertices, the corners of all shapes stacked, so the live view converts the whole design to label pixels
+# with one ViewTransform call (split() gives the per type views of the result) and only when the stage moves, instead of
+# splitting the strings of every frame. Items of other types (arcs) or with broken fields are skipped
+class DesignGeometry:
+    CORNERS = {"rect": 4, "del_rect": 4, "quadr": 4, "line": 2}
+
+    def __init__(self, items):
+        self.items = list(items) # Copy, the list of the caller is edited in place
+        points = {kind: [] for kind in self.CORNERS}
+        rotations = {"rect": [], "del_rect": []}
+        delSizes = []
+        for item in self.items:
+            parts = item.split(";")
+            kind = parts[0]
+            corners = self.CORNERS.get(kind)
+            if corners is None or len(parts) < 1 + 2*corners + (kind == "rect") + (kind in rotations):
+                continue
+            try:
+                coordinates = [float(e) for e in parts[1:1 + 2*corners]]
+                rotation = float(parts[1 + 2*corners]) if kind in rotations else None
+                delSize = int(parts[2 + 2*corners]) if kind == "rect" else None
+            except ValueError:
+                continue
+            points[kind].append(coordinates)
+            if rotation is not None:
+                rotations[kind].append(rotation)
+            if delSize is not None:
+                delSizes.append(delSize)
+        self.counts = {kind: len(points[kind]) for kind in self.CORNERS}
+        self.vertices = np.array([value for kind in self.CORNERS for coordinates in points[kind] for value in coordinates], dtype=np.float64).reshape(-1, 2)
+        self.points = self.split(self.vertices)
+        self.rotations = {kind: np.array(values, dtype=np.float64) for kind, values in rotations.items()}
+        self.delSizes = np.array(delSizes, dtype=np.int64)
+
+    def matches(self, items): # False once the items were edited, compares the strings by identity first
+        return items == self.items
+
+    def split(self, vertices): # Per type views (shapes, corners, 2) of an array laid out like vertices
+        views = {}
+        start = 0
+        for kind, corners in self.CORNERS.items():
+            end = start + self.counts[kind]*corners
+            views[kind] = vertices[start:end].reshape(-1, corners, 2)
+            start = end
+        return views
@@ -0,0 +1,52 @@
+import time
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Runs the blocking part of bringing up a device (USB enumeration and open, serial port and handshake) in a worker thread,
+# so the window is painted right away and stays responsive. connect() must not touch widgets or create timers, whatever
+# has to happen in the UI thread is done in the slot of connected. The given exception types are the expected failures,
+# anything else is printed and reported with failed as well, so the window never waits for a connection that died. The
+# result and the error are also kept on the thread for a window closed while connecting
+class DeviceConnectThread(QThread):
+    connected = pyqtSignal(str, object, float) # device name, result of connect(), seconds it took
+    failed = pyqtSignal(str, object, float) # device name, exception, seconds it took
+
+    def __init__(self, name, connect, errors=(OSError,), parent=None):
+        super().__init__(parent)
+        self.name = name
+        self.connect = connect
+        self.errors = errors
+        self.result = None
+        self.error = None
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.result = self.connect()
+        except self.errors as e:
+            self.error = e
+            self.failed.emit(self.name, e, time.perf_counter() - start)
+            return
+        except Exception as e:
+            print(f"[Startup] {self.name} connect raised {type(e).__name__}: {e}")
+            self.error = e
+            self.failed.emit(self.name, e, time.perf_counter() - start)
+            return
+        self.connected.emit(self.name, self.result, time.perf_counter() - start)
+
+
+# Seconds from the start of the process (the time module import of the main script) to the first paint of the window and
+# to every connected device, printed as they come in
+class StartupTimer:
+    def __init__(self, start):
+        self.start = start
+        self.times = {}
+
+    def mark(self, event):
+        if event in self.times:
+            return False
+        self.times[event] = time.perf_counter() - self.start
+        print(f"[Startup] {event} after {self.times[event]:.2f} s")
+        return True
+
+    def snapshot(self):
+        return dict(self.times)
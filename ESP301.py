@@ -1,4 +1,5 @@
 import serial
+import threading
 import time
 import numpy as np
 from PyQt5.QtCore import QTimer, QObject, pyqtSignal, Qt
@@ -40,37 +41,52 @@ class ESP301(QObject):
             self.port = port
             if port == "": return
             try:
-                self.esp301 = serial.Serial(port=f"COM{port}", baudrate=baudrate, timeout=timeout)
-                self.connected = self.esp301.is_open
-                self.currentPosition = [self.getPosition(1), self.getPosition(2), self.getPosition(3)]
-                self.acceleration = self.getAcceleration()
-                self.velocity = self.getVelocity()
-                self.motor_on()
-                self.breakGroup() #In case Group existed
-                self.changeToCommandMode()
-                self.setLastDirectionsMotors()
-
+                self.open(port, baudrate, timeout)
+                self.initializeMotors()
             except serial.SerialException as e:
-                print(f"[Serial Error] Could not open port COM{port}: {e}")
-                self.currentPosition = [2.2, 3.1, 4.2]
-                self.esp301 = None
-                self.connected = False
-                self.status = ESP301Status.DISCONNECTED
-                self.updateStatus()
+                self.connectionFailed(port, e)
 
         else:
+            self.esp301 = None
             self.status = ESP301Status.DISCONNECTED
             self.connected = False
 
+    def open(self, port, baudrate=921600, timeout=1): # Opens the port and reads position and settings. No timers or widgets, can run in a worker thread (see DeviceStartup)
+        self.port = port
+        self.esp301 = serial.Serial(port=f"COM{port}", baudrate=baudrate, timeout=timeout)
+        self.currentPosition = [self.getPosition(1), self.getPosition(2), self.getPosition(3)]
+        self.acceleration = self.getAcceleration()
+        self.velocity = self.getVelocity()
+        return self
+
+    def initializeMotors(self): # Second part of connecting, in the UI thread: the status polling and group moves use timers
+        self.connected = self.esp301.is_open
+        self.motor_on()
+        self.breakGroup() #In case Group existed
+        self.changeToCommandMode()
+        self.setLastDirectionsMotors()
+
+    def connectionFailed(self, port, error):
+        print(f"[Serial Error] Could not open port COM{port}: {error}")
+        self.currentPosition = [2.2, 3.1, 4.2]
+        self.esp301 = None
+        self.connected = False
+        self.status = ESP301Status.DISCONNECTED
+        self.updateStatus()
+
+    def setBusyCursor(self, busy): # Only from the UI thread, commands of open() come from a worker thread
+        if threading.current_thread() is threading.main_thread():
+            self.parentWidget.setCursor(Qt.WaitCursor if busy else Qt.ArrowCursor)
+
 
 
     def send_command(self, command:str): # Send a command and wait for response
         if self.esp301 != None:
             full_command = command + '\r'
             self.esp301.write(full_command.encode())
-            self.parentWidget.setCursor(Qt.WaitCursor)
+            self.setBusyCursor(True)
             time.sleep(0.2)
-            self.parentWidget.setCursor(Qt.ArrowCursor)
+            self.setBusyCursor(False)
             response = self.esp301.read_all().decode().strip()
             return response
         else:
@@ -233,7 +249,7 @@ class ESP301(QObject):
         value = self.safeFloat(self.send_command(f"{axis}TP?"))
         self.currentMotorsPosition[axis-1] = value
         if self.motorHasOffset[axis-1]:
-            return round((value-self.backlash[axis-1]) if self.lastMotorDirection == 1 else (value+self.backlash[axis-1]), 5)
+            return round((value-self.backlash[axis-1]) if self.lastMotorDirection[axis-1] == 1 else (value+self.backlash[axis-1]), 5)
         return round(value, 5)
 
 
@@ -284,10 +300,10 @@ class ESP301(QObject):
                 offsetedCurrentPosition = floatFetchedCurrentPosition
                 updateCurrentPosition = True
                 if self.motorHasOffset[axisInMov-1]:
-                    offsetedCurrentPosition = (floatFetchedCurrentPosition-self.backlash[axisInMov-1]) if self.lastMotorDirection == 1 else (floatFetchedCurrentPosition+self.backlash[axisInMov-1])
-                    if (offsetedCurrentPosition<self.currentPosition[axisInMov-1] if self.lastMotorDirection == 1 else offsetedCurrentPosition>self.currentPosition[axisInMov-1]):
+                    offsetedCurrentPosition = (floatFetchedCurrentPosition-self.backlash[axisInMov-1]) if self.lastMotorDirection[axisInMov-1] == 1 else (floatFetchedCurrentPosition+self.backlash[axisInMov-1])
+                    if (offsetedCurrentPosition<self.currentPosition[axisInMov-1] if self.lastMotorDirection[axisInMov-1] == 1 else offsetedCurrentPosition>self.currentPosition[axisInMov-1]):
                         updateCurrentPosition = False
-                elif (self.currentPosition[axisInMov-1]<self.currentMotorsPosition[axisInMov-1] if self.lastMotorDirection == 1 else self.currentPosition[axisInMov-1]>self.currentMotorsPosition[axisInMov-1]):
+                elif (self.currentPosition[axisInMov-1]<self.currentMotorsPosition[axisInMov-1] if self.lastMotorDirection[axisInMov-1] == 1 else self.currentPosition[axisInMov-1]>self.currentMotorsPosition[axisInMov-1]):
                     updateCurrentPosition = False
 
                 if updateCurrentPosition:
@@ -306,10 +322,10 @@ class ESP301(QObject):
                     updateCurrentPosition = [True, True]
                     for axis in range(len(floatFetchedPositionXY)):
                         if self.motorHasOffset[axis]:
-                            offsetedCurrentPosition[axis] = (floatFetchedPositionXY[axis]-self.backlash[axis]) if self.lastMotorDirection == 1 else (floatFetchedPositionXY[axis]+self.backlash[axis])
-                            if (offsetedCurrentPosition[axis]<self.currentPosition[axis] if self.lastMotorDirection == 1 else offsetedCurrentPosition[axis]>self.currentPosition[axis]):
+                            offsetedCurrentPosition[axis] = (floatFetchedPositionXY[axis]-self.backlash[axis]) if self.lastMotorDirection[axis] == 1 else (floatFetchedPositionXY[axis]+self.backlash[axis])
+                            if (offsetedCurrentPosition[axis]<self.currentPosition[axis] if self.lastMotorDirection[axis] == 1 else offsetedCurrentPosition[axis]>self.currentPosition[axis]):
                                 updateCurrentPosition[axis] = False
-                        elif (self.currentPosition[axis]<self.currentMotorsPosition[axis] if self.lastMotorDirection == 1 else self.currentPosition[axis]>self.currentMotorsPosition[axis]):
+                        elif (self.currentPosition[axis]<self.currentMotorsPosition[axis] if self.lastMotorDirection[axis] == 1 else self.currentPosition[axis]>self.currentMotorsPosition[axis]):
                             updateCurrentPosition[axis] = False
                         
                     if updateCurrentPosition[0]: self.currentPosition[0] = round(offsetedCurrentPosition[0], 5)
@@ -526,7 +542,7 @@ class ESP301(QObject):
             value = self.safeFloat(fetchedPositionXY[axis])
             self.currentMotorsPosition[axis] = value
             if self.motorHasOffset[axis]:
-                returnPosition += str((value-self.backlash[axis]) if self.lastMotorDirection == 1 else (value+self.backlash[axis]))
+                returnPosition += str((value-self.backlash[axis]) if self.lastMotorDirection[axis] == 1 else (value+self.backlash[axis]))
             else: returnPosition += fetchedPositionXY[axis]
             returnPosition += ","
         returnPosition = returnPosition[:-1]
@@ -0,0 +1,216 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import partial
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import ConvexHull, QhullError
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# Segments candidate flakes by their optical contrast against the substrate on the green channel of a frame:
+#   contrast = (substrate - intensity)/substrate   (graphene on SiO2/Si is darker, thick flakes can be brighter)
+# The frame is block averaged by downsample, the substrate is estimated locally (substrateBackground) unless a level is
+# given. Pixels within [minContrast, maxContrast] are opened, labelled, and the region statistics (area, mean contrast,
+# centroid, orientation and extent along the principal axes) are computed for all regions at once with bincount and
+# ndimage reductions.
+# Returns (substrate, flakes), flakes sorted by area with coordinates in frame pixels:
+#   center (x, y), size (length along angle, width), angle (degrees, clockwise in the image), area (pixels), contrast,
+#   outline (convex hull of the region boundary, [[x, y], ...])
+def detectFlakes(green, downsample=4, substrate=None, minContrast=0.04, maxContrast=1.0, minArea=400, maxFlakes=200):
+    d = downsample
+    height, width = green.shape[0] - green.shape[0] % d, green.shape[1] - green.shape[1] % d
+    image = green[:height, :width].reshape(height//d, d, width//d, d).mean(axis=(1, 3), dtype=np.float32)
+    if substrate is None:
+        background = substrateBackground(image)
+        substrate = float(np.median(background))
+    else:
+        background = np.float32(max(substrate, 1.0))
+    contrast = (background - image)/background
+    magnitude = np.abs(contrast)
+    mask = ndimage.binary_opening((magnitude >= minContrast) & (magnitude <= maxContrast))
+    labels, count = ndimage.label(mask)
+    if count == 0:
+        return substrate, []
+
+    # Per region sums over the foreground pixels only
+    rows, columns = np.nonzero(labels)
+    regions = labels[rows, columns]
+    area = np.bincount(regions, minlength=count + 1).astype(np.float64)
+    area[0] = 1
+    meanX = np.bincount(regions, columns, count + 1)/area
+    meanY = np.bincount(regions, rows, count + 1)/area
+    dx, dy = columns - meanX[regions], rows - meanY[regions]
+    covXX = np.bincount(regions, dx*dx, count + 1)/area
+    covYY = np.bincount(regions, dy*dy, count + 1)/area
+    covXY = np.bincount(regions, dx*dy, count + 1)/area
+    meanContrast = np.bincount(regions, contrast[rows, columns], count + 1)/area
+    angle = 0.5*np.arctan2(2*covXY, covXX - covYY) # Major axis
+    cos, sin = np.cos(angle), np.sin(angle)
+    u = dx*cos[regions] + dy*sin[regions]
+    v = -dx*sin[regions] + dy*cos[regions]
+    index = np.arange(1, count + 1)
+    uMin, uMax = ndimage.minimum(u, regions, index), ndimage.maximum(u, regions, index)
+    vMin, vMax = ndimage.minimum(v, regions, index), ndimage.maximum(v, regions, index)
+
+    area[0] = 0
+    keep = np.nonzero(area[1:]*d*d >= minArea)[0] + 1
+    keep = keep[np.argsort(-area[keep])][:maxFlakes]
+    boxes = ndimage.find_objects(labels)
+    flakes = []
+    for region in keep:
+        i = region - 1
+        # Box center: the centroid shifted to the middle of the extent along both axes
+        cu, cv = (uMin[i] + uMax[i])/2, (vMin[i] + vMax[i])/2
+        centerX = meanX[region] + cu*cos[region] - cv*sin[region]
+        centerY = meanY[region] + cu*sin[region] + cv*cos[region]
+        flakes.append({
+            "center": (float((centerX + 0.5)*d), float((centerY + 0.5)*d)),
+            "size": (float((uMax[i] - uMin[i] + 1)*d), float((vMax[i] - vMin[i] + 1)*d)),
+            "angle": float(np.degrees(angle[region])),
+            "area": float(area[region]*d*d),
+            "contrast": float(meanContrast[region]),
+            "outline": regionOutline(labels[boxes[i]] == region, boxes[i], d),
+        })
+    return substrate, flakes
+
+
+# Substrate level under uneven illumination: median of 8 x 8 block means over a window of 7 x 7 blocks, flakes smaller
+# than about half the window do not shift it. Interpolated back to the image size
+def substrateBackground(image, block=8, window=7):
+    height, width = image.shape[0] - image.shape[0] % block, image.shape[1] - image.shape[1] % block
+    if height == 0 or width == 0:
+        return np.full(image.shape, max(float(np.median(image)), 1.0), dtype=np.float32)
+    coarse = image[:height, :width].reshape(height//block, block, width//block, block).mean(axis=(1, 3))
+    coarse = ndimage.median_filter(coarse, size=window, mode="nearest")
+    background = ndimage.zoom(coarse, (image.shape[0]/coarse.shape[0], image.shape[1]/coarse.shape[1]), order=1, mode="nearest", grid_mode=True)
+    return np.maximum(background, 1.0).astype(np.float32)
+
+
+def regionOutline(regionMask, box, downsample): # Convex hull of the boundary pixels in frame pixels
+    boundary = regionMask & ~ndimage.binary_erosion(regionMask)
+    rows, columns = np.nonzero(boundary)
+    points = np.column_stack(((columns + box[1].start + 0.5)*downsample, (rows + box[0].start + 0.5)*downsample))
+    try:
+        return points[ConvexHull(points).vertices].tolist()
+    except (QhullError, ValueError): # Fewer than 3 points or all on a line
+        return points.tolist()
+
+
+# Frame pixel -> stage mm with the transform (x0, y0, mm per pixel) of the frame: X = x0 + x*scale, Y = y0 - y*scale
+def flakesToStage(flakes, transform):
+    x0, y0, scale = transform
+    return [{
+        "center": (round(x0 + flake["center"][0]*scale, 5), round(y0 - flake["center"][1]*scale, 5)),
+        "size": (flake["size"][0]*scale, flake["size"][1]*scale),
+        "angle": flake["angle"],
+        "area_um2": flake["area"]*(scale*1000)**2,
+        "contrast": flake["contrast"],
+        "outline": [(x0 + x*scale, y0 - y*scale) for x, y in flake["outline"]],
+    } for flake in flakes]
+
+
+# Flakes in overlapping mosaic tiles are found twice: keeps the larger one of flakes whose centers are closer than
+# half the width of the smaller one
+def mergeDuplicates(flakes, cell=0.1):
+    grid = {}
+    merged = []
+    for flake in sorted(flakes, key=lambda flake: -flake["area_um2"]):
+        x, y = flake["center"]
+        cellX, cellY = int(x//cell), int(y//cell)
+        duplicate = False
+        for other in (merged[i] for gx in (cellX - 1, cellX, cellX + 1) for gy in (cellY - 1, cellY, cellY + 1) for i in grid.get((gx, gy), [])):
+            if (x - other["center"][0])**2 + (y - other["center"][1])**2 < (min(flake["size"])/2)**2:
+                duplicate = True
+                break
+        if not duplicate:
+            grid.setdefault((cellX, cellY), []).append(len(merged))
+            merged.append(flake)
+    return merged
+
+
+# Runs detectFlakes in worker processes, so neither the camera view nor the acquisition thread wait for it.
+# As frame consumer it takes the green channel of a frame every interval seconds when the previous frame is done, results
+# are converted to stage mm with the frame transform from the moment the frame was pulled and emitted in the UI thread.
+# Mosaic tiles are queued with detectTile() from the tile writer and collected with takeTileFlakes() at the end of a scan
+class FlakeDetector(QObject):
+    flakesDetected = pyqtSignal(list, float) # flakes of the latest live frame (stage mm), substrate level
+    tileFlakesDetected = pyqtSignal(list) # flakes of one mosaic tile (stage mm)
+
+    def __init__(self, transformProvider, interval=0.5, workers=2, parent=None, **parameters):
+        super().__init__(parent)
+        self.transformProvider = transformProvider # returns (x0, y0, mm per pixel) of the current frame, see flakesToStage
+        self.interval = interval
+        self.workers = workers
+        self.parameters = parameters # detectFlakes keyword arguments
+        self.executor = None
+        self.lock = threading.Lock()
+        self.liveJob = None
+        self.lastSubmit = 0
+        self.tileJobs = set()
+        self.tileFlakes = []
+
+    def start(self): # Worker processes are spawned on first use, the first result takes a moment longer
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, green, callback):
+        with self.lock:
+            if self.executor is None:
+                return None
+            try:
+                job = self.executor.submit(detectFlakes, green, **self.parameters)
+            except RuntimeError: # Shut down meanwhile
+                return None
+        job.add_done_callback(callback)
+        return job
+
+    def __call__(self, buf, info, pullTime): # Frame consumer, runs in the acquisition thread
+        if self.liveJob is not None and not self.liveJob.done() or pullTime - self.lastSubmit < self.interval:
+            return
+        channels = buf.shape[1]//info.width
+        green = np.array(buf[:info.height, 1:info.width*channels:channels]) # Green is the middle byte for BGR(X) and RGB
+        self.lastSubmit = pullTime
+        self.liveJob = self.submit(green, partial(self.liveFinished, self.transformProvider()))
+
+    def liveFinished(self, transform, job):
+        if job.cancelled() or job.exception() is not None:
+            return
+        substrate, flakes = job.result()
+        self.flakesDetected.emit(flakesToStage(flakes, transform), substrate)
+
+    def detectTile(self, rgb, x, y, pixelSize): # Tile centered on the stage position x, y (mm), can be called from any thread
+        self.start()
+        height, width = rgb.shape[:2]
+        transform = (x - width/2*pixelSize, y + height/2*pixelSize, pixelSize)
+        job = self.submit(np.ascontiguousarray(rgb[:, :, 1]), partial(self.tileFinished, transform))
+        if job is not None:
+            with self.lock:
+                self.tileJobs.add(job)
+
+    def tileFinished(self, transform, job):
+        with self.lock:
+            self.tileJobs.discard(job)
+        if job.cancelled() or job.exception() is not None:
+            return
+        flakes = flakesToStage(job.result()[1], transform)
+        with self.lock:
+            self.tileFlakes.extend(flakes)
+        self.tileFlakesDetected.emit(flakes)
+
+    def takeTileFlakes(self, timeout=30): # Waits for the queued tiles, returns their flakes without duplicates from overlaps
+        with self.lock:
+            jobs = set(self.tileJobs)
+        wait(jobs, timeout)
+        deadline = time.perf_counter() + 1
+        while self.tileJobs and time.perf_counter() < deadline: # Done callbacks may still be running
+            time.sleep(0.01)
+        with self.lock:
+            flakes, self.tileFlakes = self.tileFlakes, []
+        return mergeDuplicates(flakes)
+
+    def stop(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
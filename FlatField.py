@@ -0,0 +1,145 @@
+import glob
+import math
+import os
+import re
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Flat-field and dark-frame references on disk, one set per exposure setting and frame size, named <kind>_<key>.<ext>:
+#   dark_<key>.npy  mean of the dark frames (float32, height x width x channels)
+#   flat_<key>.npy  mean of the flat frames (float32)
+#   gain_<key>.npy  float32 gain map derived from flat and dark, what the software correction loads at startup
+#   dark_<key>.dfc, flat_<key>.ffc  references exported by cameras with hardware correction (DfcExport/FfcExport)
+# Arrays are loaded memory-mapped. Without a reference for the exposure the one with the nearest exposure time is used
+class FlatFieldStore:
+    def __init__(self, directory="Calibration"):
+        self.directory = directory
+
+    @staticmethod
+    def key(exposureTime, gain, width, height): # exposureTime in us, analog gain in percent
+        return f"{int(exposureTime)}us_g{int(gain)}_{width}x{height}"
+
+    def path(self, kind, key, extension="npy"):
+        return os.path.join(self.directory, f"{kind}_{key}.{extension}")
+
+    def save(self, kind, key, array):
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(self.path(kind, key), array)
+
+    def find(self, kind, exposureTime, gain, width, height, extension="npy"): # Path of the reference with the nearest exposure time, None if there is none
+        pattern = re.compile(rf"{kind}_(\d+)us_g{int(gain)}_{width}x{height}\.{extension}$")
+        candidates = []
+        for path in glob.glob(os.path.join(self.directory, f"{kind}_*.{extension}")):
+            match = pattern.match(os.path.basename(path))
+            if match:
+                candidates.append((abs(math.log(max(int(match.group(1)), 1)/max(exposureTime, 1))), path))
+        return min(candidates)[1] if candidates else None
+
+    def load(self, kind, exposureTime, gain, width, height):
+        path = self.find(kind, exposureTime, gain, width, height)
+        return np.load(path, mmap_mode="r") if path is not None else None
+
+
+# Gain map that makes the flat uniform: mean(flat - dark)/(flat - dark) per channel, limited to gainRange where the flat
+# is (nearly) black. A fourth channel (X of RGB32) keeps a gain of 1
+def gainMap(flat, dark=None, gainRange=(0.25, 4.0)):
+    signal = np.array(flat, dtype=np.float32)
+    if dark is not None:
+        signal -= dark
+    np.maximum(signal, 1.0, out=signal)
+    gain = np.ones_like(signal)
+    for channel in range(min(signal.shape[2], 3)):
+        gain[:, :, channel] = signal[:, :, channel].mean()/signal[:, :, channel]
+    return np.clip(gain, *gainRange, out=gain)
+
+
+# Software correction, applied in place to every frame in the acquisition thread (CameraAcquisitionThread.setFrameFilter):
+#   frame = (frame - dark)*gain
+# The dark frame is subtracted in uint8 (saturating at 0), only the gain is applied in float32. The frame is processed in
+# blocks of rows that fit into the cache, so the float32 intermediate never goes to memory
+class FlatFieldCorrection:
+    def __init__(self):
+        self.dark = None # uint8 (height, width, channels), None for no dark frame
+        self.gain = None # float32 (height, width, channels), None for no flat
+        self.rows = 8
+
+    def setReferences(self, dark=None, gain=None): # Frame layout arrays, copied to memory
+        self.dark = np.ascontiguousarray(np.clip(np.rint(dark), 0, 255), dtype=np.uint8) if dark is not None else None
+        self.gain = np.ascontiguousarray(gain, dtype=np.float32) if gain is not None else None
+        shape = self.gain.shape if self.gain is not None else self.dark.shape if self.dark is not None else None
+        if shape is not None:
+            self.rows = max(1, (1 << 16)//(shape[1]*shape[2])) # About 64 kB of frame and 256 kB of float32 per block
+            self.scratch = np.empty((self.rows,) + shape[1:], dtype=np.float32)
+            self.scratch8 = np.empty((self.rows,) + shape[1:], dtype=np.uint8)
+
+    def __call__(self, buf):
+        reference = self.gain if self.gain is not None else self.dark
+        if reference is None:
+            return
+        height, width, channels = reference.shape
+        if buf.shape[0] < height or buf.shape[1] < width*channels:
+            return # Frame of another size (focus window) than the references
+        pixels = buf[:height, :width*channels].reshape(height, width, channels)
+        for row in range(0, height, self.rows):
+            block = pixels[row:row+self.rows]
+            count = len(block)
+            if self.dark is not None:
+                dark = self.dark[row:row+count]
+                source = self.scratch8[:count]
+                np.maximum(block, dark, out=source)
+                np.subtract(source, dark, out=source)
+                if self.gain is None:
+                    block[...] = source
+                    continue
+            else:
+                source = block
+            scratch = self.scratch[:count]
+            np.multiply(source, self.gain[row:row+count], out=scratch, dtype=np.float32)
+            np.add(scratch, 0.5, out=scratch)
+            np.minimum(scratch, 255, out=scratch)
+            np.copyto(block, scratch, casting="unsafe")
+
+
+# Captures a dark or flat reference as the mean of frames frames, like the autofocus with a FrameGrabber registered as
+# frame consumer. Saves the mean and the gain map of the exposure key (from the flat and the nearest dark) to the store
+class ReferenceCaptureThread(QThread):
+    captured = pyqtSignal(str, str) # kind, key
+    failed = pyqtSignal(str)
+
+    def __init__(self, kind, grabber, store, exposure, frames=16, parent=None):
+        super().__init__(parent)
+        self.kind = kind # "dark" or "flat"
+        self.grabber = grabber
+        self.store = store
+        self.exposure = exposure # (exposure time us, analog gain)
+        self.frames = frames
+        self.running = True
+
+    def run(self):
+        total = None
+        for i in range(self.frames):
+            self.grabber.request(skipFrames=1 if i == 0 else 0) # The first frame may still be corrected or averaged
+            frame = self.grabber.wait()
+            if frame is None or not self.running:
+                self.failed.emit("no camera frame" if self.running else "stopped")
+                return
+            if total is None:
+                total = np.zeros(frame.shape, dtype=np.float32)
+            total += frame
+        mean = total/self.frames
+        height, width = mean.shape[:2]
+        key = self.store.key(*self.exposure, width, height)
+        try:
+            self.store.save(self.kind, key, mean)
+            flat = mean if self.kind == "flat" else self.store.load("flat", *self.exposure, width, height)
+            if flat is not None:
+                dark = mean if self.kind == "dark" else self.store.load("dark", *self.exposure, width, height)
+                self.store.save("gain", key, gainMap(flat, dark))
+        except OSError as e:
+            self.failed.emit(f"reference not saved: {e}")
+            return
+        self.captured.emit(self.kind, key)
+
+    def stop(self):
+        self.running = False
+        self.wait()
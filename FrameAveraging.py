@@ -0,0 +1,43 @@
+import numpy as np
+
+# Exponential moving average of the live frames, applied in place in the acquisition thread (see
+# CameraAcquisitionThread.setFrameFilter) so the view, stills and frame consumers all get the denoised frame.
+# Fixed point in uint16: acc holds the average times 2^k and is updated as acc += frame - acc/2^k, which is an
+# exponential filter with a weight of 1/2^k for the newest frame (noise reduced like averaging about 2^k frames).
+# The accumulators are allocated on the first frame and whenever the frame size changes, not per frame.
+# reset() (stage moved) restarts from the next frame, while hold is set (stage moving) frames pass unchanged
+class FrameAverager:
+    def __init__(self, frames=4):
+        self.shift = 0
+        self.setFrames(frames)
+        self.accumulator = None
+        self.average = None # acc >> k of the last frame, also the acc/2^k term of the next update
+        self.resetPending = True
+        self.hold = False
+
+    def setFrames(self, frames): # Rounded to a power of two between 2 and 256
+        self.shift = min(max(int(round(np.log2(max(frames, 2)))), 1), 8)
+        self.resetPending = True
+
+    def frames(self):
+        return 1 << self.shift
+
+    def reset(self): # Can be called from any thread, the acquisition thread restarts the average with the next frame
+        self.resetPending = True
+
+    def __call__(self, buf):
+        if self.hold:
+            self.resetPending = True
+            return
+        if self.resetPending or self.accumulator is None or self.accumulator.shape != buf.shape:
+            if self.accumulator is None or self.accumulator.shape != buf.shape:
+                self.accumulator = np.empty(buf.shape, dtype=np.uint16)
+                self.average = np.empty(buf.shape, dtype=np.uint16)
+            self.resetPending = False
+            np.left_shift(buf, self.shift, out=self.accumulator, dtype=np.uint16)
+            np.copyto(self.average, buf)
+            return
+        np.subtract(self.accumulator, self.average, out=self.accumulator)
+        np.add(self.accumulator, buf, out=self.accumulator, casting="unsafe")
+        np.right_shift(self.accumulator, self.shift, out=self.average)
+        buf[...] = self.average
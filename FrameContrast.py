@@ -0,0 +1,80 @@
+import numpy as np
+
+# Contrast stretch of the live view for thin flakes: every channel is mapped linearly from its levels (low, high) to
+# 0..255 with a lookup table. The levels come from a histogram of every subsample-th row and column, taken every
+# interval frames, clip percent of the pixels saturate at each end.
+# The 256 entry tables are only rebuilt when the levels change. For RGB32 frames they are combined into one table over
+# byte pairs (B|G in the first, R|X in the second 65536 uint16 entries), so the contiguous uint16 rows of the frame are
+# mapped with one np.take instead of one take per strided channel view. np.take converts its indices to intp, so the
+# rows go in blocks of about 64 kB of frame that keep the index array in the cache (the pair offset is added into it).
+# Frames are mapped into a separate display buffer: consumers, recordings and stills keep the raw frames
+class ContrastStretch:
+    def __init__(self, interval=5, subsample=8, clip=0.5, minRange=16):
+        self.interval = interval
+        self.subsample = subsample
+        self.clip = clip
+        self.minRange = minRange # Levels closer than this are spread around their middle, noise is not stretched to full scale
+        self.reset()
+
+    def reset(self): # Levels are measured again with the next frame
+        self.levels = None # (low, high) per channel in memory order
+        self.tables = None
+        self.frames = 0
+        self.offsets = None # Table offset of every uint16 of a RGB32 row, 0 for B|G and 65536 for R|X
+        self.indices = None # Block of intp indices into the pair table
+
+    def measure(self, pixels): # (low, high) per channel of a (height, width, channels) view
+        sample = pixels[::self.subsample, ::self.subsample]
+        levels = []
+        for channel in range(min(sample.shape[2], 3)):
+            cumulative = np.cumsum(np.bincount(sample[:, :, channel].ravel(), minlength=256))
+            total = cumulative[-1]
+            low = int(np.searchsorted(cumulative, total*self.clip/100))
+            high = int(np.searchsorted(cumulative, total*(1 - self.clip/100)))
+            if high - low < self.minRange:
+                middle = (low + high)//2
+                low, high = max(middle - self.minRange//2, 0), min(middle + self.minRange//2, 255)
+            levels.append((low, high))
+        return levels
+
+    def channelTables(self, levels, channels): # (channels, 256) uint8, padding bytes (X of RGB32) are kept
+        values = np.arange(256, dtype=np.float32)
+        tables = np.tile(np.arange(256, dtype=np.uint8), (channels, 1))
+        for channel, (low, high) in enumerate(levels):
+            tables[channel] = np.clip(np.rint((values - low)*(255/max(high - low, 1))), 0, 255).astype(np.uint8)
+        return tables
+
+    def buildTables(self, levels, channels):
+        tables = self.channelTables(levels, channels)
+        if channels != 4:
+            return tables
+        pairs = np.arange(65536, dtype=np.uint16) # Little endian: the first byte of a pair is the low byte
+        low, high = pairs & 0xff, pairs >> 8
+        return np.concatenate([tables[0][low].astype(np.uint16) | tables[1][high].astype(np.uint16) << 8,
+                               tables[2][low].astype(np.uint16) | tables[3][high].astype(np.uint16) << 8])
+
+    def __call__(self, buf, out, width, height, channels): # Maps the (height, stride) frame buf into out (same shape)
+        pixels = buf[:height, :width*channels].reshape(height, width, channels)
+        if self.frames % self.interval == 0:
+            levels = self.measure(pixels)
+            if levels != self.levels:
+                self.levels = levels
+                self.tables = self.buildTables(levels, channels)
+        self.frames += 1
+        if channels == 4:
+            if self.offsets is None or len(self.offsets) != width*2:
+                self.offsets = np.tile(np.array([0, 65536], dtype=np.intp), width)
+                self.indices = np.empty((max(1, (1 << 16)//(width*4)), width*2), dtype=np.intp)
+            pairs = buf[:height, :width*4].view(np.uint16)
+            outPairs = out[:height, :width*4].view(np.uint16)
+            rows = len(self.indices)
+            for row in range(0, height, rows):
+                block = pairs[row:row+rows]
+                indices = self.indices[:len(block)]
+                np.add(block, self.offsets, out=indices)
+                np.take(self.tables, indices, out=outPairs[row:row+rows], mode="clip")
+        else:
+            outPixels = out[:height, :width*channels].reshape(height, width, channels)
+            for channel in range(channels):
+                np.take(self.tables[channel], pixels[:, :, channel], out=outPixels[:, :, channel], mode="clip")
+        return out
@@ -0,0 +1,99 @@
+import threading
+import numpy as np
+
+# Fixed-bin latency histogram in milliseconds, values above the last bin are counted in it
+class LatencyHistogram:
+    def __init__(self, maxMs=500, binMs=0.5):
+        self.binMs = binMs
+        self.counts = np.zeros(int(maxMs/binMs), dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, ms):
+        self.counts[min(max(int(ms/self.binMs), 0), len(self.counts)-1)] += 1
+        self.count += 1
+        self.total += ms
+        self.maximum = max(self.maximum, ms)
+
+    def percentile(self, p): # Upper edge of the bin containing the p-th percentile, 0 without samples
+        if self.count == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count*p/100))
+        return (index+1)*self.binMs
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total/self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.maximum,
+        }
+
+
+# Frame sequence and latency statistics of the live view, fed by the acquisition thread (onPull) and the UI thread (onPaint).
+# The sensor timestamps come from the camera clock: the offset to the host clock is taken as the smallest observed
+# pull time - sensor time, so sensor latencies are relative to the fastest frame seen (transfer time of that frame excluded)
+class FrameMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.lastSeq = None
+            self.received = 0
+            self.lost = 0 # Frames missing in the sequence numbers (lost by camera, driver or a too slow pull)
+            self.gaps = 0
+            self.clockOffset = None
+            self.sensorToPull = LatencyHistogram()
+            self.pullToPaint = LatencyHistogram()
+            self.sensorToPaint = LatencyHistogram()
+
+    def onPull(self, seq, timestamp, pullTime): # pullTime: time.perf_counter() after PullImageV2
+        with self.lock:
+            self.received += 1
+            if self.lastSeq is not None:
+                missing = (seq - self.lastSeq - 1) & 0xffffffff
+                if 0 < missing < 0x80000000: # Larger jumps (backwards) are a restarted stream, not lost frames
+                    self.lost += missing
+                    self.gaps += 1
+            self.lastSeq = seq
+            offset = pullTime - timestamp/1e6
+            if self.clockOffset is None or offset < self.clockOffset:
+                self.clockOffset = offset
+            self.sensorToPull.add((offset - self.clockOffset)*1000)
+
+    def onPaint(self, timestamp, pullTime, paintTime): # paintTime: time.perf_counter() after the frame was painted
+        with self.lock:
+            self.pullToPaint.add((paintTime - pullTime)*1000)
+            if self.clockOffset is not None:
+                self.sensorToPaint.add((paintTime - timestamp/1e6 - self.clockOffset)*1000)
+
+    def streamRestarted(self): # Sequence numbers and the camera clock can start over with a new stream
+        with self.lock:
+            self.lastSeq = None
+            self.clockOffset = None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "received": self.received,
+                "lost": self.lost,
+                "gaps": self.gaps,
+                "lastSeq": self.lastSeq,
+                "sensorToPull_ms": self.sensorToPull.summary(),
+                "pullToPaint_ms": self.pullToPaint.summary(),
+                "sensorToPaint_ms": self.sensorToPaint.summary(),
+            }
+
+    def histograms(self): # Copies of the bin counts, bin width in ms
+        with self.lock:
+            return {
+                "binMs": self.sensorToPull.binMs,
+                "sensorToPull": self.sensorToPull.counts.copy(),
+                "pullToPaint": self.pullToPaint.counts.copy(),
+                "sensorToPaint": self.sensorToPaint.counts.copy(),
+            }
@@ -0,0 +1,151 @@
+import math
+from collections import OrderedDict
+from PyQt5.QtCore import Qt, QRectF, QPointF, pyqtSignal
+from PyQt5.QtGui import QImage, QPainter, QPen, QColor, QPolygonF
+from PyQt5.QtWidgets import QWidget
+
+# Zoomable overview of the scanned chip (MosaicStore.TilePyramid). Paints only the visible blocks of the pyramid level
+# matching the zoom, blocks are paged in from the memory-mapped files and kept in a small LRU cache.
+# Wheel zooms around the cursor, dragging pans, double-click emits the stage position to move to. Flakes found while
+# scanning (FlakeDetection) are drawn as outlines. Without a pyramid (nothing scanned yet) only the stage range, the
+# field of view and flakes are drawn, setPyramid() shows the pyramid created by the first scan
+class MosaicOverview(QWidget):
+    positionRequested = pyqtSignal(float, float) # x, y in mm
+
+    def __init__(self, pyramid=None, parent=None, cacheSize=400, extent=12.0, pixelSize=0.000087):
+        super().__init__(parent)
+        self.pyramid = pyramid
+        self.extent = pyramid.extent if pyramid is not None else extent # Stage range in mm
+        self.pixelSize = pyramid.pixelSize if pyramid is not None else pixelSize
+        self.center = [self.extent/2, self.extent/2] # mm at the widget center
+        self.mmPerPixel = self.extent/300
+        self.cache = OrderedDict() # (level, bx, by) -> QImage
+        self.cacheSize = cacheSize
+        self.stagePosition = None
+        self.fieldOfView = (0, 0) # Camera field of view in mm, drawn around the stage position
+        self.flakes = []
+        self.dragStart = None
+        self.setMinimumSize(200, 200)
+        self.setMouseTracking(True)
+        self.setCursor(Qt.CrossCursor)
+
+    def setPyramid(self, pyramid):
+        self.pyramid = pyramid
+        self.extent = pyramid.extent
+        self.pixelSize = pyramid.pixelSize
+        self.cache.clear()
+        self.update()
+
+    def setStagePosition(self, x, y, fieldWidth=0, fieldHeight=0):
+        self.stagePosition = (x, y)
+        self.fieldOfView = (fieldWidth, fieldHeight)
+        self.update()
+
+    def setFlakes(self, flakes): # Flakes in stage mm
+        self.flakes = flakes
+        self.update()
+
+    def refreshBlocks(self): # Drops cached blocks the pyramid has rewritten (new tiles)
+        if self.pyramid is None:
+            return
+        for key in self.pyramid.takeChangedBlocks():
+            self.cache.pop(key, None)
+        self.update()
+
+    def fitToContent(self):
+        bounds = self.pyramid.bounds() if self.pyramid is not None else None
+        if bounds is None:
+            return
+        x0, y0, x1, y1 = bounds
+        self.center = [(x0 + x1)/2, (y0 + y1)/2]
+        self.mmPerPixel = max((x1 - x0)/max(self.width(), 1), (y1 - y0)/max(self.height(), 1))*1.05
+        self.update()
+
+    def toScreen(self, x, y):
+        return QPointF((x - self.center[0])/self.mmPerPixel + self.width()/2, (self.center[1] - y)/self.mmPerPixel + self.height()/2)
+
+    def toStage(self, point):
+        return (self.center[0] + (point.x() - self.width()/2)*self.mmPerPixel, self.center[1] - (point.y() - self.height()/2)*self.mmPerPixel)
+
+    def level(self): # Coarsest level that still has at least one pixel per screen pixel
+        level = int(math.floor(math.log2(max(self.mmPerPixel/self.pixelSize, 1))))
+        return min(level, self.pyramid.levels - 1) if self.pyramid is not None else level
+
+    def blockImage(self, level, bx, by):
+        key = (level, bx, by)
+        image = self.cache.get(key)
+        if image is not None:
+            self.cache.move_to_end(key)
+            return image
+        pixels = self.pyramid.block(level, bx, by)
+        if pixels is None:
+            return None
+        size = self.pyramid.blockSize
+        image = QImage(pixels.data, size, size, size*3, QImage.Format_RGB888).copy() # Owns its memory, pixels is temporary
+        self.cache[key] = image
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return image
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        level = self.level()
+        extent = self.extent
+        if self.pyramid is not None:
+            blockMm = self.pyramid.blockSize*self.pyramid.pixelSize*2**level
+            left, top = self.toStage(QPointF(0, 0))
+            right, bottom = self.toStage(QPointF(self.width(), self.height()))
+            blockPixels = blockMm/self.mmPerPixel
+            for by in range(max(int((extent - top)//blockMm), 0), int((extent - bottom)//blockMm) + 1):
+                for bx in range(max(int(left//blockMm), 0), int(right//blockMm) + 1):
+                    if not self.pyramid.hasBlock(level, bx, by):
+                        continue
+                    image = self.blockImage(level, bx, by)
+                    if image is not None:
+                        topLeft = self.toScreen(bx*blockMm, extent - by*blockMm)
+                        painter.drawImage(QRectF(topLeft.x(), topLeft.y(), blockPixels, blockPixels), image)
+
+        painter.setPen(QPen(QColor(0, 255, 128), 1))
+        for flake in self.flakes:
+            painter.drawPolygon(QPolygonF([self.toScreen(x, y) for x, y in flake["outline"]]))
+
+        painter.setPen(QPen(QColor(120, 120, 120), 1, Qt.DashLine)) # Stage range
+        painter.drawRect(QRectF(self.toScreen(0, extent), self.toScreen(extent, 0)))
+        if self.stagePosition is not None:
+            center = self.toScreen(*self.stagePosition)
+            painter.setPen(QPen(Qt.red, 1))
+            width, height = self.fieldOfView[0]/self.mmPerPixel, self.fieldOfView[1]/self.mmPerPixel
+            painter.drawRect(QRectF(center.x() - width/2, center.y() - height/2, width, height))
+            painter.drawLine(QPointF(center.x() - 6, center.y()), QPointF(center.x() + 6, center.y()))
+            painter.drawLine(QPointF(center.x(), center.y() - 6), QPointF(center.x(), center.y() + 6))
+        painter.setPen(Qt.white)
+        painter.drawText(5, self.height() - 5, f"{self.mmPerPixel*1000:.2f} µm/px, level {level}")
+
+    def wheelEvent(self, event): # Zoom around the cursor
+        anchor = self.toStage(event.pos())
+        factor = 1.25**(-event.angleDelta().y()/120)
+        self.mmPerPixel = min(max(self.mmPerPixel*factor, self.pixelSize/4), self.extent/50)
+        after = self.toStage(event.pos())
+        self.center[0] += anchor[0] - after[0]
+        self.center[1] += anchor[1] - after[1]
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.dragStart = event.pos()
+
+    def mouseMoveEvent(self, event):
+        if self.dragStart is not None:
+            delta = event.pos() - self.dragStart
+            self.center[0] -= delta.x()*self.mmPerPixel
+            self.center[1] += delta.y()*self.mmPerPixel
+            self.dragStart = event.pos()
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.dragStart = None
+
+    def mouseDoubleClickEvent(self, event):
+        x, y = self.toStage(event.pos())
+        self.positionRequested.emit(round(x, 5), round(y, 5))
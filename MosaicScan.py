@@ -0,0 +1,166 @@
+import os
+import json
+import queue
+import threading
+import time
+import numpy as np
+import amcam
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Tile positions (stage mm, tile centers) covering the region with the given overlap, in serpentine order so that
+# consecutive tiles only differ in one axis
+def scanPositions(x0, y0, x1, y1, tileWidth, tileHeight, overlap=0.1):
+    stepX, stepY = tileWidth*(1 - overlap), tileHeight*(1 - overlap)
+    columns = int(np.ceil((abs(x1 - x0) - tileWidth)/stepX)) + 1 if abs(x1 - x0) > tileWidth else 1
+    rows = int(np.ceil((abs(y1 - y0) - tileHeight)/stepY)) + 1 if abs(y1 - y0) > tileHeight else 1
+    left, top = min(x0, x1) + tileWidth/2, max(y0, y1) - tileHeight/2
+    positions = []
+    for row in range(rows):
+        order = range(columns) if row % 2 == 0 else reversed(range(columns))
+        for column in order:
+            positions.append((row, column, round(left + column*stepX, 5), round(top - row*stepY, 5)))
+    return positions
+
+
+# Processes and saves the tiles while the stage already moves to the next one. Tiles are RGB .npy files (memory-mappable)
+# listed with their stage position in mosaic.json, and are added to the chip map (MosaicStore.TilePyramid) if given.
+# With a FlakeDetection.FlakeDetector every tile is also queued for flake detection, the flakes go to flakes.json
+class TileWriterThread(QThread):
+    tileSaved = pyqtSignal(int)
+    writeFailed = pyqtSignal(str)
+    flakesSaved = pyqtSignal(list) # flakes of the whole scan (stage mm)
+
+    def __init__(self, directory, metadata, bgr=True, pyramid=None, detector=None, maxQueued=4, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.metadata = metadata
+        self.pyramid = pyramid
+        self.detector = detector
+        self.bgr = bgr # Camera byte order of the frames, tiles are stored as RGB
+        self.jobs = queue.Queue(maxQueued) # Bounded: the scan waits for the disk instead of filling the memory
+        self.tiles = []
+        self.running = True
+        os.makedirs(self.directory, exist_ok=True)
+
+    def enqueue(self, index, row, column, x, y, frame): # Blocks while the queue is full
+        self.jobs.put((index, row, column, x, y, frame))
+
+    def run(self):
+        while self.running or not self.jobs.empty():
+            try:
+                index, row, column, x, y, frame = self.jobs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            rgb = frame[:, :, 2::-1] if self.bgr else frame[:, :, :3]
+            name = f"tile_{row:03d}_{column:03d}.npy"
+            try:
+                np.save(os.path.join(self.directory, name), np.ascontiguousarray(rgb))
+            except OSError as e:
+                self.writeFailed.emit(f"{name}: {e}")
+                continue
+            self.tiles.append({"file": name, "row": row, "column": column, "x": x, "y": y})
+            if self.detector is not None:
+                self.detector.detectTile(rgb, x, y, self.metadata["pixelSize_mm"])
+            if self.pyramid is not None:
+                try:
+                    self.pyramid.addTile(rgb, x, y, self.metadata["pixelSize_mm"])
+                except OSError as e: # Disk full: the tile is saved, only the chip map misses it
+                    self.writeFailed.emit(f"chip map: {e}")
+            self.tileSaved.emit(index)
+        self.writeIndex()
+        if self.pyramid is not None:
+            try:
+                self.pyramid.save()
+            except OSError as e:
+                self.writeFailed.emit(f"chip map: {e}")
+        if self.detector is not None:
+            self.writeFlakes(self.detector.takeTileFlakes())
+
+    def writeIndex(self):
+        with open(os.path.join(self.directory, "mosaic.json"), "w") as f:
+            json.dump({**self.metadata, "tiles": sorted(self.tiles, key=lambda tile: (tile["row"], tile["column"]))}, f, indent=1)
+
+    def writeFlakes(self, flakes):
+        try:
+            with open(os.path.join(self.directory, "flakes.json"), "w") as f:
+                json.dump({"flakes": flakes}, f, indent=1)
+        except OSError as e:
+            self.writeFailed.emit(f"flakes.json: {e}")
+        self.flakesSaved.emit(flakes)
+
+    def stop(self): # Saves the queued tiles and the index before returning
+        self.running = False
+        self.wait()
+
+
+# Stage scan in a worker thread. Like the autofocus, moves are requested with moveRequested and confirmed with moveDone()
+# by the UI thread that owns the ESP301. Per tile: move, settle, one software trigger, grab the frame. Right after the
+# grab the move to the next tile is requested and the tile goes to the writer, so moving, processing and saving overlap
+class MosaicScanThread(QThread):
+    moveRequested = pyqtSignal(float, float) # x, y in mm
+    tileAcquired = pyqtSignal(int, int, float) # tile index, number of tiles, tiles per second so far
+    scanFinished = pyqtSignal(str, int, float, float) # directory, tiles, seconds, tiles per second
+    failed = pyqtSignal(str)
+
+    def __init__(self, positions, grabber, trigger, writer, settleTime=0.1, parent=None):
+        super().__init__(parent)
+        self.positions = positions
+        self.grabber = grabber # CameraAcquisition.FrameGrabber registered as frame consumer
+        self.trigger = trigger # Triggers exactly one frame (software trigger), None for a free running camera
+        self.writer = writer
+        self.settleTime = settleTime # s after the controller reports the move done
+        self.moveFinished = threading.Event()
+        self.running = True
+
+    def moveDone(self):
+        self.moveFinished.set()
+
+    def requestMove(self, x, y):
+        self.moveFinished.clear()
+        self.moveRequested.emit(x, y)
+
+    def waitForMove(self):
+        if not self.moveFinished.wait(20):
+            raise TimeoutError("stage move did not finish")
+        if not self.running:
+            raise InterruptedError("scan stopped")
+
+    def run(self):
+        start = time.perf_counter()
+        acquired = 0
+        try:
+            row, column, x, y = self.positions[0]
+            self.requestMove(x, y)
+            for i, (row, column, x, y) in enumerate(self.positions):
+                self.waitForMove()
+                time.sleep(self.settleTime)
+                if self.trigger is not None:
+                    self.grabber.request()
+                    self.trigger()
+                else:
+                    self.grabber.request(skipFrames=1) # The next frame may have been exposed while moving
+                frame = self.grabber.wait()
+                if frame is None:
+                    raise TimeoutError(f"no frame for tile {row}, {column}")
+                if i + 1 < len(self.positions): # Stage moves while the tile is processed and saved
+                    nextRow, nextColumn, nextX, nextY = self.positions[i + 1]
+                    self.requestMove(nextX, nextY)
+                self.writer.enqueue(i, row, column, x, y, frame)
+                acquired += 1
+                self.tileAcquired.emit(i, len(self.positions), acquired/(time.perf_counter() - start))
+        except (TimeoutError, InterruptedError) as e:
+            self.failed.emit(str(e))
+        except amcam.HRESULTException as ex:
+            self.failed.emit('software trigger failed, hr=0x{:x}'.format(ex.hr))
+        finally:
+            self.writer.stop()
+        seconds = time.perf_counter() - start
+        self.scanFinished.emit(self.writer.directory, acquired, seconds, acquired/seconds if seconds > 0 else 0.0)
+
+    def cancel(self): # Stops after the current tile without waiting, scanFinished is still emitted
+        self.running = False
+        self.moveFinished.set()
+
+    def stop(self):
+        self.cancel()
+        self.wait()
@@ -0,0 +1,171 @@
+import os
+import json
+import errno
+import shutil
+import threading
+import numpy as np
+
+# On-disk, memory-mapped tile pyramid of the chip in stage coordinates.
+# Level 0 has pixelSize mm per pixel, every further level halves the resolution. Each level is a grid of
+# blockSize x blockSize RGB blocks, block (bx, by) covers the global pixels [bx*blockSize, (bx+1)*blockSize) with
+#   global x = X/pixelSize, global y = (extent - Y)/pixelSize   (stage Y points up, image rows down)
+# Only blocks that contain scanned tiles exist. Per level the blocks are slots of one growing memory-mapped file
+# (level_N.raw) and level_N.idx.npy maps (bx, by) to the slot, so a full-chip map is read block by block. The files grow
+# by at most growBlocks slots at a time (a full chip at level 0 would be tens of GB) and only if the disk has the room,
+# otherwise addTile raises OSError(ENOSPC) and the pyramid keeps the blocks it has
+class TilePyramid:
+    def __init__(self, directory, pixelSize=0.000087, blockSize=256, levels=10, extent=12.0, growBlocks=4096):
+        self.directory = directory
+        self.growBlocks = growBlocks
+        headerPath = os.path.join(directory, "pyramid.json")
+        if os.path.exists(headerPath): # An existing pyramid keeps its geometry
+            with open(headerPath) as f:
+                header = json.load(f)
+            pixelSize, blockSize, levels, extent = header["pixelSize_mm"], header["blockSize"], header["levels"], header["extent_mm"]
+        self.pixelSize = pixelSize
+        self.blockSize = blockSize
+        self.levels = levels
+        self.extent = extent
+        self.lock = threading.RLock()
+        self.index = [{} for level in range(levels)] # (bx, by) -> slot
+        self.maps = [None]*levels
+        self.capacity = [0]*levels
+        self.changed = set() # (level, bx, by) rewritten since the last takeChangedBlocks()
+
+        if not os.path.exists(headerPath): # Opening an existing pyramid writes nothing
+            os.makedirs(directory, exist_ok=True)
+            with open(headerPath, "w") as f:
+                json.dump({"pixelSize_mm": pixelSize, "blockSize": blockSize, "levels": levels, "extent_mm": extent}, f, indent=2)
+        for level in range(levels):
+            indexPath = self.path(level, "idx.npy")
+            if os.path.exists(indexPath):
+                self.index[level] = {(int(bx), int(by)): int(slot) for bx, by, slot in np.load(indexPath)}
+                self.mapLevel(level, max(len(self.index[level]), 1))
+
+    def path(self, level, extension):
+        return os.path.join(self.directory, f"level_{level}.{extension}")
+
+    def mapLevel(self, level, capacity): # (Re)maps the block file of a level with room for capacity blocks
+        blockBytes = self.blockSize*self.blockSize*3
+        path = self.path(level, "raw")
+        with open(path, "ab") as f:
+            if f.tell() < capacity*blockBytes:
+                missing = capacity*blockBytes - f.tell()
+                if shutil.disk_usage(self.directory).free < missing:
+                    raise OSError(errno.ENOSPC, f"{missing/2**20:.0f} MB more needed for the chip map", path)
+                f.truncate(capacity*blockBytes)
+        if self.maps[level] is not None:
+            self.maps[level].flush()
+        self.maps[level] = np.memmap(path, dtype=np.uint8, mode="r+", shape=(capacity, self.blockSize, self.blockSize, 3))
+        self.capacity[level] = capacity
+
+    def blockForWriting(self, level, key): # Existing block or a new black one
+        slot = self.index[level].get(key)
+        if slot is None:
+            slot = len(self.index[level])
+            if slot >= self.capacity[level]:
+                self.mapLevel(level, self.capacity[level] + min(max(64, self.capacity[level]), self.growBlocks))
+            self.index[level][key] = slot
+            self.maps[level][slot] = 0
+        return self.maps[level][slot]
+
+    def block(self, level, bx, by): # Copy of a block (blockSize, blockSize, 3) or None if nothing was scanned there
+        with self.lock:
+            slot = self.index[level].get((bx, by))
+            if slot is None:
+                return None
+            return np.array(self.maps[level][slot])
+
+    def hasBlock(self, level, bx, by):
+        return (bx, by) in self.index[level]
+
+    def addTile(self, rgb, x, y, pixelSize=None): # rgb (height, width, 3) centered on the stage position x, y (mm)
+        if pixelSize is not None and abs(pixelSize - self.pixelSize) > 1e-12: # Resample to the level 0 pixel size
+            scale = pixelSize/self.pixelSize
+            rows = (np.arange(int(rgb.shape[0]*scale))/scale).astype(np.intp)
+            columns = (np.arange(int(rgb.shape[1]*scale))/scale).astype(np.intp)
+            rgb = rgb[rows][:, columns]
+        height, width = rgb.shape[:2]
+        gx0 = int(round(x/self.pixelSize - width/2))
+        gy0 = int(round((self.extent - y)/self.pixelSize - height/2))
+        if gx0 < 0: # Outside of the stage range
+            rgb, width, gx0 = rgb[:, -gx0:], width + gx0, 0
+        if gy0 < 0:
+            rgb, height, gy0 = rgb[-gy0:], height + gy0, 0
+        if width <= 0 or height <= 0:
+            return
+        size = self.blockSize
+        with self.lock:
+            touched = set()
+            for by in range(gy0//size, (gy0 + height - 1)//size + 1):
+                for bx in range(gx0//size, (gx0 + width - 1)//size + 1):
+                    block = self.blockForWriting(0, (bx, by))
+                    x0, y0 = max(gx0, bx*size), max(gy0, by*size)
+                    x1, y1 = min(gx0 + width, (bx + 1)*size), min(gy0 + height, (by + 1)*size)
+                    block[y0 - by*size:y1 - by*size, x0 - bx*size:x1 - bx*size] = rgb[y0 - gy0:y1 - gy0, x0 - gx0:x1 - gx0]
+                    touched.add((bx, by))
+            self.changed |= {(0, bx, by) for bx, by in touched}
+            for level in range(1, self.levels): # Each parent block is rebuilt from its 2 x 2 children
+                parents = {(bx//2, by//2) for bx, by in touched}
+                half = size//2
+                for px, py in parents:
+                    block = self.blockForWriting(level, (px, py))
+                    for dy in range(2):
+                        for dx in range(2):
+                            slot = self.index[level - 1].get((2*px + dx, 2*py + dy))
+                            if slot is None:
+                                continue
+                            child = self.maps[level - 1][slot].astype(np.uint16)
+                            mean = (child[0::2, 0::2] + child[1::2, 0::2] + child[0::2, 1::2] + child[1::2, 1::2])//4
+                            block[dy*half:(dy + 1)*half, dx*half:(dx + 1)*half] = mean
+                self.changed |= {(level, bx, by) for bx, by in parents}
+                touched = parents
+
+    def addScan(self, directory): # Adds the tiles of a MosaicScan directory (mosaic.json)
+        with open(os.path.join(directory, "mosaic.json")) as f:
+            mosaic = json.load(f)
+        for tile in mosaic["tiles"]:
+            self.addTile(np.load(os.path.join(directory, tile["file"]), mmap_mode="r"), tile["x"], tile["y"], mosaic["pixelSize_mm"])
+        self.save()
+
+    def patch(self, x, y, size): # (size, size, 3) level 0 pixels centered on the stage position x, y (mm), None unless fully scanned
+        gx0 = int(round(x/self.pixelSize - size/2))
+        gy0 = int(round((self.extent - y)/self.pixelSize - size/2))
+        if gx0 < 0 or gy0 < 0:
+            return None
+        blockSize = self.blockSize
+        patch = np.empty((size, size, 3), dtype=np.uint8)
+        with self.lock:
+            for by in range(gy0//blockSize, (gy0 + size - 1)//blockSize + 1):
+                for bx in range(gx0//blockSize, (gx0 + size - 1)//blockSize + 1):
+                    slot = self.index[0].get((bx, by))
+                    if slot is None:
+                        return None
+                    x0, y0 = max(gx0, bx*blockSize), max(gy0, by*blockSize)
+                    x1, y1 = min(gx0 + size, (bx + 1)*blockSize), min(gy0 + size, (by + 1)*blockSize)
+                    patch[y0 - gy0:y1 - gy0, x0 - gx0:x1 - gx0] = self.maps[0][slot][y0 - by*blockSize:y1 - by*blockSize, x0 - bx*blockSize:x1 - bx*blockSize]
+        return patch
+
+    def takeChangedBlocks(self):
+        with self.lock:
+            changed = self.changed
+            self.changed = set()
+            return changed
+
+    def bounds(self): # (x0, y0, x1, y1) in mm of the scanned area, None if empty
+        with self.lock:
+            if not self.index[0]:
+                return None
+            keys = np.array(list(self.index[0].keys()))
+        blockMm = self.blockSize*self.pixelSize
+        return (keys[:, 0].min()*blockMm, self.extent - (keys[:, 1].max() + 1)*blockMm,
+                (keys[:, 0].max() + 1)*blockMm, self.extent - keys[:, 1].min()*blockMm)
+
+    def save(self): # Flushes the blocks and writes the indices
+        with self.lock:
+            for level in range(self.levels):
+                if self.maps[level] is None:
+                    continue
+                self.maps[level].flush()
+                entries = np.array([(bx, by, slot) for (bx, by), slot in self.index[level].items()], dtype=np.int64).reshape(-1, 3)
+                np.save(self.path(level, "idx.npy"), entries)
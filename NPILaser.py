@@ -1,4 +1,5 @@
 import serial
+import threading
 import time
 from PyQt5.QtCore import QObject, pyqtSignal, Qt 
 from PyQt5.QtWidgets import QWidget
@@ -20,29 +21,40 @@ class NPILaser(QObject):
         self.parentWidget = parent
         self.parentWidget.setCursor(Qt.ArrowCursor)
         if port:
-            self.port = port
             try:
-                self.serial =  serial.Serial(port=f"COM{port}", baudrate=baudrate, timeout=timeout)
-                self.connected = self.serial.is_open
-                self.turnOff()
-                self.configureRemote()
-                self.status = self.getStatus()
+                self.open(port, baudrate, timeout)
             except serial.SerialException as e:
-                print(f"[Serial Error] Could not open port COM{port}: {e}")
-                self.serial = None
-                self.connected = False
+                self.connectionFailed(port, e)
         else:
             self.connected = False
             self.serial = None
             self.status = NPILaserStatus.DISCONNECTED
 
+    def open(self, port, baudrate=115200, timeout=1): # Opens the port and configures the laser. No widgets, can run in a worker thread (see DeviceStartup)
+        self.port = port
+        self.serial =  serial.Serial(port=f"COM{port}", baudrate=baudrate, timeout=timeout)
+        self.turnOff()
+        self.configureRemote()
+        self.status = self.getStatus()
+        self.connected = self.serial.is_open # Last, the UI only sends commands once the laser is configured
+        return self
+
+    def connectionFailed(self, port, error):
+        print(f"[Serial Error] Could not open port COM{port}: {error}")
+        self.serial = None
+        self.connected = False
+
+    def setBusyCursor(self, busy): # Only from the UI thread, commands of open() come from a worker thread
+        if threading.current_thread() is threading.main_thread():
+            self.parentWidget.setCursor(Qt.WaitCursor if busy else Qt.ArrowCursor)
+
     def sendCommand(self, command): # Send command to laser and wait for response
         if self.serial != None:
             full_command = command + '\r'
             self.serial.write(full_command.encode())
-            self.parentWidget.setCursor(Qt.WaitCursor)
+            self.setBusyCursor(True)
             time.sleep(0.9)
-            self.parentWidget.setCursor(Qt.ArrowCursor)
+            self.setBusyCursor(False)
             response = self.serial.read_all().decode().strip()
             return response
         else:
@@ -0,0 +1,140 @@
+import csv
+import os
+import threading
+import time
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+from Registration import FrameSpectrum, phaseCorrelation
+
+LOG_FIELDS = ["time", "reference", "start_x_mm", "start_y_mm", "target_x_mm", "target_y_mm", "error_x_um", "error_y_um",
+              "peak", "corrected", "residual_x_um", "residual_y_um", "message"]
+
+def appendCorrectionLog(path, record): # One CSV row per closed-loop move, the header is written with the first row
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    newFile = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, LOG_FIELDS)
+        if newFile:
+            writer.writeheader()
+        writer.writerow({key: record.get(key, "") for key in LOG_FIELDS})
+
+
+# Move with one camera based correction, like the autofocus the moves are requested with moveRequested and confirmed
+# with moveDone() by the UI thread owning the ESP301.
+# Reference: the patch around the target in the frame before the move if the target is in the field of view, otherwise
+# the chip map (MosaicStore.TilePyramid) around the target if it was scanned at the frame pixel size.
+# After the move has settled, the patch where the reported stage position is shown (the crosshair) is registered against
+# the reference. The shift is the error of the move: where the stage is versus the target (backlash estimates, missed
+# steps). Errors above the tolerance are corrected with one move to target - error, the residual after it is measured for
+# the log. Errors above maxCorrection are not trusted
+class ClosedLoopMoveThread(QThread):
+    moveRequested = pyqtSignal(float, float) # x, y in mm
+    moveCorrected = pyqtSignal(dict) # log record, errors in µm
+    failed = pyqtSignal(str)
+
+    def __init__(self, target, grabber, transformProvider, positionProvider, chipMap=None, logPath=None, size=128, downsample=2,
+                 tolerance=0.0005, maxCorrection=0.03, minPeak=0.1, settleTime=0.2, arrivalTolerance=0.001, parent=None):
+        super().__init__(parent)
+        self.target = target # (x, y) mm
+        self.grabber = grabber # CameraAcquisition.FrameGrabber registered as frame consumer
+        self.transformProvider = transformProvider # CameraView.frameToStage
+        self.positionProvider = positionProvider # (x, y) mm reported by the controller
+        self.chipMap = chipMap
+        self.logPath = logPath
+        self.spectrum = FrameSpectrum(size, downsample)
+        self.tolerance = tolerance # mm
+        self.maxCorrection = maxCorrection # mm
+        self.minPeak = minPeak
+        self.settleTime = settleTime
+        self.arrivalTolerance = arrivalTolerance # mm, reported position against the commanded one after a move
+        self.moveFinished = threading.Event()
+        self.running = True
+
+    def moveDone(self):
+        self.moveFinished.set()
+
+    def move(self, x, y):
+        self.moveFinished.clear()
+        self.moveRequested.emit(x, y)
+        if not self.moveFinished.wait(20):
+            raise TimeoutError("stage move did not finish")
+        if not self.running:
+            raise InterruptedError("move stopped")
+        position = self.positionProvider()
+        if max(abs(position[0] - x), abs(position[1] - y)) > self.arrivalTolerance: # Frames taken now would show the stage still moving
+            raise ValueError(f"stage reported ({position[0]:.5f}, {position[1]:.5f}) mm after the move to ({x:.5f}, {y:.5f}) mm")
+        time.sleep(self.settleTime)
+
+    def grab(self): # Green channel of a fresh frame and its pixel -> stage transform
+        self.grabber.request(skipFrames=1)
+        frame = self.grabber.wait()
+        if frame is None:
+            raise TimeoutError("no camera frame")
+        return frame[:, :, 1], self.transformProvider()
+
+    def patchSpectrum(self, gray, transform, x, y): # Spectrum of the patch where the frame shows the stage position x, y, None if outside
+        x0, y0, scale = transform
+        return self.spectrum.fromGray(gray, ((x - x0)/scale, (y0 - y)/scale))
+
+    def chipMapSpectrum(self, scale):
+        if self.chipMap is None or abs(self.chipMap.pixelSize - scale) > 1e-9:
+            return None
+        patch = self.chipMap.patch(self.target[0], self.target[1], self.spectrum.size*self.spectrum.downsample)
+        if patch is None:
+            return None
+        return self.spectrum.fromGray(patch[:, :, 1])
+
+    def measure(self, reference): # Error (x, y) in mm of the stage position against the target and the correlation peak
+        gray, transform = self.grab()
+        spectrum = self.patchSpectrum(gray, transform, *self.positionProvider())
+        if spectrum is None:
+            raise ValueError("stage position is not in the field of view (focus window)")
+        dx, dy, peak = phaseCorrelation(reference, spectrum)
+        scale = transform[2]*self.spectrum.downsample
+        return (-dx*scale, dy*scale), peak
+
+    def run(self):
+        record = {"time": time.time(), "target_x_mm": self.target[0], "target_y_mm": self.target[1], "corrected": False}
+        try:
+            gray, transform = self.grab()
+            record["start_x_mm"], record["start_y_mm"] = self.positionProvider()
+            reference = self.patchSpectrum(gray, transform, *self.target)
+            record["reference"] = "frame"
+            if reference is None:
+                reference = self.chipMapSpectrum(transform[2])
+                record["reference"] = "chip map"
+            self.move(*self.target)
+            if reference is None:
+                raise ValueError("no reference image of the target (outside the view and not on the chip map)")
+
+            error, peak = self.measure(reference)
+            record["error_x_um"], record["error_y_um"], record["peak"] = round(error[0]*1000, 3), round(error[1]*1000, 3), round(peak, 3)
+            if peak < self.minPeak:
+                raise ValueError(f"registration failed (correlation {peak:.2f})")
+            size = float(np.hypot(*error))
+            if size > self.maxCorrection:
+                raise ValueError(f"error of {size*1000:.1f} µm is not plausible, not corrected")
+            if size > self.tolerance:
+                self.move(round(self.target[0] - error[0], 5), round(self.target[1] - error[1], 5))
+                record["corrected"] = True
+                residual, peak = self.measure(reference)
+                record["residual_x_um"], record["residual_y_um"] = round(residual[0]*1000, 3), round(residual[1]*1000, 3)
+            self.log(record)
+            self.moveCorrected.emit(record)
+        except (TimeoutError, InterruptedError, ValueError) as e:
+            record["message"] = str(e)
+            self.log(record)
+            self.failed.emit(str(e))
+
+    def log(self, record):
+        if self.logPath is None:
+            return
+        try:
+            appendCorrectionLog(self.logPath, record)
+        except OSError as e:
+            print(f"[Closed-Loop Move] log not written: {e}")
+
+    def stop(self):
+        self.running = False
+        self.moveFinished.set()
+        self.wait()
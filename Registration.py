@@ -0,0 +1,142 @@
+import threading
+import numpy as np
+
+# Translation between two images by FFT phase correlation: the normalized cross-power spectrum of the two images has an
+# inverse transform with a sharp peak at the shift. The peak is refined to sub-pixel from its larger neighbour.
+# Both spectra come from FrameSpectrum (same crop size), so every image is windowed and transformed only once.
+# Returns (dx, dy, peak): image content moved by dx, dy pixels from the reference to the frame, peak (0..1) is the
+# correlation strength, below ~0.05 the shift is not reliable (no common structure, motion blur)
+def phaseCorrelation(referenceSpectrum, frameSpectrum):
+    crossPower = frameSpectrum*np.conj(referenceSpectrum)
+    crossPower /= np.maximum(np.abs(crossPower), 1e-12)
+    correlation = np.fft.irfft2(crossPower)
+    size = correlation.shape[0]
+    y, x = np.unravel_index(np.argmax(correlation), correlation.shape)
+    peak = correlation[y, x]
+    dx = x + subpixelOffset(correlation[y, (x - 1) % size], peak, correlation[y, (x + 1) % size])
+    dy = y + subpixelOffset(correlation[(y - 1) % size, x], peak, correlation[(y + 1) % size, x])
+    if dx > size/2: # Shifts beyond half the size wrap around
+        dx -= size
+    if dy > size/2:
+        dy -= size
+    return float(dx), float(dy), float(peak)
+
+
+def subpixelOffset(left, center, right): # Peak of a phase correlation is a sampled sinc: shift from the larger neighbour
+    if right > left and right > 0:
+        return float(right/(right + center))
+    if left > 0:
+        return float(-left/(left + center))
+    return 0.0
+
+
+# Windowed spectrum of the green channel of a frame: square crop of size*downsample frame pixels (central unless a center
+# is given), block averaged by downsample. Frames are the (height, stride) buffers of the acquisition thread, images
+# (height, width) arrays
+class FrameSpectrum:
+    def __init__(self, size=256, downsample=4):
+        self.size = size
+        self.downsample = downsample
+        window = np.hanning(size).astype(np.float32)
+        self.window = np.outer(window, window) # Suppresses the edges, which would correlate at zero shift
+
+    def crop(self, image, center=None): # Square of a gray image around center (x, y pixels), None if it does not fit
+        span = self.size*self.downsample
+        height, width = image.shape[:2]
+        if center is None:
+            x, y = (width - span)//2, (height - span)//2
+        else:
+            x, y = int(round(center[0] - span/2)), int(round(center[1] - span/2))
+        if x < 0 or y < 0 or x + span > width or y + span > height:
+            return None
+        return image[y:y+span, x:x+span]
+
+    def fromGray(self, image, center=None):
+        crop = self.crop(image, center)
+        if crop is None:
+            return None
+        d = self.downsample
+        small = crop.reshape(self.size, d, self.size, d).mean(axis=(1, 3), dtype=np.float32)
+        small -= small.mean()
+        return np.fft.rfft2(small*self.window)
+
+    def fromFrame(self, buf, info):
+        channels = buf.shape[1]//info.width
+        green = buf[:info.height, 1:info.width*channels:channels] # Middle byte for BGR(X) and RGB, a view
+        return self.fromGray(green)
+
+
+# Stage motion and drift from the live stream, registered in the acquisition thread for every frame (frame consumer).
+# Frames are registered against a key frame rather than the previous frame, so slow drift does not add up the error of
+# every single registration. The key frame is replaced when the shift exceeds a quarter of the crop or the correlation
+# gets weak, its offset is kept. Shifts are converted to mm in stage axes with the pixel size of the frame:
+#   stage x = -image dx*pixelSize   stage y = +image dy*pixelSize   (like ClickableCameraLabel, y grows downwards on screen)
+class DriftEstimator:
+    def __init__(self, pixelSizeProvider, size=256, minPeak=0.05, velocitySmoothing=0.1):
+        self.pixelSizeProvider = pixelSizeProvider # mm per frame pixel, with binning (CameraView.frameToStage()[2])
+        self.size = size
+        self.spectrum = None
+        self.minPeak = minPeak
+        self.velocitySmoothing = velocitySmoothing # Weight of the newest frame in the velocity average
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self): # The current position becomes zero drift
+        with self.lock:
+            self.keyFrame = None
+            self.keyOffset = (0.0, 0.0) # mm of the key frame relative to the first frame
+            self.frameSize = None
+            self.position = (0.0, 0.0)
+            self.velocity = (0.0, 0.0)
+            self.lastTimestamp = None
+            self.peak = 0.0
+            self.registered = 0
+            self.rejected = 0
+
+    def __call__(self, buf, info, pullTime): # Frame consumer, runs in the acquisition thread
+        if (info.width, info.height) != self.frameSize: # New ROI or binning: start over
+            self.reset()
+            self.frameSize = (info.width, info.height)
+            self.spectrum = self.spectrumFor(info.width, info.height)
+        spectrum = self.spectrum.fromFrame(buf, info)
+        if spectrum is None:
+            return
+        timestamp = info.timestamp/1e6 if info.timestamp else pullTime
+        if self.keyFrame is None:
+            with self.lock:
+                self.keyFrame = spectrum
+                self.lastTimestamp = timestamp
+            return
+        dx, dy, peak = phaseCorrelation(self.keyFrame, spectrum)
+        scale = self.pixelSizeProvider()*self.spectrum.downsample
+        with self.lock:
+            self.peak = peak
+            if peak < self.minPeak:
+                self.rejected += 1
+                self.keyFrame = spectrum # Lost track (fast move, defocus): continue from here
+                self.keyOffset = self.position
+                self.lastTimestamp = timestamp
+                return
+            position = (self.keyOffset[0] - dx*scale, self.keyOffset[1] + dy*scale)
+            elapsed = timestamp - self.lastTimestamp
+            if elapsed > 0:
+                a = self.velocitySmoothing
+                self.velocity = tuple((1 - a)*v + a*(p - q)/elapsed for v, p, q in zip(self.velocity, position, self.position))
+            self.position = position
+            self.lastTimestamp = timestamp
+            self.registered += 1
+            if max(abs(dx), abs(dy)) > self.spectrum.size/4:
+                self.keyFrame = spectrum
+                self.keyOffset = position
+
+    def spectrumFor(self, width, height): # Spectrum of the largest central crop, frames smaller than size (focus window) get a smaller one
+        side = min(width, height)
+        size = self.size
+        while size > 32 and size > side:
+            size //= 2
+        return FrameSpectrum(size, max(1, side//size))
+
+    def snapshot(self): # Shift since reset and velocity in mm and mm/s (stage axes), correlation of the last frame
+        with self.lock:
+            return {"x_mm": self.position[0], "y_mm": self.position[1], "vx_mm_s": self.velocity[0], "vy_mm_s": self.velocity[1],
+                    "peak": self.peak, "registered": self.registered, "rejected": self.rejected}
@@ -0,0 +1,242 @@
+import ctypes
+import threading
+import time
+import numpy as np
+import amcam
+
+# Drop-in replacement for amcam.Amcam without hardware: same class methods (EnumV2, Open) and the instance methods used by
+# CameraView. Synthetic frames are produced at a configurable resolution and frame rate by an own thread that raises
+# AMCAM_EVENT_IMAGE like the amcam internal threads do. Use it with CameraView(cameraClass=SimulatedAmcam) or
+# python gui.py --simulate-camera. setConnected(False) simulates unplugging the camera
+class SimulatedAmcam:
+    width = 2048
+    height = 1536
+    fps = 30
+    drift = (0.0, 0.0) # Sample motion in sensor pixels per frame
+    connected = True
+    hotplug = None # Callback of HotPlug, called when the camera is plugged in or out
+    openCameras = []
+
+    @classmethod
+    def configure(cls, width=None, height=None, fps=None, drift=None): # Applies to cameras opened afterwards
+        if width is not None:
+            cls.width = width
+        if height is not None:
+            cls.height = height
+        if fps is not None:
+            cls.fps = fps
+        if drift is not None:
+            cls.drift = drift
+
+    @classmethod
+    def HotPlug(cls, fun):
+        cls.hotplug = fun
+
+    @classmethod
+    def setConnected(cls, connected): # Unplugged: not enumerated, open cameras raise AMCAM_EVENT_DISCONNECTED and their pulls fail
+        cls.connected = connected
+        if not connected:
+            for camera in list(cls.openCameras):
+                camera.disconnect()
+        if cls.hotplug is not None:
+            cls.hotplug()
+
+    @classmethod
+    def EnumV2(cls):
+        if not cls.connected:
+            return []
+        model = amcam.AmcamModelV2("Simulated Camera", amcam.AMCAM_FLAG_ROI_HARDWARE | amcam.AMCAM_FLAG_TRIGGER_SOFTWARE | amcam.AMCAM_FLAG_RGB888,
+                                   0, 1, 1, 0, 0, 1.0, 1.0, [amcam.AmcamResolution(cls.width, cls.height)])
+        return [amcam.AmcamDeviceV2("Simulated Camera", "simulated-0", model)]
+
+    @classmethod
+    def Open(cls, id):
+        if not cls.connected:
+            return None
+        camera = cls(cls.width, cls.height, cls.fps, cls.drift)
+        cls.openCameras.append(camera)
+        return camera
+
+    def __init__(self, width, height, fps, drift=(0.0, 0.0)):
+        self.sensorWidth = width
+        self.sensorHeight = height
+        self.fps = fps
+        self.drift = drift
+        self.options = {amcam.AMCAM_OPTION_BYTEORDER: 0, amcam.AMCAM_OPTION_RGB: 0, amcam.AMCAM_OPTION_BINNING: 1, amcam.AMCAM_OPTION_TRIGGER: 0}
+        self.roi = (0, 0, 0, 0)
+        self.autoExposure = True
+        self.exposureTime = 20000 # us
+        self.analogGain = 100
+        self.sample = self.createSample(width, height)
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.frameTimestamp = 0
+        self.pendingTriggers = 0
+        self.startTime = time.perf_counter()
+        self.fun = None
+        self.ctx = None
+        self.thread = None
+        self.running = False
+        self.unplugged = False
+
+    @staticmethod
+    def createSample(width, height): # BGRX texture larger than the sensor: shading, a grid of flakes and fine structure to focus on
+        margin = 256
+        h, w = height + 2*margin, width + 2*margin
+        y, x = np.mgrid[0:h, 0:w]
+        base = 90 + 40*np.sin(x/700) + 30*np.cos(y/500) + 12*np.sin(x/3.1)*np.sin(y/2.7)
+        sample = np.empty((h, w, 4), dtype=np.uint8)
+        sample[:, :, 0] = np.clip(base + 30, 0, 255)
+        sample[:, :, 1] = np.clip(base + 10, 0, 255)
+        sample[:, :, 2] = np.clip(base, 0, 255)
+        sample[:, :, 3] = 255
+        rng = np.random.default_rng(1)
+        for i in range(60):
+            fw, fh = rng.integers(20, 160, 2)
+            fx, fy = rng.integers(0, w - fw), rng.integers(0, h - fh)
+            sample[fy:fy+fh, fx:fx+fw, :3] = rng.integers(120, 230, 3)
+        return sample
+
+    def Close(self):
+        self.Stop()
+        if self in self.openCameras:
+            self.openCameras.remove(self)
+
+    def disconnect(self): # The frame thread stops and the event comes from an own thread, like from the amcam threads
+        self.unplugged = True
+        self.running = False
+        if self.fun is not None:
+            threading.Thread(target=self.fun, args=(amcam.AMCAM_EVENT_DISCONNECTED, self.ctx), daemon=True).start()
+
+    def StartPullModeWithCallback(self, fun, ctx):
+        self.fun = fun
+        self.ctx = ctx
+        self.running = True
+        self.thread = threading.Thread(target=self.generateFrames, daemon=True)
+        self.thread.start()
+
+    def Stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def generateFrames(self): # Frame clock of the simulated sensor, like the amcam internal threads it only raises events
+        interval = 1/self.fps
+        nextFrame = time.perf_counter()
+        while self.running:
+            nextFrame += interval
+            delay = nextFrame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                nextFrame = time.perf_counter() # Too slow, do not try to catch up
+            with self.lock:
+                if self.options[amcam.AMCAM_OPTION_TRIGGER] != 0:
+                    if self.pendingTriggers == 0:
+                        continue
+                    if self.pendingTriggers != 0xffff:
+                        self.pendingTriggers -= 1
+                self.seq += 1
+                self.frameTimestamp = int((time.perf_counter() - self.startTime)*1e6)
+            if self.fun is not None:
+                self.fun(amcam.AMCAM_EVENT_IMAGE, self.ctx)
+
+    def render(self, pImageData, bits, roi, binning, seq):
+        x, y, w, h = roi
+        if w == 0 or h == 0:
+            x, y, w, h = 0, 0, self.sensorWidth, self.sensorHeight
+        margin = (self.sample.shape[0] - self.sensorHeight)//2
+        dx = int(round(self.drift[0]*seq)) % (2*margin) - margin if self.drift[0] else 0
+        dy = int(round(self.drift[1]*seq)) % (2*margin) - margin if self.drift[1] else 0
+        view = self.sample[margin+y+dy:margin+y+dy+h:binning, margin+x+dx:margin+x+dx+w:binning]
+        width, height = view.shape[1], view.shape[0]
+        channels = bits//8
+        stride = (width*bits + 31)//32*4
+        address = ctypes.cast(pImageData, ctypes.c_void_p).value
+        target = np.ctypeslib.as_array((ctypes.c_uint8*(stride*height)).from_address(address)).reshape(height, stride)
+        pixels = target[:, :width*channels].reshape(height, width, channels)
+        if channels == 4:
+            pixels[...] = view
+        elif self.options[amcam.AMCAM_OPTION_BYTEORDER] == 1:
+            pixels[...] = view[:, :, :3]
+        else:
+            pixels[...] = view[:, :, 2::-1]
+        return width, height
+
+    def fillFrameInfo(self, pInfo, width, height, seq, timestamp):
+        if pInfo is not None:
+            pInfo.width = width
+            pInfo.height = height
+            pInfo.flag = amcam.AMCAM_FRAMEINFO_FLAG_SEQ | amcam.AMCAM_FRAMEINFO_FLAG_TIMESTAMP
+            pInfo.seq = seq
+            pInfo.timestamp = timestamp
+
+    def PullImageV2(self, pImageData, bits, pInfo):
+        if self.unplugged:
+            raise amcam.HRESULTException(0x8000ffff)
+        with self.lock:
+            seq, timestamp = self.seq, self.frameTimestamp
+        binning = self.options[amcam.AMCAM_OPTION_BINNING] & 0x7f
+        width, height = self.render(pImageData, bits, self.roi, binning, seq)
+        self.fillFrameInfo(pInfo, width, height, seq, timestamp)
+
+    def Snap(self, nResolutionIndex):
+        if self.fun is None:
+            raise amcam.HRESULTException(0x8000ffff) # E_UNEXPECTED: not started
+        threading.Timer(self.exposureTime/1e6, self.fun, (amcam.AMCAM_EVENT_STILLIMAGE, self.ctx)).start()
+
+    def PullStillImageV2(self, pImageData, bits, pInfo):
+        with self.lock:
+            seq = self.seq
+        width, height = self.render(pImageData, bits, (0, 0, 0, 0), 1, seq)
+        self.fillFrameInfo(pInfo, width, height, seq, int((time.perf_counter() - self.startTime)*1e6))
+
+    def Trigger(self, nNumber): # Software trigger: next nNumber frames, 0xffff continuously
+        with self.lock:
+            self.pendingTriggers = nNumber
+
+    def get_Size(self):
+        return (self.sensorWidth, self.sensorHeight)
+
+    def get_FinalSize(self):
+        x, y, w, h = self.roi
+        if w == 0 or h == 0:
+            w, h = self.sensorWidth, self.sensorHeight
+        binning = self.options[amcam.AMCAM_OPTION_BINNING] & 0x7f
+        return ((w + binning - 1)//binning, (h + binning - 1)//binning)
+
+    def get_StillResolution(self, nResolutionIndex):
+        return (self.sensorWidth, self.sensorHeight)
+
+    def put_Option(self, iOption, iValue):
+        self.options[iOption] = iValue
+
+    def get_Option(self, iOption):
+        if iOption not in self.options:
+            raise amcam.HRESULTException(0x80004001) # E_NOTIMPL
+        return self.options[iOption]
+
+    def put_Roi(self, xOffset, yOffset, xWidth, yHeight):
+        self.roi = (xOffset, yOffset, xWidth, yHeight)
+
+    def get_Roi(self):
+        return self.roi
+
+    def get_AutoExpoEnable(self):
+        return self.autoExposure
+
+    def put_AutoExpoEnable(self, bAutoExposure):
+        self.autoExposure = bool(bAutoExposure)
+
+    def get_ExpoTime(self):
+        return self.exposureTime
+
+    def put_ExpoTime(self, Time):
+        self.exposureTime = Time
+
+    def get_ExpoAGain(self):
+        return self.analogGain
+
+    def put_TempTint(self, nTemp, nTint):
+        pass
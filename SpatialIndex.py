@@ -0,0 +1,61 @@
+import math
+
+# Uniform grid over view pixels for hit-testing many shapes: every key is stored in the cells its bounding box
+# (x1, y1, x2, y2) overlaps, a point or box query only looks at the keys of the cells it touches. With shapes spread over
+# the view (step-and-repeat arrays) a query costs the same for ten or thousands of shapes. insert() of an existing key
+# moves it, so an edited shape is updated without rebuilding the grid
+class GridIndex:
+    def __init__(self, cellSize=64):
+        self.cellSize = cellSize
+        self.cells = {} # (column, row) -> set of keys
+        self.boxes = {} # key -> box
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def clear(self):
+        self.cells.clear()
+        self.boxes.clear()
+
+    def cellRange(self, box):
+        x1, y1, x2, y2 = box
+        return (range(math.floor(x1/self.cellSize), math.floor(x2/self.cellSize) + 1),
+                range(math.floor(y1/self.cellSize), math.floor(y2/self.cellSize) + 1))
+
+    def insert(self, key, box):
+        self.remove(key)
+        self.boxes[key] = box
+        columns, rows = self.cellRange(box)
+        for column in columns:
+            for row in rows:
+                self.cells.setdefault((column, row), set()).add(key)
+
+    def remove(self, key):
+        box = self.boxes.pop(key, None)
+        if box is None:
+            return
+        columns, rows = self.cellRange(box)
+        for column in columns:
+            for row in rows:
+                cell = self.cells.get((column, row))
+                if cell is not None:
+                    cell.discard(key)
+                    if not cell:
+                        del self.cells[(column, row)]
+
+    def query(self, box): # Keys whose boxes overlap box (edges included), unordered
+        x1, y1, x2, y2 = box
+        columns, rows = self.cellRange(box)
+        candidates = set()
+        for column in columns:
+            for row in rows:
+                candidates.update(self.cells.get((column, row), ()))
+        found = []
+        for key in candidates:
+            bx1, by1, bx2, by2 = self.boxes[key]
+            if bx1 <= x2 and x1 <= bx2 and by1 <= y2 and y1 <= by2:
+                found.append(key)
+        return found
+
+    def queryPoint(self, x, y):
+        return self.query((x, y, x, y))
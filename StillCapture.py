@@ -0,0 +1,160 @@
+import os
+import ctypes
+import json
+import queue
+import struct
+import threading
+import time
+import numpy as np
+import amcam
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QImage
+
+# Writes an uncompressed (lossless) RGB TIFF with the metadata as JSON in the ImageDescription tag
+def writeTiff(path, rgb, description=""):
+    height, width = rgb.shape[:2]
+    descriptionBytes = description.encode("utf-8") + b"\0"
+    entryCount = 13
+    ifdSize = 2 + entryCount*12 + 4
+    bitsOffset = 8 + ifdSize
+    resolutionOffset = bitsOffset + 6
+    descriptionOffset = resolutionOffset + 16
+    dataOffset = descriptionOffset + len(descriptionBytes)
+    dataOffset += dataOffset % 2 # Word alignment
+    byteCount = width*height*3
+
+    def short(tag, value):
+        return struct.pack("<HHIHH", tag, 3, 1, value, 0)
+    def long(tag, value):
+        return struct.pack("<HHII", tag, 4, 1, value)
+
+    ifd = struct.pack("<H", entryCount)
+    ifd += long(256, width) # ImageWidth
+    ifd += long(257, height) # ImageLength
+    ifd += struct.pack("<HHII", 258, 3, 3, bitsOffset) # BitsPerSample 8,8,8
+    ifd += short(259, 1) # Compression: none
+    ifd += short(262, 2) # PhotometricInterpretation: RGB
+    ifd += struct.pack("<HHII", 270, 2, len(descriptionBytes), descriptionOffset) # ImageDescription
+    ifd += long(273, dataOffset) # StripOffsets
+    ifd += short(277, 3) # SamplesPerPixel
+    ifd += long(278, height) # RowsPerStrip
+    ifd += long(279, byteCount) # StripByteCounts
+    ifd += struct.pack("<HHII", 282, 5, 1, resolutionOffset) # XResolution
+    ifd += struct.pack("<HHII", 283, 5, 1, resolutionOffset+8) # YResolution
+    ifd += short(296, 1) # ResolutionUnit: none
+    ifd += struct.pack("<I", 0)
+
+    with open(path, "wb") as f:
+        f.write(b"II" + struct.pack("<HI", 42, 8))
+        f.write(ifd)
+        f.write(struct.pack("<HHH", 8, 8, 8))
+        f.write(struct.pack("<IIII", 1, 1, 1, 1))
+        f.write(descriptionBytes)
+        f.write(b"\0"*(dataOffset - descriptionOffset - len(descriptionBytes)))
+        f.write(np.ascontiguousarray(rgb[:, :, :3], dtype=np.uint8).tobytes())
+
+# Background writer: images are queued with their metadata and saved as PNG or TIFF without blocking the caller
+class ImageWriterThread(QThread):
+    imageSaved = pyqtSignal(str)
+    imageFailed = pyqtSignal(str)
+
+    def __init__(self, maxQueued=8, parent=None):
+        super().__init__(parent)
+        self.jobs = queue.Queue(maxQueued)
+        self.running = True
+
+    def enqueue(self, path, buf, width, height, stride, imageFormat, metadata): # False if the queue is full
+        try:
+            self.jobs.put_nowait((path, buf, width, height, stride, imageFormat, metadata))
+            return True
+        except queue.Full:
+            return False
+
+    def run(self):
+        while self.running or not self.jobs.empty():
+            try:
+                path, buf, width, height, stride, imageFormat, metadata = self.jobs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                self.write(path, buf, width, height, stride, imageFormat, metadata)
+                self.imageSaved.emit(path)
+            except OSError as e:
+                self.imageFailed.emit(f"{path}: {e}")
+
+    def write(self, path, buf, width, height, stride, imageFormat, metadata):
+        image = QImage(buf.data, width, height, stride, imageFormat)
+        if path.lower().endswith((".tif", ".tiff")):
+            rgb = image.convertToFormat(QImage.Format_RGB888)
+            ptr = rgb.constBits()
+            ptr.setsize(rgb.bytesPerLine()*rgb.height())
+            rows = np.frombuffer(ptr, dtype=np.uint8).reshape(rgb.height(), rgb.bytesPerLine())
+            writeTiff(path, rows[:, :width*3].reshape(height, width, 3), json.dumps(metadata))
+        else:
+            for key, value in metadata.items():
+                image.setText(key, str(value))
+            if not image.save(path):
+                raise OSError("could not write image")
+
+    def stop(self): # Finishes the queued images before returning
+        self.running = False
+        self.wait()
+
+
+# Handles AMCAM_EVENT_STILLIMAGE outside of the UI thread: pulls the full resolution still and hands it to the writer
+class StillCaptureThread(QThread):
+    captureFailed = pyqtSignal(str)
+
+    def __init__(self, hcam, maxWidth, maxHeight, bits, imageFormat, writer, directory="Captures", fileFormat="tiff", parent=None):
+        super().__init__(parent)
+        self.hcam = hcam
+        self.bits = bits
+        self.bufsize = ((maxWidth * self.bits + 31) // 32 * 4) * maxHeight # Still size can be smaller (ROI), the frame info tells
+        self.imageFormat = imageFormat
+        self.writer = writer
+        self.directory = directory
+        self.fileFormat = fileFormat
+        self.pendingStills = threading.Semaphore(0)
+        self.requests = queue.Queue() # Metadata of requested stills in snap order
+        self.running = True
+
+    def capture(self, metadata): # Called in the UI thread, returns immediately
+        self.requests.put(metadata)
+        try:
+            self.hcam.Snap(0) # Resolution index 0: full resolution
+        except amcam.HRESULTException:
+            self.requests.get_nowait()
+            raise
+
+    def notifyStill(self): # Called from the amcam internal threads for every AMCAM_EVENT_STILLIMAGE
+        self.pendingStills.release()
+
+    def run(self):
+        while self.running:
+            if not self.pendingStills.acquire(timeout=0.1):
+                continue
+            try:
+                metadata = self.requests.get_nowait()
+            except queue.Empty:
+                metadata = {}
+            buf = np.empty(self.bufsize, dtype=np.uint8) # Owned by the writer job afterwards
+            info = amcam.AmcamFrameInfoV2(0, 0, 0, 0, 0)
+            try:
+                self.hcam.PullStillImageV2(buf.ctypes.data_as(ctypes.c_char_p), self.bits, info)
+            except amcam.HRESULTException as ex:
+                self.captureFailed.emit('pull still image failed, hr=0x{:x}'.format(ex.hr))
+                continue
+            metadata["width"] = info.width
+            metadata["height"] = info.height
+            metadata["sensorTimestamp_us"] = info.timestamp
+            stride = (info.width * self.bits + 31) // 32 * 4
+            os.makedirs(self.directory, exist_ok=True)
+            captured = metadata.get("time", time.time())
+            stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(captured))
+            path = os.path.join(self.directory, f"still_{stamp}_{int(captured*1000)%1000:03d}.{self.fileFormat}")
+            if not self.writer.enqueue(path, buf, info.width, info.height, stride, self.imageFormat, metadata):
+                self.captureFailed.emit('still image dropped, writer queue is full')
+
+    def stop(self):
+        self.running = False
+        self.wait()
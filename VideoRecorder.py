@@ -0,0 +1,142 @@
+import os
+import json
+import queue
+import time
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Recording container: a directory with
+#   header.json        frame geometry and pixel format
+#   frames_NNNN.raw    chunks of framesPerChunk raw frames (rows x stride, as pulled from the camera), memory-mapped while written
+#   index.npy          one INDEX_DTYPE record per frame, frame i is slot i % framesPerChunk of chunk i // framesPerChunk
+INDEX_DTYPE = np.dtype([
+    ("seq", np.uint32),          # AmcamFrameInfoV2 sequence number
+    ("timestamp", np.uint64),    # AmcamFrameInfoV2 sensor timestamp, microseconds
+    ("hostTime", np.float64),    # time.time() when the frame was pulled
+    ("x", np.float64),           # ESP301.currentPosition in mm
+    ("y", np.float64),
+    ("z", np.float64),
+    ("laserOn", np.bool_),
+])
+
+# Background writer for a recording. The acquisition thread hands every pulled frame to record(), which copies it into one
+# of a fixed number of preallocated buffers and returns. When the disk cannot keep up and all buffers are in use the frame
+# is skipped for the recording only, the live view never waits for the recorder
+class VideoRecorderThread(QThread):
+    recordingFailed = pyqtSignal(str)
+
+    def __init__(self, directory, width, height, stride, bits, stateProvider=None, framesPerChunk=256, bufferCount=32, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.bits = bits
+        self.stateProvider = stateProvider # Returns ((x, y, z), laserOn), called from the acquisition thread
+        self.framesPerChunk = framesPerChunk
+        self.buffers = [np.empty((height, stride), dtype=np.uint8) for i in range(bufferCount)]
+        self.freeBuffers = queue.Queue()
+        for i in range(bufferCount):
+            self.freeBuffers.put(i)
+        self.frames = queue.Queue() # (buffer index, index record) in pull order
+        self.index = np.zeros(1024, dtype=INDEX_DTYPE)
+        self.recorded = 0
+        self.skipped = 0
+        self.chunk = None
+        self.running = True
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "header.json"), "w") as f:
+            json.dump({"width": width, "height": height, "stride": stride, "bits": bits, "framesPerChunk": framesPerChunk,
+                       "format": "RGB32" if bits == 32 else "RGB24", "started": time.time()}, f, indent=2)
+
+    def record(self, buf, info, pullTime=None): # Frame consumer of the acquisition thread, buf is only read before returning
+        try:
+            bufferIndex = self.freeBuffers.get_nowait()
+        except queue.Empty:
+            self.skipped += 1
+            return False
+        np.copyto(self.buffers[bufferIndex], buf)
+        record = np.zeros((), dtype=INDEX_DTYPE)
+        record["seq"] = info.seq
+        record["timestamp"] = info.timestamp
+        record["hostTime"] = time.time()
+        if self.stateProvider is not None:
+            position, laserOn = self.stateProvider()
+            record["x"], record["y"], record["z"] = position[:3]
+            record["laserOn"] = laserOn
+        self.frames.put((bufferIndex, record))
+        return True
+
+    def run(self):
+        try:
+            while self.running or not self.frames.empty():
+                try:
+                    bufferIndex, record = self.frames.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                self.write(self.buffers[bufferIndex], record)
+                self.freeBuffers.put(bufferIndex)
+        except OSError as e:
+            self.recordingFailed.emit(str(e))
+        finally:
+            self.closeChunk()
+            np.save(os.path.join(self.directory, "index.npy"), self.index[:self.recorded])
+
+    def write(self, buf, record):
+        slot = self.recorded % self.framesPerChunk
+        if slot == 0:
+            self.closeChunk()
+            path = os.path.join(self.directory, f"frames_{self.recorded // self.framesPerChunk:04d}.raw")
+            self.chunk = np.memmap(path, dtype=np.uint8, mode="w+", shape=(self.framesPerChunk, self.height, self.stride))
+        self.chunk[slot] = buf
+        if self.recorded == len(self.index):
+            self.index = np.resize(self.index, 2*len(self.index))
+        self.index[self.recorded] = record
+        self.recorded += 1
+
+    def closeChunk(self): # Flushes the written pages so the memory of a chunk is released before the next one
+        if self.chunk is None:
+            return
+        self.chunk.flush()
+        path = self.chunk.filename
+        self.chunk = None # Unmaps the chunk
+        if self.recorded % self.framesPerChunk != 0: # Last chunk: cut the unused frame slots
+            with open(path, "r+b") as f:
+                f.truncate((self.recorded % self.framesPerChunk)*self.height*self.stride)
+
+    def counters(self): # Frames written to disk (or queued) and frames skipped because the writer fell behind
+        return {"recorded": self.recorded, "queued": self.frames.qsize(), "skipped": self.skipped}
+
+    def stop(self): # Writes the queued frames and the index before returning
+        self.running = False
+        self.wait()
+
+
+# Read access to a recording for review, frames are memory-mapped on demand
+class VideoRecording:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "header.json")) as f:
+            self.header = json.load(f)
+        self.index = np.load(os.path.join(directory, "index.npy"))
+        self.chunks = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, i): # (height, width, channels) view of frame i, channels in camera byte order
+        chunkIndex, slot = divmod(i, self.header["framesPerChunk"])
+        if chunkIndex not in self.chunks:
+            path = os.path.join(self.directory, f"frames_{chunkIndex:04d}.raw")
+            self.chunks[chunkIndex] = np.memmap(path, dtype=np.uint8, mode="r").reshape(-1, self.header["height"], self.header["stride"])
+        channels = self.header["bits"] // 8
+        return self.chunks[chunkIndex][slot][:, :self.header["width"]*channels].reshape(self.header["height"], self.header["width"], channels)
+
+    def frameAt(self, hostTime): # Index of the last frame pulled at or before hostTime (time.time())
+        return max(0, int(np.searchsorted(self.index["hostTime"], hostTime, side="right")) - 1)
+
+    def droppedFrames(self): # Sequence numbers missing in the recording (camera drops and recorder skips)
+        seq = self.index["seq"].astype(np.int64)
+        gaps = np.diff(seq) - 1
+        return int(gaps[gaps > 0].sum()) if len(gaps) else 0
@@ -0,0 +1,36 @@
+import math
+import numpy as np
+
+# Stage mm <-> view pixels for the camera view and its overlays, the only place the camera calibration is applied:
+#   pixel = center + R(rotation)*F*(point - position)/scale
+# position is the stage position shown at the view pixel center, scale the mm per view pixel (pixel size times sensor
+# pixels per view pixel), F the axis flips (stage y points up, pixel y down) and rotation the angle of the camera against
+# the stage axes in degrees. toView and toStage map arrays of any shape (..., 2), e.g. the stacked corners of all design
+# shapes, with one matrix product
+class ViewTransform:
+    def __init__(self, position, scale, center, rotation=0.0, flip=(False, True)):
+        self.position = np.array(position[:2], dtype=np.float64)
+        self.scale = scale
+        self.center = np.array(center, dtype=np.float64)
+        self.rotation = rotation
+        self.flip = flip
+        cos, sin = math.cos(math.radians(rotation)), math.sin(math.radians(rotation))
+        signs = np.diag([-1.0 if flip[0] else 1.0, -1.0 if flip[1] else 1.0])
+        self.matrix = np.array([[cos, -sin], [sin, cos]]) @ signs/scale # Stage offset -> pixel offset
+        self.inverse = np.linalg.inv(self.matrix)
+
+    def toView(self, points): # Stage mm (..., 2) -> view pixels (..., 2)
+        return (np.asarray(points, dtype=np.float64) - self.position) @ self.matrix.T + self.center
+
+    def toStage(self, pixels): # View pixels (..., 2) -> stage mm (..., 2)
+        return (np.asarray(pixels, dtype=np.float64) - self.center) @ self.inverse.T + self.position
+
+
+def rotateAround(points, centers, degrees): # Rotates (n, k, 2) points around (n, 2) centers by (n,) angles, clockwise on screen like QTransform.rotate
+    angle = np.radians(np.asarray(degrees, dtype=np.float64))[:, None]
+    cos, sin = np.cos(angle), np.sin(angle)
+    offset = points - centers[:, None, :]
+    rotated = np.empty_like(offset)
+    rotated[..., 0] = centers[:, None, 0] + offset[..., 0]*cos - offset[..., 1]*sin
+    rotated[..., 1] = centers[:, None, 1] + offset[..., 0]*sin + offset[..., 1]*cos
+    return rotated
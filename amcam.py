@@ -402,6 +402,7 @@ class Amcam:
         __PROGRESS_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.py_object)
         __HOTPLUG_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
         __hotplug = None
+        __hotplugCb = None # The thunk given to Amcam_HotPlug, kept alive while the library may call it
 
     __lib = None
     __progress = None
@@ -467,8 +468,10 @@ class Amcam:
             cls.__hotplug = fun
             if cls.__hotplug is None:
                 cls.__lib.Amcam_HotPlug(None, None)
+                cls.__hotplugCb = None
             else:
-                cls.__lib.Amcam_HotPlug(cls.__HOTPLUG_CALLBACK(cls.__hotplugCallbackFun), None)
+                cls.__hotplugCb = cls.__HOTPLUG_CALLBACK(cls.__hotplugCallbackFun)
+                cls.__lib.Amcam_HotPlug(cls.__hotplugCb, None)
 
     @classmethod
     def EnumV2(cls):
@@ -556,7 +559,7 @@ class Amcam:
             self.__lib.Amcam_PullImageV2(self.__h, pImageData, bits, None)
         else:
             x = self.__FrameInfoV2()
-            self.__lib.Amcam_PullImageV2(self.__h, pImageData, bits, self.byref(x))
+            self.__lib.Amcam_PullImageV2(self.__h, pImageData, bits, ctypes.byref(x))
             self.__convertFrameInfo(pInfo, x)
 
     def PullStillImageV2(self, pImageData, bits, pInfo):
@@ -564,7 +567,7 @@ class Amcam:
             self.__lib.Amcam_PullStillImageV2(self.__h, pImageData, bits, None)
         else:
             x = self.__FrameInfoV2()
-            self.__lib.Amcam_PullStillImageV2(self.__h, pImageData, bits, self.byref(x))
+            self.__lib.Amcam_PullStillImageV2(self.__h, pImageData, bits, ctypes.byref(x))
             self.__convertFrameInfo(pInfo, x)
 
 # bits: 24 (RGB24), 32 (RGB32), 48 (RGB48), 8 (Gray) or 16 (Gray). In RAW mode, this parameter is ignored.
@@ -574,7 +577,7 @@ class Amcam:
             self.__lib.Amcam_PullImageWithRowPitchV2(self.__h, pImageData, bits, rowPitch, None)
         else:
             x = self.__FrameInfoV2()
-            self.__lib.Amcam_PullImageWithRowPitchV2(self.__h, pImageData, bits, rowPitch, self.byref(x))
+            self.__lib.Amcam_PullImageWithRowPitchV2(self.__h, pImageData, bits, rowPitch, ctypes.byref(x))
             self.__convertFrameInfo(pInfo, x)
 
     def PullStillImageWithRowPitchV2(self, pImageData, bits, rowPitch, pInfo):
@@ -582,7 +585,7 @@ class Amcam:
             self.__lib.Amcam_PullStillImageWithRowPitchV2(self.__h, pImageData, bits, rowPitch, None)
         else:
             x = self.__FrameInfoV2()
-            self.__lib.Amcam_PullStillImageWithRowPitchV2(self.__h, pImageData, bits, rowPitch, pInfo)
+            self.__lib.Amcam_PullStillImageWithRowPitchV2(self.__h, pImageData, bits, rowPitch, ctypes.byref(x))
             self.__convertFrameInfo(pInfo, x)
 
     def ResolutionNumber(self):
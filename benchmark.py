@@ -0,0 +1,224 @@
+import os, sys, time, ctypes
+import numpy as np
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtCore import Qt, QRect, QRectF, QTimer, QEventLoop
+from PyQt5.QtGui import QImage, QPixmap, QPainter
+from PyQt5.QtWidgets import QApplication
+import amcam
+from SimulatedCamera import SimulatedAmcam
+
+# Benchmarks of the live view pipeline, run with: python benchmark.py [frame] [liveview] [transform] [hittest] [--quick]
+
+def timePerFrame(function, frames): # Returns milliseconds per call
+    function() # warm up
+    start = time.perf_counter()
+    for i in range(frames):
+        function()
+    return (time.perf_counter()-start)*1000/frames
+
+def benchmarkFramePath(width=2048, height=1536, widgetWidth=1360, widgetHeight=1020, frames=30):
+    target = QImage(widgetWidth, widgetHeight, QImage.Format_RGB32) # Stands in for the widget backing store
+    targetRect = QRect(0, 0, widgetWidth, widgetHeight)
+
+    # Old path: RGB24 buffer -> QImage -> QPixmap.fromImage -> QLabel.setScaledContents (scaled copy) -> blit
+    strideRGB24 = (width * 24 + 31) // 32 * 4
+    bufRGB24 = bytes(strideRGB24 * height)
+    def legacyFrame():
+        img = QImage(bufRGB24, width, height, strideRGB24, QImage.Format_RGB888)
+        pixmap = QPixmap.fromImage(img) # copy + RGB888 -> RGB32 conversion
+        scaled = pixmap.scaled(widgetWidth, widgetHeight, Qt.IgnoreAspectRatio, Qt.SmoothTransformation) # second copy
+        painter = QPainter(target)
+        painter.drawPixmap(0, 0, scaled) # third copy
+        painter.end()
+
+    # New path: writable RGB32 numpy buffer borrowed by a QImage created once, scaled while painting
+    bufRGB32 = np.zeros((height, width*4), dtype=np.uint8)
+    borrowed = QImage(bufRGB32.data, width, height, width*4, QImage.Format_RGB32)
+    def zeroCopyFrame():
+        painter = QPainter(target)
+        painter.drawImage(targetRect, borrowed) # only copy: scaling into the backing store
+        painter.end()
+
+    isBorrowed = int(borrowed.constBits()) == bufRGB32.ctypes.data
+    legacy = timePerFrame(legacyFrame, frames)
+    zeroCopy = timePerFrame(zeroCopyFrame, frames)
+    print(f"Frame path {width}x{height} -> {widgetWidth}x{widgetHeight}")
+    print(f"  legacy    (RGB24, QPixmap, scaled contents): {legacy:8.2f} ms/frame, 3 frame copies, 1 pixel format conversion")
+    print(f"  zero-copy (RGB32, borrowed QImage)         : {zeroCopy:8.2f} ms/frame, 1 frame copy, 0 pixel format conversions")
+    print(f"  QImage borrows the numpy buffer: {isBorrowed}")
+    return {"legacy": legacy, "zeroCopy": zeroCopy}
+
+def syntheticDesignItems(count, center=(6.5, 7.2), spread=0.08, seed=0): # Design strings around center (mm) like the design list produces them
+    rng = np.random.default_rng(seed)
+    kinds = ["rect", "line", "quadr", "del_rect"]
+    items = []
+    for i in range(count):
+        x, y = center[0] + rng.uniform(-spread, spread), center[1] + rng.uniform(-spread, spread)
+        w, h = rng.uniform(0.002, 0.02, 2)
+        kind = kinds[i % len(kinds)]
+        if kind == "line":
+            items.append(f"line;{x:.5f};{y:.5f};{x+w:.5f};{y-h:.5f}")
+        elif kind == "quadr":
+            items.append(f"quadr;{x:.5f};{y:.5f};{x+w:.5f};{y:.5f};{x+w*1.2:.5f};{y-h:.5f};{x-w*0.2:.5f};{y-h:.5f}")
+        else:
+            corners = f"{x:.5f};{y:.5f};{x+w:.5f};{y:.5f};{x+w:.5f};{y-h:.5f};{x:.5f};{y-h:.5f}"
+            items.append(f"rect;{corners};0.0;20" if kind == "rect" else f"del_rect;{corners};0.0")
+    return items
+
+def runEventLoop(seconds):
+    loop = QEventLoop()
+    QTimer.singleShot(int(seconds*1000), loop.quit)
+    loop.exec_()
+
+def benchmarkLiveViewStages(frameWidth, frameHeight, designCount, widgetWidth, widgetHeight, frames=20): # Milliseconds per frame for every stage
+    from ClickableCameraLabel import ClickableCameraLabel
+    from FrameContrast import ContrastStretch
+    camera = SimulatedAmcam(frameWidth, frameHeight, 1000)
+    stride = frameWidth*4
+    buf = np.zeros((frameHeight, stride), dtype=np.uint8)
+    pointer = buf.ctypes.data_as(ctypes.c_char_p)
+    info = amcam.AmcamFrameInfoV2(0, 0, 0, 0, 0)
+    image = QImage(buf.data, frameWidth, frameHeight, stride, QImage.Format_RGB32)
+    label = ClickableCameraLabel()
+    label.resize(widgetWidth, widgetHeight)
+    label.setSensorGeometry(frameWidth, frameHeight)
+    label.designItems = syntheticDesignItems(designCount)
+    label.setFrame(image)
+    target = QImage(widgetWidth, widgetHeight, QImage.Format_RGB32)
+    camera.PullImageV2(pointer, 32, info) # A synthetic frame for the contrast stretch
+    stretch = ContrastStretch()
+    stretchBuffer = np.empty_like(buf)
+
+    def frameBlit():
+        painter = QPainter(target)
+        painter.scale(widgetWidth/frameWidth, widgetHeight/frameHeight)
+        painter.drawImage(QRectF(0, 0, frameWidth, frameHeight), image)
+        painter.end()
+    def paintFrame(): # Frame blit + grid, crosshair and scale bar
+        painter = QPainter(target)
+        label.paintFrame(painter)
+        painter.end()
+
+    stages = {
+        "pull": timePerFrame(lambda: camera.PullImageV2(pointer, 32, info), frames),
+        "QImage": timePerFrame(lambda: QImage(buf.data, frameWidth, frameHeight, stride, QImage.Format_RGB32), frames),
+        "QPixmap": timePerFrame(lambda: QPixmap.fromImage(image).toImage(), frames), # setPixmap round trip, not used by the live view anymore
+        "design parse": timePerFrame(lambda: label.setFrame(image), frames),
+        "contrast": timePerFrame(lambda: stretch(buf, stretchBuffer, frameWidth, frameHeight, 4), frames), # Levels measured every stretch.interval frames
+        "frame blit": timePerFrame(frameBlit, frames),
+    }
+    stages["grid overlay"] = max(0.0, timePerFrame(paintFrame, frames) - stages["frame blit"])
+    stages["paint"] = timePerFrame(lambda: label.render(target), frames) # Complete paintEvent: frame, grid and design shapes
+    return stages
+
+def benchmarkLiveViewThroughput(frameWidth, frameHeight, designCount, widgetWidth, widgetHeight, seconds=2.0, cameraFps=120):
+    from CameraView import CameraView
+    SimulatedAmcam.configure(width=frameWidth, height=frameHeight, fps=cameraFps)
+    view = CameraView(cameraClass=SimulatedAmcam, displayRate=1000) # Display rate above the camera rate: every frame is presented if the UI keeps up
+    view.setFixedSize(widgetWidth, widgetHeight)
+    view.imageLabel.resize(widgetWidth, widgetHeight)
+    view.imageLabel.designItems = syntheticDesignItems(designCount)
+    view.show()
+    painted = [0]
+    def countPaint():
+        painted[0] += 1
+    view.imageLabel.framePainted.connect(countPaint)
+    deadline = time.perf_counter() + 10
+    while view.acquisition is None and time.perf_counter() < deadline: # The camera is opened in the background
+        runEventLoop(0.05)
+    runEventLoop(0.5) # Warm up
+    view.resetFrameMetrics()
+    startCounters = view.frameCounters()
+    painted[0] = 0
+    startWall, startCpu = time.perf_counter(), time.process_time()
+    runEventLoop(seconds)
+    wall, cpu = time.perf_counter() - startWall, time.process_time() - startCpu
+    counters = view.frameCounters()
+    metrics = view.frameMetrics()
+    view.close()
+    frames = max(painted[0], 1)
+    return {
+        "cameraFps": (counters["pulled"] - startCounters["pulled"])/wall,
+        "displayFps": painted[0]/wall,
+        "cpuPerFrame": cpu*1000/frames, # Whole process: simulated camera, acquisition and UI thread
+        "pullToPaint": metrics["pullToPaint_ms"]["p50"],
+    }
+
+def benchmarkLiveView(frameSizes=((1024, 768), (2048, 1536)), designCounts=(0, 10, 100, 1000), widgetSizes=((800, 600), (1360, 1020)), seconds=2.0):
+    stageNames = ["pull", "QImage", "QPixmap", "design parse", "contrast", "frame blit", "grid overlay", "paint"]
+    print("Live view pipeline (simulated camera, ms per frame for the stages)")
+    print(f"{'frame':>10} {'widget':>10} {'designs':>7} {'cam fps':>8} {'view fps':>8} {'cpu/fr':>7} {'p2p p50':>8} | " + " ".join(f"{name:>12}" for name in stageNames))
+    results = []
+    for frameWidth, frameHeight in frameSizes:
+        for widgetWidth, widgetHeight in widgetSizes:
+            for designCount in designCounts:
+                throughput = benchmarkLiveViewThroughput(frameWidth, frameHeight, designCount, widgetWidth, widgetHeight, seconds)
+                stages = benchmarkLiveViewStages(frameWidth, frameHeight, designCount, widgetWidth, widgetHeight)
+                print(f"{f'{frameWidth}x{frameHeight}':>10} {f'{widgetWidth}x{widgetHeight}':>10} {designCount:>7} "
+                      f"{throughput['cameraFps']:>8.1f} {throughput['displayFps']:>8.1f} {throughput['cpuPerFrame']:>7.2f} {throughput['pullToPaint']:>8.1f} | "
+                      + " ".join(f"{stages[name]:>12.3f}" for name in stageNames))
+                results.append({"frame": (frameWidth, frameHeight), "widget": (widgetWidth, widgetHeight), "designs": designCount, **throughput, "stages": stages})
+    return results
+
+def benchmarkDesignTransform(designCounts=(10, 100, 1000), repeats=200): # Microseconds per conversion of a whole design
+    from DesignGeometry import DesignGeometry
+    from ViewTransform import ViewTransform
+    print("Design transform (µs per design)")
+    print(f"{'designs':>7} {'corners':>8} {'parse':>10} {'scalar':>10} {'toView':>10} {'toStage':>10}")
+    results = []
+    for designCount in designCounts:
+        items = syntheticDesignItems(designCount)
+        design = DesignGeometry(items)
+        transform = ViewTransform((6.5, 7.2), 0.000087*1.28, (400, 300))
+        position, scale = transform.position, transform.scale
+        def scalar(): # Corner by corner like the conversions before ViewTransform
+            return [((x - position[0])/scale + 400, (position[1] - y)/scale + 300) for x, y in design.vertices.tolist()]
+        pixels = transform.toView(design.vertices)
+        timings = {
+            "parse": timePerFrame(lambda: DesignGeometry(items), max(repeats//10, 1))*1000,
+            "scalar": timePerFrame(scalar, repeats)*1000,
+            "toView": timePerFrame(lambda: transform.toView(design.vertices), repeats)*1000,
+            "toStage": timePerFrame(lambda: transform.toStage(pixels), repeats)*1000,
+        }
+        print(f"{designCount:>7} {len(design.vertices):>8} " + " ".join(f"{timings[name]:>10.1f}" for name in ["parse", "scalar", "toView", "toStage"]))
+        results.append({"designs": designCount, "corners": len(design.vertices), **timings})
+    return results
+
+def benchmarkHitTest(spacings=(60, 30, 15), widgetWidth=1360, widgetHeight=1020, tests=2000): # Step-and-repeat arrays of 10x10 px rects
+    from PyQt5.QtCore import QPointF
+    from ClickableCameraLabel import ClickableCameraLabel
+    label = ClickableCameraLabel()
+    label.resize(widgetWidth, widgetHeight)
+    rng = np.random.default_rng(0)
+    points = [QPointF(x, y) for x, y in rng.uniform(0, (widgetWidth, widgetHeight), (tests, 2)).tolist()]
+    print("Design hit-testing (µs per call)")
+    print(f"{'shapes':>7} {'index all':>10} {'index one':>10} {'shapeAt':>10} {'conflict':>10}")
+    results = []
+    for spacing in spacings:
+        label.rectangles = [{'rect': QRectF(x, y, 10, 10), 'rotation': 0, 'del_rect': QRectF(x - 2, y - 2, 14, 14), 'del_size': 2}
+                            for x in range(0, widgetWidth - 10, spacing) for y in range(0, widgetHeight - 10, spacing)]
+        timings = {
+            "index all": timePerFrame(label.indexDesign, 3)*1000,
+            "index one": timePerFrame(lambda: label.indexShape("rect", len(label.rectangles)//2), tests)*1000,
+            "shapeAt": timePerFrame(lambda: [label.shapeAt(point) for point in points], 1)*1000/tests,
+            "conflict": timePerFrame(lambda: [label.rectConflict(QRectF(point.x(), point.y(), 30, 30)) for point in points], 1)*1000/tests,
+        }
+        print(f"{len(label.rectangles):>7} " + " ".join(f"{timings[name]:>10.1f}" for name in ["index all", "index one", "shapeAt", "conflict"]))
+        results.append({"shapes": len(label.rectangles), **timings})
+    return results
+
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    selected = [arg for arg in sys.argv[1:] if not arg.startswith("--")] or ["frame", "liveview"]
+    if "frame" in selected:
+        benchmarkFramePath()
+    if "liveview" in selected:
+        if "--quick" in sys.argv:
+            benchmarkLiveView(frameSizes=((1024, 768),), designCounts=(0, 100), widgetSizes=((800, 600),), seconds=1.0)
+        else:
+            benchmarkLiveView()
+    if "transform" in selected:
+        benchmarkDesignTransform()
+    if "hittest" in selected:
+        benchmarkHitTest()
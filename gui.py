@@ -1,28 +1,46 @@
+import time
+STARTUP_TIME = time.perf_counter() # Before the imports below, startup times include loading the modules
 from ESP301 import ESP301, ESP301Status
 from NPILaser import NPILaser, NPILaserStatus
 from CameraView import CameraView
-import sys
+from Autofocus import AutofocusThread, FocusFrameGrabber
+from CameraAcquisition import FrameGrabber
+from MosaicScan import MosaicScanThread, TileWriterThread, scanPositions
+from MosaicStore import TilePyramid
+from MosaicOverview import MosaicOverview
+from FlakeDetection import FlakeDetector
+from Registration import DriftEstimator
+from PositionCorrection import ClosedLoopMoveThread
+from DeviceStartup import DeviceConnectThread, StartupTimer
+import os, sys, serial
 from PyQt5.QtCore import pyqtSlot, Qt, QSize
 from PyQt5 import QtCore
 from PyQt5.QtGui import QPixmap, QIntValidator, QPainter, QPen, QColor, QBrush
-from PyQt5.QtWidgets import QLabel, QApplication, QWidget, QFrame, QCheckBox, QMessageBox, QVBoxLayout, QPushButton, QLineEdit, QHBoxLayout, QStackedWidget, QGridLayout, QListWidgetItem, QListWidget
+from PyQt5.QtWidgets import QLabel, QApplication, QWidget, QFrame, QCheckBox, QMessageBox, QVBoxLayout, QPushButton, QLineEdit, QHBoxLayout, QStackedWidget, QGridLayout, QListWidgetItem, QListWidget, QComboBox
 import GuiHelper
 
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, cameraClass=None):
         super().__init__()
-        self.controller = ESP301(self, "3")
+        self.startupTimer = StartupTimer(STARTUP_TIME)
+        self.controller = ESP301(self) # Connected in the background once the window is up, see connectController
         self.laser = NPILaser(self)
+        self.controllerConnect = None
+        self.laserConnect = None
         self.setWindowTitle("Laser-Cutting Microscope GUI")
         self.controller.statusUpdate.connect(self.updateView)
+        self.controller.statusUpdate.connect(self.checkPendingMove)
         self.laser.statusUpdate.connect(self.updateView)
         self.pixel_size = 0.000089 #mm
 
-        print("Starting Graphic User Interface, this may take a couple of seconds")
-
         screen_size = QApplication.primaryScreen().availableGeometry()
         self.setFixedSize(screen_size.width(), int(screen_size.height()*0.95))
         self.designItems = []
+        self.autofocus = None
+        self.mosaicScan = None
+        self.closedLoopMove = None
+        self.pendingMoveDone = None # Callback of a worker thread (autofocus, scan) waiting for a stage move
+        self.pendingMoveId = 0 # Counts the requested moves, a status poll of an earlier move does not finish the current one
 
 
         # Main horizontal layout (left + right)
@@ -30,9 +48,18 @@ class MainWindow(QWidget):
         self.setLayout(main_layout)
 
         # ===== Left box (Camera View) =====
-        self.cameraView = CameraView()
+        self.cameraView = CameraView(cameraClass=cameraClass)
+        self.cameraView.cameraConnected.connect(lambda connected, seconds: self.startupTimer.mark("camera connected" if connected else "camera not available"))
         main_layout.addWidget(self.cameraView, 7)
         self.cameraView.imageLabel.updated.connect(self.updateDesignItems)
+        self.cameraView.recordingStateProvider = lambda: (self.controller.currentPosition, self.laser.status == NPILaserStatus.ON)
+        self.flakeDetector = FlakeDetector(self.cameraView.frameToStage)
+        self.flakeDetector.flakesDetected.connect(self.flakesDetected)
+        self.driftEstimator = DriftEstimator(lambda: self.cameraView.frameToStage()[2])
+        self.driftTimer = QtCore.QTimer(self)
+        self.driftTimer.timeout.connect(self.updateDriftReadout)
+        self.averagedPosition = None # Stage position the frame average was started at
+        self.controller.statusUpdate.connect(self.updateFrameAveraging)
         self.lineHorizontalStepSize = 76.8 #pixels
         self.lineVerticalStepSize = 102.5 #pixels
 
@@ -49,10 +76,61 @@ class MainWindow(QWidget):
         self.laserSafetyOverlayImage.resize(int(overlayPixmap.width()/7), int(overlayPixmap.height()/7))
         self.laserSafetyOverlayImage.move(50, 30)
         self.laserSafetyOverlayImage.setHidden(True)
+        self.connectController("3")
         self.updateView()
         
         self.laserSafetyOverlayImage.raise_()
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        self.startupTimer.mark("window painted")
+
+    # --- Device connections, the serial handshakes run in worker threads ---
+    def connectController(self, port):
+        if self.controllerConnect is not None or not port:
+            return
+        self.controller.port = port
+        self.controllerConnect = DeviceConnectThread("controller", lambda: self.controller.open(port), (serial.SerialException,))
+        self.controllerConnect.connected.connect(self.controllerConnected)
+        self.controllerConnect.failed.connect(lambda name, error, seconds: self.controllerConnectFailed(port, error))
+        self.controllerConnect.start()
+        self.updateView()
+
+    def controllerConnected(self, name, controller, seconds):
+        self.controllerConnect.wait() # Returns right after the signal, the thread must not be deleted while it runs
+        self.controllerConnect = None
+        self.controller.initializeMotors()
+        self.startupTimer.mark("controller connected")
+        self.updateView()
+
+    def controllerConnectFailed(self, port, error):
+        self.controllerConnect.wait() # Returns right after the signal, the thread must not be deleted while it runs
+        self.controllerConnect = None
+        self.controller.connectionFailed(port, error)
+        self.updateView()
+
+    def connectLaser(self, port):
+        if self.laserConnect is not None or not port:
+            return
+        self.laser.port = port
+        self.laserConnect = DeviceConnectThread("laser", lambda: self.laser.open(port), (serial.SerialException,))
+        self.laserConnect.connected.connect(self.laserConnected)
+        self.laserConnect.failed.connect(lambda name, error, seconds: self.laserConnectFailed(port, error))
+        self.laserConnect.start()
+        self.updateView()
+
+    def laserConnected(self, name, laser, seconds):
+        self.laserConnect.wait() # Returns right after the signal, the thread must not be deleted while it runs
+        self.laserConnect = None
+        self.startupTimer.mark("laser connected")
+        self.updateView()
+
+    def laserConnectFailed(self, port, error):
+        self.laserConnect.wait() # Returns right after the signal, the thread must not be deleted while it runs
+        self.laserConnect = None
+        self.laser.connectionFailed(port, error)
+        self.updateView()
+
     # --- Design of right box ---
     def setup_right_box(self):
         layout = QVBoxLayout()
@@ -599,6 +677,181 @@ class MainWindow(QWidget):
         laser_row.addWidget(self.laserTurnOff)
         self.laser_disabled_widgets.extend([self.laser_label, self.laserTurnOn, self.laserTurnOff])
         self.laser_disabled_section_layout.addLayout(laser_row)
+
+        # --- Subsection: Camera ---
+        camera_title = QLabel("Camera")
+        camera_title.setStyleSheet("font-weight: bold; font-size: 18px; margin-top: 10px")
+        layout.addWidget(camera_title)
+        focus_window_row = QHBoxLayout()
+        focus_window_label = QLabel("Focus Window:")
+        self.focus_window_switch = GuiHelper.ToggleSwitch(False, "On - Reduced camera window", "Off - Full sensor")
+        self.focus_window_switch.valueChanged.connect(self.toggleFocusWindow)
+        self.pick_focus_window_btn = QPushButton("Pick Window")
+        self.pick_focus_window_btn.setFixedWidth(100)
+        self.pick_focus_window_btn.clicked.connect(self.cameraView.imageLabel.startFocusWindowPicking)
+        self.cameraView.imageLabel.focusWindowPicked.connect(self.setPickedFocusWindow)
+        binning_label = QLabel("Binning:")
+        self.binning_input = QLineEdit()
+        self.binning_input.setValidator(QIntValidator(1, 8))
+        self.binning_input.setFixedWidth(40)
+        self.binning_input.setPlaceholderText("1")
+        focus_window_row.addWidget(focus_window_label)
+        focus_window_row.addWidget(self.focus_window_switch)
+        focus_window_row.addWidget(self.pick_focus_window_btn)
+        focus_window_row.addWidget(binning_label)
+        focus_window_row.addWidget(self.binning_input)
+        focus_window_row.addStretch()
+        layout.addLayout(focus_window_row)
+        capture_row = QHBoxLayout()
+        self.capture_still_btn = QPushButton("Capture Still")
+        self.capture_still_btn.setFixedWidth(120)
+        self.capture_still_btn.clicked.connect(self.cameraView.captureStill)
+        self.capture_status_label = QLabel("")
+        self.capture_status_label.setStyleSheet("color: gray;")
+        self.cameraView.stillSaved.connect(lambda path: self.capture_status_label.setText(f"Saved {path}"))
+        capture_row.addWidget(self.capture_still_btn)
+        capture_row.addWidget(self.capture_status_label)
+        capture_row.addStretch()
+        layout.addLayout(capture_row)
+        record_row = QHBoxLayout()
+        record_label = QLabel("Video:")
+        self.record_switch = GuiHelper.ToggleSwitch(False, "On - Recording", "Off - Not recording")
+        self.record_switch.valueChanged.connect(self.toggleRecording)
+        self.cameraView.recordingStopped.connect(self.recordingStopped)
+        record_row.addWidget(record_label)
+        record_row.addWidget(self.record_switch)
+        record_row.addStretch()
+        layout.addLayout(record_row)
+        hud_row = QHBoxLayout()
+        hud_label = QLabel("Frame Metrics:")
+        self.hud_switch = GuiHelper.ToggleSwitch(False, "On - Shown in camera view", "Off - Hidden")
+        self.hud_switch.valueChanged.connect(self.cameraView.setHudEnabled)
+        hud_row.addWidget(hud_label)
+        hud_row.addWidget(self.hud_switch)
+        hud_row.addStretch()
+        layout.addLayout(hud_row)
+        averaging_row = QHBoxLayout()
+        averaging_label = QLabel("Frame Averaging:")
+        self.averaging_combo = QComboBox()
+        self.averaging_combo.addItems(["Off", "2 frames", "4 frames", "8 frames", "16 frames"])
+        self.averaging_combo.currentIndexChanged.connect(lambda index: self.cameraView.setFrameAveraging(1 << index))
+        averaging_row.addWidget(averaging_label)
+        averaging_row.addWidget(self.averaging_combo)
+        averaging_row.addStretch()
+        layout.addLayout(averaging_row)
+        contrast_row = QHBoxLayout()
+        contrast_label = QLabel("Contrast Stretch:")
+        self.contrast_switch = GuiHelper.ToggleSwitch(False, "On - Levels stretched per channel", "Off")
+        self.contrast_switch.valueChanged.connect(self.cameraView.setContrastStretch)
+        contrast_row.addWidget(contrast_label)
+        contrast_row.addWidget(self.contrast_switch)
+        contrast_row.addStretch()
+        layout.addLayout(contrast_row)
+        flat_field_row = QHBoxLayout()
+        flat_field_label = QLabel("Flat Field:")
+        self.flat_field_switch = GuiHelper.ToggleSwitch(False, "On - Dark and flat corrected", "Off")
+        self.flat_field_switch.valueChanged.connect(self.cameraView.setFlatFieldCorrection)
+        self.dark_reference_btn = QPushButton("Dark")
+        self.dark_reference_btn.setFixedWidth(60)
+        self.dark_reference_btn.setToolTip("Block the light, then capture the dark reference for the current exposure")
+        self.dark_reference_btn.clicked.connect(lambda: self.cameraView.captureReference("dark"))
+        self.flat_reference_btn = QPushButton("Flat")
+        self.flat_reference_btn.setFixedWidth(60)
+        self.flat_reference_btn.setToolTip("Move to blank substrate and defocus, then capture the flat reference for the current exposure")
+        self.flat_reference_btn.clicked.connect(lambda: self.cameraView.captureReference("flat"))
+        self.flat_field_status_label = QLabel("")
+        self.flat_field_status_label.setStyleSheet("color: gray;")
+        self.cameraView.flatFieldChanged.connect(self.flat_field_status_label.setText)
+        flat_field_row.addWidget(flat_field_label)
+        flat_field_row.addWidget(self.flat_field_switch)
+        flat_field_row.addWidget(self.dark_reference_btn)
+        flat_field_row.addWidget(self.flat_reference_btn)
+        flat_field_row.addWidget(self.flat_field_status_label)
+        flat_field_row.addStretch()
+        layout.addLayout(flat_field_row)
+        flake_row = QHBoxLayout()
+        flake_label = QLabel("Flake Detection:")
+        self.flake_switch = GuiHelper.ToggleSwitch(False, "On - Click a flake to add it", "Off")
+        self.flake_switch.valueChanged.connect(self.toggleFlakeDetection)
+        self.flake_status_label = QLabel("")
+        self.flake_status_label.setStyleSheet("color: gray;")
+        flake_row.addWidget(flake_label)
+        flake_row.addWidget(self.flake_switch)
+        flake_row.addWidget(self.flake_status_label)
+        flake_row.addStretch()
+        layout.addLayout(flake_row)
+        drift_row = QHBoxLayout()
+        drift_label = QLabel("Drift Readout:")
+        self.drift_switch = GuiHelper.ToggleSwitch(False, "On", "Off")
+        self.drift_switch.valueChanged.connect(self.toggleDriftReadout)
+        self.drift_reset_btn = QPushButton("Zero")
+        self.drift_reset_btn.setFixedWidth(60)
+        self.drift_reset_btn.clicked.connect(self.driftEstimator.reset)
+        self.drift_status_label = QLabel("")
+        self.drift_status_label.setStyleSheet("color: gray;")
+        drift_row.addWidget(drift_label)
+        drift_row.addWidget(self.drift_switch)
+        drift_row.addWidget(self.drift_reset_btn)
+        drift_row.addWidget(self.drift_status_label)
+        drift_row.addStretch()
+        layout.addLayout(drift_row)
+        closed_loop_row = QHBoxLayout()
+        closed_loop_label = QLabel("Closed-Loop Moves:")
+        self.closed_loop_switch = GuiHelper.ToggleSwitch(False, "On - Go-to moves are corrected with the camera", "Off")
+        self.closed_loop_status_label = QLabel("")
+        self.closed_loop_status_label.setStyleSheet("color: gray;")
+        closed_loop_row.addWidget(closed_loop_label)
+        closed_loop_row.addWidget(self.closed_loop_switch)
+        closed_loop_row.addWidget(self.closed_loop_status_label)
+        closed_loop_row.addStretch()
+        layout.addLayout(closed_loop_row)
+        autofocus_row = QHBoxLayout()
+        self.autofocus_btn = QPushButton("Autofocus")
+        self.autofocus_btn.setFixedWidth(120)
+        self.autofocus_btn.clicked.connect(self.startAutofocus)
+        self.autofocus_label = QLabel("")
+        self.autofocus_label.setStyleSheet("color: gray;")
+        autofocus_row.addWidget(self.autofocus_btn)
+        autofocus_row.addWidget(self.autofocus_label)
+        autofocus_row.addStretch()
+        layout.addLayout(autofocus_row)
+        self.disabled_widgets.append(self.autofocus_btn)
+        scan_row = QHBoxLayout()
+        scan_label = QLabel("Scan Region:")
+        self.scan_fields = []
+        for placeholder in ["x0", "y0", "x1", "y1"]:
+            field = QLineEdit()
+            field.setPlaceholderText(placeholder)
+            field.setFixedWidth(60)
+            self.scan_fields.append(field)
+        self.scan_btn = QPushButton("Scan")
+        self.scan_btn.setFixedWidth(80)
+        self.scan_btn.clicked.connect(self.toggleMosaicScan)
+        scan_row.addWidget(scan_label)
+        for field in self.scan_fields:
+            scan_row.addWidget(field)
+        scan_row.addWidget(self.scan_btn)
+        scan_row.addStretch()
+        layout.addLayout(scan_row)
+        self.scan_status_label = QLabel("")
+        self.scan_status_label.setStyleSheet("color: gray;")
+        layout.addWidget(self.scan_status_label)
+        self.disabled_widgets.append(self.scan_btn)
+        overview_row = QHBoxLayout()
+        overview_label = QLabel("Chip Map (double-click to move):")
+        self.fit_overview_btn = QPushButton("Fit")
+        self.fit_overview_btn.setFixedWidth(60)
+        overview_row.addWidget(overview_label)
+        overview_row.addWidget(self.fit_overview_btn)
+        overview_row.addStretch()
+        layout.addLayout(overview_row)
+        self.chipMap = TilePyramid("Mosaic") if os.path.exists(os.path.join("Mosaic", "pyramid.json")) else None # Created by the first scan, see chipMapPyramid
+        self.mosaic_overview = MosaicOverview(self.chipMap, pixelSize=self.pixel_size)
+        self.mosaic_overview.setFixedHeight(300)
+        self.mosaic_overview.positionRequested.connect(self.moveToOverviewPosition)
+        self.fit_overview_btn.clicked.connect(self.mosaic_overview.fitToContent)
+        layout.addWidget(self.mosaic_overview)
+        QtCore.QTimer.singleShot(0, self.mosaic_overview.fitToContent)
         layout.addStretch(5)
 
 
@@ -622,8 +875,9 @@ class MainWindow(QWidget):
     def updateDesignItems(self):
         self.designItems = self.cameraView.imageLabel.designItems
         if self.cameraView.imageLabel.goToCoordinates != self.controller.currentPosition and self.cameraView.imageLabel.orderedMoving:
-            instruction = f"line;{self.controller.currentPosition[0]};{self.controller.currentPosition[1]};{self.cameraView.imageLabel.goToCoordinates[0]};{self.cameraView.imageLabel.goToCoordinates[1]}"
-            self.performDesign([instruction], False)
+            if not self.startClosedLoopMove(*self.cameraView.imageLabel.goToCoordinates[:2]):
+                instruction = f"line;{self.controller.currentPosition[0]};{self.controller.currentPosition[1]};{self.cameraView.imageLabel.goToCoordinates[0]};{self.cameraView.imageLabel.goToCoordinates[1]}"
+                self.performDesign([instruction], False)
             self.cameraView.imageLabel.orderedMoving = False
         self.list_widget.clear()
         for idx, item_str in enumerate(self.designItems, 1):
@@ -699,6 +953,244 @@ class MainWindow(QWidget):
         self.designItems[index] = ";".join(parts)
         self.updateDesignItems()
 
+    def focusWindowBinning(self):
+        try:
+            return max(1, min(8, int(self.binning_input.text())))
+        except ValueError:
+            return 1
+
+    def toggleFocusWindow(self, enabled): # On: camera only streams the region around the design (or a picked window if there is no design)
+        if not enabled:
+            self.cameraView.setFocusWindow(None)
+        elif not self.cameraView.focusOnDesign(binning=self.focusWindowBinning()):
+            self.cameraView.imageLabel.startFocusWindowPicking()
+
+    def setPickedFocusWindow(self, rect):
+        self.cameraView.setFocusWindow(rect, self.focusWindowBinning())
+        self.focus_window_switch.blockSignals(True)
+        self.focus_window_switch.setChecked(True)
+        self.focus_window_switch.setText(self.focus_window_switch.label_on)
+        self.focus_window_switch.blockSignals(False)
+
+    def toggleRecording(self, enabled): # Records the camera stream with stage position and laser state, e.g. for a whole cutting run
+        if not enabled:
+            self.cameraView.stopRecording()
+        elif not self.cameraView.startRecording():
+            self.recordingStopped("")
+
+    def recordingStopped(self, directory): # Also called when the stream restarts with a new frame size
+        self.record_switch.blockSignals(True)
+        self.record_switch.setChecked(False)
+        self.record_switch.setText(self.record_switch.label_off)
+        self.record_switch.blockSignals(False)
+        if directory:
+            self.capture_status_label.setText(f"Recorded {directory}")
+
+    def updateFrameAveraging(self): # Averaged frames would smear: bypassed while the stage moves, restarted after it moved
+        moving = self.controller.status in (ESP301Status.MOVING, ESP301Status.GROUP_MOVING)
+        position = tuple(self.controller.currentPosition)
+        if moving != self.cameraView.frameAverager.hold or position != self.averagedPosition:
+            self.cameraView.setStageMoving(moving)
+        self.averagedPosition = position
+
+    def toggleFlakeDetection(self, enabled): # Live flake outlines in the camera view, scans also detect flakes while enabled
+        if enabled:
+            self.flakeDetector.start()
+            self.cameraView.addFrameConsumer(self.flakeDetector)
+            self.flake_status_label.setText("Starting detection...")
+        else:
+            self.cameraView.removeFrameConsumer(self.flakeDetector)
+            self.cameraView.imageLabel.setFlakes([])
+            self.flake_status_label.setText("")
+
+    def flakesDetected(self, flakes, substrate):
+        if not self.flake_switch.isChecked(): # Result of a frame from before switching off
+            return
+        self.cameraView.imageLabel.setFlakes(flakes)
+        self.flake_status_label.setText(f"{len(flakes)} flakes, substrate level {substrate:.0f}")
+
+    def toggleDriftReadout(self, enabled): # Image shift since zeroing and its rate from frame to frame registration, in stage axes
+        if enabled:
+            self.driftEstimator.reset()
+            self.cameraView.addFrameConsumer(self.driftEstimator)
+            self.driftTimer.start(250)
+        else:
+            self.cameraView.removeFrameConsumer(self.driftEstimator)
+            self.driftTimer.stop()
+            self.drift_status_label.setText("")
+
+    def updateDriftReadout(self):
+        drift = self.driftEstimator.snapshot()
+        if drift["registered"] == 0:
+            self.drift_status_label.setText("No frames registered yet")
+            return
+        speed = (drift["vx_mm_s"]**2 + drift["vy_mm_s"]**2)**0.5
+        text = f"x {drift['x_mm']*1000:+.2f} µm  y {drift['y_mm']*1000:+.2f} µm  {speed*1000:.1f} µm/s"
+        if drift["peak"] < self.driftEstimator.minPeak:
+            text += "  (lost track)"
+        self.drift_status_label.setText(text)
+
+    def startAutofocus(self): # Searches z for the sharpest camera image around the current z, moves run in this thread
+        if self.autofocus is not None or self.mosaicScan is not None or self.closedLoopMove is not None or self.cameraView.acquisition is None:
+            return
+        if not self.controller.connected or self.controller.joystickMode: # The z moves would never be made or be fought by the joystick
+            self.autofocus_label.setText("Autofocus needs the connected stage with the joystick off")
+            return
+        self.autofocusGrabber = FocusFrameGrabber()
+        self.cameraView.addFrameConsumer(self.autofocusGrabber)
+        self.autofocus = AutofocusThread(self.autofocusGrabber, self.controller.currentPosition[2])
+        self.autofocus.moveRequested.connect(lambda z, worker=self.autofocus: self.moveStageFor(worker.moveDone, [(3, z)]))
+        self.autofocus.progress.connect(lambda z, score: self.autofocus_label.setText(f"z = {z:.4f} mm, sharpness {score:.1f}"))
+        self.autofocus.focused.connect(lambda z, score, seconds, moves: self.autofocus_label.setText(f"Focused at z = {z:.4f} mm in {seconds:.1f} s ({moves} moves)"))
+        self.autofocus.failed.connect(lambda message: self.autofocus_label.setText(f"Autofocus failed: {message}"))
+        self.autofocus.finished.connect(self.autofocusFinished)
+        self.autofocus_btn.setEnabled(False)
+        self.autofocus.start()
+
+    def moveStageFor(self, moveDone, moves): # Moves requested by a worker thread: [(axis, position)], moveDone() is called when the stage stopped
+        # setAbsPosition reports READY synchronously (statusUpdate) while the axis commands are sent, e.g. for an axis
+        # that is already at its target or before the controller started moving. The callback is only armed after all
+        # commands were sent and completion is taken from a later status poll
+        self.pendingMoveDone = None
+        self.pendingMoveId += 1
+        for axis, position in moves:
+            self.controller.setAbsPosition(axis, position)
+        self.pendingMoveDone = moveDone
+        QtCore.QTimer.singleShot(200, lambda moveId=self.pendingMoveId: self.pollPendingMove(moveId))
+
+    def pollPendingMove(self, moveId): # Fresh status of the controller, it emits statusUpdate when READY, while moving its position loop does
+        if moveId != self.pendingMoveId or self.pendingMoveDone is None:
+            return
+        if self.controller.status != ESP301Status.MOVING and self.controller.status != ESP301Status.GROUP_MOVING:
+            self.controller.updateStatus()
+
+    def checkPendingMove(self): # The requested move is done once the controller is not moving anymore
+        if self.pendingMoveDone is not None and self.controller.status != ESP301Status.MOVING and self.controller.status != ESP301Status.GROUP_MOVING:
+            moveDone = self.pendingMoveDone
+            self.pendingMoveDone = None
+            moveDone()
+
+    def autofocusFinished(self):
+        self.cameraView.removeFrameConsumer(self.autofocusGrabber)
+        self.autofocus = None
+        self.pendingMoveDone = None
+        self.autofocus_btn.setEnabled(self.controller.connected)
+        self.updateView()
+
+    def chipMapPyramid(self): # Tile pyramid of the chip map, created in Mosaic/ when the first scan starts
+        if self.chipMap is None:
+            self.chipMap = TilePyramid("Mosaic", pixelSize=self.pixel_size)
+            self.mosaic_overview.setPyramid(self.chipMap)
+        return self.chipMap
+
+    def toggleMosaicScan(self): # Tiles the scan region (mm, default 1 x 1 mm around the current position) with camera frames
+        if self.mosaicScan is not None:
+            self.mosaicScan.cancel()
+            return
+        if self.autofocus is not None or self.closedLoopMove is not None or self.cameraView.acquisition is None:
+            return
+        if not self.controller.connected or self.controller.joystickMode: # The tile moves would never be made or be fought by the joystick
+            self.scan_status_label.setText("Scanning needs the connected stage with the joystick off")
+            return
+        if self.cameraView.focusWindow is not None:
+            QMessageBox.warning(self, "Scan", "Switch the focus window off before scanning, tiles are full sensor frames.", QMessageBox.Ok)
+            return
+        x, y = self.controller.currentPosition[0], self.controller.currentPosition[1]
+        defaults = [x - 0.5, y - 0.5, x + 0.5, y + 0.5]
+        try:
+            region = [float(field.text()) if field.text() else default for field, default in zip(self.scan_fields, defaults)]
+        except ValueError:
+            self.scan_status_label.setText("Invalid scan region")
+            return
+        if not all(0 <= value <= 12 for value in region):
+            self.outOfRangeWarning()
+            return
+        pixelSize = self.cameraView.imageLabel.pixel_size
+        tileWidth = self.cameraView.w*self.cameraView.binning*pixelSize
+        tileHeight = self.cameraView.h*self.cameraView.binning*pixelSize
+        positions = scanPositions(*region, tileWidth, tileHeight)
+        metadata = {"region": region, "pixelSize_mm": pixelSize*self.cameraView.binning, "tileWidth_mm": tileWidth, "tileHeight_mm": tileHeight,
+                    "width": self.cameraView.w, "height": self.cameraView.h, "created": time.time()}
+        detector = self.flakeDetector if self.flake_switch.isChecked() else None
+        writer = TileWriterThread(os.path.join("Scans", time.strftime("scan_%Y%m%d_%H%M%S")), metadata, bgr=self.cameraView.bits == 32, pyramid=self.chipMapPyramid(), detector=detector)
+        writer.tileSaved.connect(self.mosaic_overview.refreshBlocks)
+        writer.writeFailed.connect(lambda message: self.scan_status_label.setText(f"Not saved: {message}"))
+        writer.flakesSaved.connect(self.mosaicFlakesSaved)
+        if detector is not None:
+            self.mosaic_overview.setFlakes([])
+            detector.tileFlakesDetected.connect(self.mosaicTileFlakes)
+        self.scanGrabber = FrameGrabber()
+        self.cameraView.addFrameConsumer(self.scanGrabber)
+        trigger = self.cameraView.triggerFrame if self.cameraView.setTriggerMode(True) else None
+        self.mosaicScan = MosaicScanThread(positions, self.scanGrabber, trigger, writer)
+        self.mosaicScan.moveRequested.connect(lambda x, y, worker=self.mosaicScan: self.moveStageFor(worker.moveDone, [(1, x), (2, y)]))
+        self.mosaicScan.tileAcquired.connect(lambda index, total, rate: self.scan_status_label.setText(f"Tile {index+1}/{total}, {rate:.2f} tiles/s"))
+        self.mosaicScan.failed.connect(lambda message: self.scan_status_label.setText(f"Scan stopped: {message}"))
+        self.mosaicScan.scanFinished.connect(self.mosaicScanFinished)
+        self.scan_btn.setText("Stop")
+        writer.start()
+        self.mosaicScan.start()
+
+    def mosaicScanFinished(self, directory, tiles, seconds, tilesPerSecond):
+        self.cameraView.removeFrameConsumer(self.scanGrabber)
+        self.cameraView.setTriggerMode(False)
+        self.mosaicScan.wait()
+        self.mosaicScan = None
+        self.pendingMoveDone = None
+        self.scan_btn.setText("Scan")
+        self.scan_status_label.setText(f"{tiles} tiles in {seconds:.1f} s ({tilesPerSecond:.2f} tiles/s), saved to {directory}")
+        self.updateView()
+
+    def mosaicTileFlakes(self, flakes): # Shown while scanning, replaced by the merged list at the end
+        self.mosaic_overview.setFlakes(self.mosaic_overview.flakes + flakes)
+
+    def mosaicFlakesSaved(self, flakes):
+        self.flakeDetector.tileFlakesDetected.disconnect(self.mosaicTileFlakes)
+        self.mosaic_overview.setFlakes(flakes)
+        self.flake_status_label.setText(f"{len(flakes)} flakes in the scan")
+
+    def moveToOverviewPosition(self, x, y): # Double-click on the chip map
+        if self.controller.joystickMode or self.mosaicScan is not None or self.autofocus is not None or self.closedLoopMove is not None:
+            return
+        if not (0 <= x <= 12 and 0 <= y <= 12):
+            self.outOfRangeWarning()
+            return
+        if self.startClosedLoopMove(x, y):
+            return
+        self.controller.setAbsPosition(1, x)
+        self.controller.setAbsPosition(2, y)
+        self.updateView()
+
+    def startClosedLoopMove(self, x, y): # Go-to move with one camera based correction, False if closed-loop moves are off or not possible
+        if not self.closed_loop_switch.isChecked() or self.closedLoopMove is not None or self.cameraView.acquisition is None:
+            return False
+        if self.autofocus is not None or self.mosaicScan is not None or not self.controller.connected:
+            return False
+        self.closedLoopGrabber = FrameGrabber()
+        self.cameraView.addFrameConsumer(self.closedLoopGrabber)
+        self.closedLoopMove = ClosedLoopMoveThread((x, y), self.closedLoopGrabber, self.cameraView.frameToStage,
+                                                   lambda: (self.controller.currentPosition[0], self.controller.currentPosition[1]),
+                                                   chipMap=self.chipMap, logPath=os.path.join("Logs", "position_corrections.csv"))
+        self.closedLoopMove.moveRequested.connect(lambda x, y, worker=self.closedLoopMove: self.moveStageFor(worker.moveDone, [(1, x), (2, y)]))
+        self.closedLoopMove.moveCorrected.connect(self.closedLoopMoveCorrected)
+        self.closedLoopMove.failed.connect(lambda message: self.closed_loop_status_label.setText(f"Not corrected: {message}"))
+        self.closedLoopMove.finished.connect(self.closedLoopMoveFinished)
+        self.closed_loop_status_label.setText("Moving...")
+        self.closedLoopMove.start()
+        return True
+
+    def closedLoopMoveCorrected(self, record):
+        text = f"Error {record['error_x_um']:+.2f}, {record['error_y_um']:+.2f} µm"
+        if record["corrected"]:
+            text += f", after correction {record['residual_x_um']:+.2f}, {record['residual_y_um']:+.2f} µm"
+        self.closed_loop_status_label.setText(text)
+
+    def closedLoopMoveFinished(self):
+        self.cameraView.removeFrameConsumer(self.closedLoopGrabber)
+        self.closedLoopMove = None
+        self.pendingMoveDone = None
+        self.updateView()
+
     def outOfRangeWarning(self):
         QMessageBox.warning(self, "ATTENTION!",
                                          "CONTROLLER OUT OF RANGE!\n\nYou are trying to move the controller out of range. Remember the position range are following:\n\nx-Axis: 0mm -> 12mm \n\ny-Axis: 0mm -> 12mm\n\nz-Axis: 0mm -> 10mm", QMessageBox.Ok, QMessageBox.Ok)
@@ -717,6 +1209,9 @@ class MainWindow(QWidget):
             self.zMotorBLOffsetInput.setPlaceholderText(f"{self.controller.backlash[2]:.4f}")
             self.cameraView.imageLabel.currentPosition = self.controller.currentPosition
             self.cameraView.imageLabel.designItems = self.designItems
+            fieldWidth = self.cameraView.w*self.cameraView.binning*self.cameraView.imageLabel.pixel_size
+            fieldHeight = self.cameraView.h*self.cameraView.binning*self.cameraView.imageLabel.pixel_size
+            self.mosaic_overview.setStagePosition(self.controller.currentPosition[0], self.controller.currentPosition[1], fieldWidth, fieldHeight)
             for name in self.group_card_names[1:3]:
                 self.input_fields_by_name[name][0].setPlaceholderText(f"{self.controller.currentPosition[0]:.4f}")
                 self.input_fields_by_name[name][1].setPlaceholderText(f"{self.controller.currentPosition[1]:.4f}")
@@ -754,10 +1249,16 @@ class MainWindow(QWidget):
                     self.cut_checkbox.setStyleSheet("color: black;")
             if self.controller.status == ESP301Status.OFF:
                 self.motor_switch.setCheckState(False)
+        elif self.controllerConnect is not None:
+            self.status_label.setText(f"Connecting to COM{self.controller.port}...")
+            self.com_input.hide()
+            self.connect_button.setEnabled(False)
         else:
             self.status_label.setText("Connect to controller in COM")
             self.com_input.show()
             self.connect_button.setText("Connect")
+        if self.controllerConnect is None:
+            self.connect_button.setEnabled(True)
         self.velocity_input.setPlaceholderText(str(self.controller.velocity))
         self.accel_input.setPlaceholderText(str(self.controller.acceleration))
         self.setLaserDisabledWidgetState(self.laser.connected)
@@ -789,12 +1290,18 @@ class MainWindow(QWidget):
                 self.cut_checkbox.setEnabled(False)
                 self.cut_checkbox.setStyleSheet("color: gray;") 
                 self.laserSafetyOverlayImage.setHidden(True)      
+        elif self.laserConnect is not None:
+            self.laser_connection_status_label.setText(f"Connecting to COM{self.laser.port}...")
+            self.laser_com_input.hide()
+            self.laser_connect_button.setEnabled(False)
         else:
             self.laser_connection_status_label.setText("Connect to laser in COM")
             self.laser_com_input.show()
             self.laser_connect_button.setText("Connect")
             self.cut_checkbox.setEnabled(False)
             self.cut_checkbox.setStyleSheet("color: gray;")    
+        if self.laserConnect is None:
+            self.laser_connect_button.setEnabled(True)
         self.setDisabledWidgetState(self.controller.connected)
 
     def addDesignShape(self, input_fields, name):
@@ -874,18 +1381,16 @@ class MainWindow(QWidget):
     # --- Button Methods ---
     def toggleComConnection(self):
         if not self.controller.connected:
-            com_port = self.com_input.text().strip()
-            self.controller.__init__(self, com_port)
-            self.updateView()
+            self.controller.__init__(self) # Starts over disconnected
+            self.connectController(self.com_input.text().strip())
         else:
             self.controller.disconnect()
             self.updateView()
 
     def toggleLaserComConnection(self):
         if not self.laser.connected:
-            laser_com_port = self.laser_com_input.text().strip()
-            self.laser.__init__(self, laser_com_port)
-            self.updateView()
+            self.laser.__init__(self)
+            self.connectLaser(self.laser_com_input.text().strip())
         else:
             self.laser.disconnect()
             self.updateView()
@@ -898,10 +1403,27 @@ class MainWindow(QWidget):
             self.response_label.setText(response)
             self.command_input.setText("")
 
+    def closeEvent(self, event): # Stop the worker and camera acquisition threads before the window is destroyed
+        for connect in (self.controllerConnect, self.laserConnect): # A serial handshake still running is finished first
+            if connect is not None:
+                connect.wait()
+        if self.mosaicScan is not None:
+            self.mosaicScan.stop()
+        if self.autofocus is not None:
+            self.autofocus.stop()
+        if self.closedLoopMove is not None:
+            self.closedLoopMove.stop()
+        self.flakeDetector.stop()
+        self.cameraView.close()
+
 
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    win = MainWindow()
+    if "--simulate-camera" in sys.argv: # Synthetic frames instead of the AmScope camera
+        from SimulatedCamera import SimulatedAmcam
+        win = MainWindow(cameraClass=SimulatedAmcam)
+    else:
+        win = MainWindow()
     win.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,47 @@
+import numpy as np
+from DesignGeometry import DesignGeometry
+from ViewTransform import ViewTransform
+
+ITEMS = [
+    "rect;1;2;3;2;3;1;1;1;15.0;20",
+    "line;0;0;1;1",
+    "arc;1;1;2;2", # Not a corner shape
+    "del_rect;4;5;6;5;6;4;4;4;0.0",
+    "rect;1;2;3", # Broken
+    "quadr;0;0;1;0;1.2;-1;-0.2;-1",
+    "rect;7;8;9;8;9;7;7;7;0.0;x", # Broken del size
+]
+
+
+def test_parse_counts_and_views():
+    design = DesignGeometry(ITEMS)
+    assert design.counts == {"rect": 1, "del_rect": 1, "quadr": 1, "line": 1}
+    assert design.vertices.shape == (4 + 4 + 4 + 2, 2)
+    np.testing.assert_array_equal(design.points["rect"][0], [[1, 2], [3, 2], [3, 1], [1, 1]])
+    np.testing.assert_array_equal(design.points["line"][0], [[0, 0], [1, 1]])
+    np.testing.assert_array_equal(design.rotations["rect"], [15.0])
+    np.testing.assert_array_equal(design.delSizes, [20])
+    assert np.shares_memory(design.points["quadr"], design.vertices)
+
+
+def test_split_of_transformed_vertices():
+    design = DesignGeometry(ITEMS)
+    transform = ViewTransform((2.0, 2.0), 0.01, (100, 100))
+    views = design.split(transform.toView(design.vertices))
+    for kind, corners in DesignGeometry.CORNERS.items():
+        np.testing.assert_allclose(views[kind], transform.toView(design.points[kind]))
+        assert views[kind].shape == (design.counts[kind], corners, 2)
+
+
+def test_matches_and_copy_of_items():
+    items = list(ITEMS)
+    design = DesignGeometry(items)
+    assert design.matches(items)
+    items.append("line;0;0;2;2")
+    assert not design.matches(items)
+
+
+def test_empty_design():
+    design = DesignGeometry([])
+    assert design.vertices.shape == (0, 2)
+    assert all(design.points[kind].shape == (0, corners, 2) for kind, corners in DesignGeometry.CORNERS.items())
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from FrameAveraging import FrameAverager
+from FrameContrast import ContrastStretch
+from CameraAcquisition import frameFilterChain
+
+
+def test_averager_converges_and_reduces_noise():
+    rng = np.random.default_rng(0)
+    averager = FrameAverager(frames=8)
+    assert averager.frames() == 8
+    truth = np.full((64, 96), 120, dtype=np.uint8)
+    last = None
+    for i in range(60):
+        frame = np.clip(truth + rng.normal(0, 10, truth.shape), 0, 255).astype(np.uint8)
+        averager(frame)
+        last = frame
+    assert abs(float(last.mean()) - 120) < 2
+    assert last.std() < 6 # About 10/sqrt(2*8 - 1) for an exponential average
+
+
+def test_averager_reset_and_hold_pass_the_frame():
+    averager = FrameAverager(frames=4)
+    averager(np.full((4, 4), 200, dtype=np.uint8))
+    frame = np.full((4, 4), 0, dtype=np.uint8)
+    averager(frame)
+    assert (frame > 0).all() # Averaged with the first frame
+    averager.reset()
+    frame = np.full((4, 4), 10, dtype=np.uint8)
+    averager(frame)
+    assert (frame == 10).all()
+    averager.hold = True
+    frame = np.full((4, 4), 90, dtype=np.uint8)
+    averager(frame)
+    assert (frame == 90).all()
+    averager.hold = False
+    frame = np.full((4, 4), 30, dtype=np.uint8)
+    averager(frame)
+    assert (frame == 30).all() # Restarted after the hold
+    averager(np.full((2, 3), 50, dtype=np.uint8)) # New frame size
+
+
+def test_filter_chain_runs_in_order():
+    calls = []
+    assert frameFilterChain([]) is None
+    single = lambda buf: calls.append("single")
+    assert frameFilterChain([single]) is single
+    chain = frameFilterChain([lambda buf: calls.append(1), lambda buf: calls.append(2)])
+    chain(None)
+    assert calls == [1, 2]
+
+
+@pytest.mark.parametrize("channels", [3, 4])
+def test_contrast_stretch_matches_the_channel_tables(channels):
+    width, height, padding = 200, 150, 8 # Rows of the frame buffers are padded like the camera stride
+    rng = np.random.default_rng(channels)
+    buf = np.zeros((height, width*channels + padding), dtype=np.uint8)
+    pixels = buf[:, :width*channels].reshape(height, width, channels)
+    pixels[...] = rng.integers(60, 140, (height, width, channels))
+    out = np.zeros_like(buf)
+    stretch = ContrastStretch(subsample=2)
+    stretch(buf, out, width, height, channels)
+    tables = stretch.channelTables(stretch.levels, channels)
+    expected = np.stack([tables[channel][pixels[:, :, channel]] for channel in range(channels)], axis=-1)
+    np.testing.assert_array_equal(out[:, :width*channels].reshape(height, width, channels), expected)
+    assert not out[:, width*channels:].any() # Padding is not written
+    assert (buf[:, :width*channels] >= 60).all() # The frame itself is kept
+    if channels == 4:
+        np.testing.assert_array_equal(expected[:, :, 3], pixels[:, :, 3]) # X byte passes unchanged
+    mapped = out[:, :width*channels].reshape(height, width, channels)[:, :, :3]
+    assert mapped.min() == 0 and mapped.max() == 255
+
+
+def test_contrast_levels_follow_the_interval():
+    width, height = 64, 64
+    buf = np.full((height, width*4), 100, dtype=np.uint8)
+    out = np.empty_like(buf)
+    stretch = ContrastStretch(interval=3, subsample=1, minRange=16)
+    stretch(buf, out, width, height, 4)
+    assert stretch.levels == [(92, 108)]*3 # Flat frame: spread around its middle
+    buf[:] = 200
+    stretch(buf, out, width, height, 4)
+    assert stretch.levels == [(92, 108)]*3
+    stretch(buf, out, width, height, 4)
+    stretch(buf, out, width, height, 4)
+    assert stretch.levels == [(192, 208)]*3
@@ -0,0 +1,48 @@
+from CameraAcquisition import FrameRingBuffer
+
+
+def writeFrame(ring, seq):
+    index, pointer = ring.acquireWriteSlot()
+    ring.buffers[index][0, 0] = seq
+    ring.setFrameInfo(index, seq, seq*1000, 0.0)
+    return ring.publish(index), index
+
+
+def test_every_frame_taken_is_displayed():
+    ring = FrameRingBuffer(4, 2, 8)
+    for seq in range(10):
+        notify, index = writeFrame(ring, seq)
+        assert notify
+        taken, buf = ring.takeLatest()
+        assert taken == index and buf[0, 0] == seq and ring.frameInfo(taken)[0] == seq
+        ring.release(taken)
+    assert ring.counters() == {"pulled": 10, "displayed": 10, "dropped": 0}
+
+
+def test_frames_not_taken_are_dropped_and_notified_once():
+    ring = FrameRingBuffer(3, 2, 8)
+    notifications = [writeFrame(ring, seq)[0] for seq in range(5)]
+    assert notifications == [True, False, False, False, False] # One notification until the UI takes the newest frame
+    index, buf = ring.takeLatest()
+    assert buf[0, 0] == 4
+    assert ring.takeLatest() is None
+    assert ring.counters() == {"pulled": 5, "displayed": 1, "dropped": 4}
+    ring.resetCounters()
+    assert ring.counters() == {"pulled": 0, "displayed": 0, "dropped": 0}
+
+
+def test_writer_skips_the_published_and_the_displayed_slot():
+    ring = FrameRingBuffer(2, 2, 8) # At least three slots
+    assert len(ring.buffers) == 3
+    writeFrame(ring, 1)
+    reading, buf = ring.takeLatest() # Held by the UI
+    notify, published = writeFrame(ring, 2)
+    for seq in range(3, 20):
+        index, pointer = ring.acquireWriteSlot()
+        assert index not in (reading, published)
+        ring.setFrameInfo(index, seq, 0, 0.0)
+        published = index
+        ring.publish(index)
+    assert buf[0, 0] == 1 # The displayed frame was never overwritten
+    ring.release(reading)
+    assert ring.readingIndex == -1
@@ -0,0 +1,63 @@
+import errno
+from collections import namedtuple
+import numpy as np
+import pytest
+import MosaicStore
+from MosaicStore import TilePyramid
+
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+
+def tile(height=300, width=400, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def test_patch_returns_the_tile(tmp_path):
+    pyramid = TilePyramid(str(tmp_path/"Mosaic"), pixelSize=0.001, blockSize=64, levels=4)
+    rgb = tile()
+    pyramid.addTile(rgb, 6.0, 6.0)
+    np.testing.assert_array_equal(pyramid.patch(6.0, 6.0, 100), rgb[100:200, 150:250])
+    assert pyramid.patch(6.0 + 0.4, 6.0, 100) is None # Half outside of the scanned tile
+    assert pyramid.patch(0.0, 12.0, 10) is None # Beyond the stage range
+
+
+def test_levels_are_averaged_and_marked_changed(tmp_path):
+    pyramid = TilePyramid(str(tmp_path/"Mosaic"), pixelSize=0.001, blockSize=64, levels=3)
+    pyramid.addTile(np.full((128, 128, 3), 100, dtype=np.uint8), 0.064, 12.0 - 0.064) # Exactly blocks (0..1, 0..1) of level 0
+    assert {(level, bx, by) for level, bx, by in pyramid.takeChangedBlocks()} == \
+        {(0, 0, 0), (0, 1, 0), (0, 0, 1), (0, 1, 1), (1, 0, 0), (2, 0, 0)}
+    assert pyramid.takeChangedBlocks() == set()
+    assert (pyramid.block(1, 0, 0) == 100).all() # The 2 x 2 children at half resolution
+    level2 = pyramid.block(2, 0, 0)
+    assert (level2[:32, :32] == 100).all() and (level2[32:] == 0).all() and (level2[:, 32:] == 0).all()
+    assert pyramid.block(0, 5, 5) is None
+    np.testing.assert_allclose(pyramid.bounds(), (0.0, 12.0 - 0.128, 0.128, 12.0))
+
+
+def test_resampled_tile(tmp_path):
+    pyramid = TilePyramid(str(tmp_path/"Mosaic"), pixelSize=0.001, blockSize=64, levels=2)
+    pyramid.addTile(np.full((100, 100, 3), 7, dtype=np.uint8), 6.0, 6.0, pixelSize=0.002) # Twice the pyramid pixel size
+    assert (pyramid.patch(6.0, 6.0, 190) == 7).all()
+
+
+def test_reopen_keeps_geometry_and_blocks(tmp_path):
+    directory = str(tmp_path/"Mosaic")
+    pyramid = TilePyramid(directory, pixelSize=0.001, blockSize=64, levels=3)
+    rgb = tile(seed=3)
+    pyramid.addTile(rgb, 3.0, 4.0)
+    pyramid.save()
+    reopened = TilePyramid(directory, pixelSize=0.5, blockSize=16, levels=7) # The stored header wins
+    assert (reopened.pixelSize, reopened.blockSize, reopened.levels) == (0.001, 64, 3)
+    np.testing.assert_array_equal(reopened.patch(3.0, 4.0, 64), pyramid.patch(3.0, 4.0, 64))
+
+
+def test_growth_checks_the_free_disk_space(tmp_path, monkeypatch):
+    pyramid = TilePyramid(str(tmp_path/"Mosaic"), pixelSize=0.001, blockSize=64, levels=2, growBlocks=64)
+    pyramid.addTile(tile(64, 64), 1.0, 1.0)
+    blocks = len(pyramid.index[0])
+    monkeypatch.setattr(MosaicStore.shutil, "disk_usage", lambda path: DiskUsage(1 << 30, 1 << 30, 0)) # Disk full
+    with pytest.raises(OSError) as error:
+        for i in range(200): # More blocks than the first 64 slots
+            pyramid.addTile(tile(64, 64), 1.0 + 0.07*(i % 14), 2.0 + 0.07*(i//14))
+    assert error.value.errno == errno.ENOSPC
+    assert len(pyramid.index[0]) >= blocks and pyramid.capacity[0] == 64
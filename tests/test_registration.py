@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from Registration import FrameSpectrum, phaseCorrelation, subpixelOffset
+
+
+def texture(size, seed=0): # Smooth random structure, band limited so that sub-pixel shifts are well defined
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft2(rng.normal(size=(size, size)))
+    fy = np.fft.fftfreq(size)[:, None]
+    fx = np.fft.rfftfreq(size)[None, :]
+    spectrum *= np.exp(-(fx**2 + fy**2)/(2*0.08**2))
+    return spectrum
+
+
+def shifted(spectrum, size, dx, dy): # Image of spectrum with its content moved by dx, dy pixels (periodic)
+    fy = np.fft.fftfreq(size)[:, None]
+    fx = np.fft.rfftfreq(size)[None, :]
+    image = np.fft.irfft2(spectrum*np.exp(-2j*np.pi*(fx*dx + fy*dy)), s=(size, size))
+    return ((image - image.min())/(image.max() - image.min())*200 + 20).astype(np.float32)
+
+
+@pytest.mark.parametrize("dx, dy", [(0.0, 0.0), (3.3, -5.6), (-12.7, 8.25), (0.5, 0.5)])
+def test_subpixel_shift(dx, dy):
+    size = 512
+    spectrum = texture(size)
+    frameSpectrum = FrameSpectrum(size=128, downsample=2)
+    reference = frameSpectrum.fromGray(shifted(spectrum, size, 0, 0))
+    frame = frameSpectrum.fromGray(shifted(spectrum, size, dx, dy))
+    foundX, foundY, peak = phaseCorrelation(reference, frame)
+    assert foundX == pytest.approx(dx/2, abs=0.05) # Spectrum pixels are downsampled by 2
+    assert foundY == pytest.approx(dy/2, abs=0.05)
+    assert peak > 0.2
+
+
+def test_unrelated_images_correlate_weakly():
+    size = 256
+    frameSpectrum = FrameSpectrum(size=128, downsample=2)
+    reference = frameSpectrum.fromGray(shifted(texture(size, 1), size, 0, 0))
+    frame = frameSpectrum.fromGray(shifted(texture(size, 2), size, 0, 0))
+    assert phaseCorrelation(reference, frame)[2] < 0.05
+
+
+def test_crop_outside_of_the_image():
+    frameSpectrum = FrameSpectrum(size=64, downsample=4)
+    image = np.zeros((200, 300), dtype=np.float32)
+    assert frameSpectrum.crop(image) is None # 256 pixels do not fit into 200 rows
+    assert frameSpectrum.fromGray(np.zeros((300, 300), dtype=np.float32), center=(10, 150)) is None
+
+
+def test_subpixel_offset_from_larger_neighbour():
+    assert subpixelOffset(0.0, 1.0, 1.0) == pytest.approx(0.5)
+    assert subpixelOffset(1.0, 1.0, 0.0) == pytest.approx(-0.5)
+    assert subpixelOffset(-0.1, 1.0, -0.2) == 0.0
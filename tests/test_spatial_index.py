@@ -0,0 +1,59 @@
+import numpy as np
+from SpatialIndex import GridIndex
+
+
+def linearScan(boxes, box): # What the index must return: every box overlapping box, edges included
+    x1, y1, x2, y2 = box
+    return {key for key, (bx1, by1, bx2, by2) in boxes.items() if bx1 <= x2 and x1 <= bx2 and by1 <= y2 and y1 <= by2}
+
+
+def randomBoxes(rng, count, extent=1000, maxSize=120):
+    boxes = {}
+    for key in range(count):
+        x, y = rng.uniform(-50, extent, 2)
+        w, h = rng.uniform(0, maxSize, 2)
+        boxes[key] = (x, y, x + w, y + h)
+    return boxes
+
+
+def test_query_matches_linear_scan():
+    rng = np.random.default_rng(1)
+    boxes = randomBoxes(rng, 500)
+    index = GridIndex(cellSize=64)
+    for key, box in boxes.items():
+        index.insert(key, box)
+    assert len(index) == len(boxes)
+    for x, y, w, h in rng.uniform(-100, 1100, (200, 4)):
+        box = (x, y, x + abs(w)/10, y + abs(h)/10)
+        assert set(index.query(box)) == linearScan(boxes, box)
+
+
+def test_query_point_includes_edges():
+    index = GridIndex(cellSize=10)
+    index.insert("a", (0, 0, 10, 10))
+    index.insert("b", (10, 10, 20, 20))
+    assert set(index.queryPoint(10, 10)) == {"a", "b"}
+    assert index.queryPoint(5, 5) == ["a"]
+    assert index.queryPoint(25, 25) == []
+
+
+def test_insert_moves_and_remove_forgets():
+    rng = np.random.default_rng(2)
+    boxes = randomBoxes(rng, 200)
+    index = GridIndex(cellSize=32)
+    for key, box in boxes.items():
+        index.insert(key, box)
+    for key in range(0, 200, 3): # Edited shapes
+        x, y = rng.uniform(0, 1000, 2)
+        boxes[key] = (x, y, x + 5, y + 5)
+        index.insert(key, boxes[key])
+    for key in range(1, 200, 7): # Deleted shapes
+        del boxes[key]
+        index.remove(key)
+    index.remove("unknown")
+    assert len(index) == len(boxes)
+    assert set(index.query((-100, -100, 1200, 1200))) == set(boxes)
+    for x, y in rng.uniform(0, 1000, (200, 2)):
+        assert set(index.queryPoint(x, y)) == linearScan(boxes, (x, y, x, y))
+    index.clear()
+    assert len(index) == 0 and index.cells == {}
@@ -0,0 +1,44 @@
+import json
+import struct
+import numpy as np
+from StillCapture import writeTiff
+
+
+def readTiff(path): # Tags of the first IFD and the RGB pixels of the single strip writeTiff writes
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[:4] == b"II*\0"
+    offset = struct.unpack_from("<I", data, 4)[0]
+    count = struct.unpack_from("<H", data, offset)[0]
+    tags = {}
+    for i in range(count):
+        tag, kind, values, value = struct.unpack_from("<HHII", data, offset + 2 + 12*i)
+        if kind == 3 and values == 1:
+            value &= 0xffff
+        tags[tag] = (kind, values, value)
+    width, height = tags[256][2], tags[257][2]
+    strip = data[tags[273][2]:tags[273][2] + tags[279][2]]
+    return tags, data, np.frombuffer(strip, dtype=np.uint8).reshape(height, width, 3)
+
+
+def test_tiff_round_trip(tmp_path):
+    rgb = np.random.default_rng(0).integers(0, 256, (31, 47, 4), dtype=np.uint8) # Odd sizes, a fourth channel is dropped
+    metadata = {"exposure_us": 20000, "stage_mm": [6.5, 7.2, 1.0], "note": "µm"}
+    path = str(tmp_path/"still.tiff")
+    writeTiff(path, rgb, json.dumps(metadata))
+    tags, data, pixels = readTiff(path)
+    np.testing.assert_array_equal(pixels, rgb[:, :, :3])
+    assert tags[259][2] == 1 and tags[262][2] == 2 and tags[277][2] == 3 # Uncompressed RGB
+    assert tags[273][2] % 2 == 0 # Word aligned strip
+    assert struct.unpack_from("<HHH", data, tags[258][2]) == (8, 8, 8)
+    kind, length, offset = tags[270]
+    assert json.loads(data[offset:offset + length - 1].decode("utf-8")) == metadata
+    assert len(data) == tags[273][2] + 31*47*3
+
+
+def test_tiff_of_a_strided_view(tmp_path):
+    frame = np.random.default_rng(1).integers(0, 256, (20, 64*3 + 4), dtype=np.uint8) # Rows with padding like the camera buffers
+    rgb = frame[:, :64*3].reshape(20, 64, 3)
+    path = str(tmp_path/"view.tiff")
+    writeTiff(path, rgb)
+    np.testing.assert_array_equal(readTiff(path)[2], rgb)
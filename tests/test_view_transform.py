@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from ViewTransform import ViewTransform, rotateAround
+
+
+@pytest.mark.parametrize("rotation", [0.0, 1.5, -30.0, 90.0])
+@pytest.mark.parametrize("flip", [(False, True), (True, False), (False, False)])
+def test_round_trip(rotation, flip):
+    transform = ViewTransform((6.5, 7.2, 1.0), 0.000087*1.28, (680, 510), rotation, flip)
+    points = np.random.default_rng(0).uniform(6.4, 6.6, (5, 4, 2))
+    pixels = transform.toView(points)
+    assert pixels.shape == points.shape
+    np.testing.assert_allclose(transform.toStage(pixels), points, atol=1e-12)
+
+
+def test_position_maps_to_center_and_y_is_flipped():
+    scale = 0.001
+    transform = ViewTransform((6.0, 7.0), scale, (400, 300))
+    np.testing.assert_allclose(transform.toView((6.0, 7.0)), (400, 300))
+    np.testing.assert_allclose(transform.toView((6.0 + 10*scale, 7.0 + 20*scale)), (410, 280)) # Stage y up, pixel y down
+    np.testing.assert_allclose(transform.toStage((400, 300)), (6.0, 7.0))
+
+
+def test_rotate_around_quarter_turn():
+    points = np.array([[[1.0, 0.0], [2.0, 0.0]], [[0.0, 5.0], [0.0, 6.0]]])
+    centers = np.array([[0.0, 0.0], [0.0, 5.0]])
+    rotated = rotateAround(points, centers, np.array([90.0, 0.0]))
+    np.testing.assert_allclose(rotated[0], [[0.0, 1.0], [0.0, 2.0]], atol=1e-12) # Clockwise on screen, y pointing down
+    np.testing.assert_allclose(rotated[1], points[1])